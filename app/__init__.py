@@ -3,7 +3,8 @@ Fábrica de la aplicación Flask (Application Factory).
 Configura extensiones, CORS y Blueprints.
 """
 import os
-from flask import Flask
+from datetime import timedelta
+from flask import Flask, jsonify
 from dotenv import load_dotenv
 import stripe
 from sqlalchemy import text
@@ -19,8 +20,21 @@ from .routes.montador_routes import montador_bp
 from .routes.outlet_routes import outlet_bp
 from .routes.order_routes import order_bp
 from .routes.public_routes import public_bp
+from .routes.eventos_routes import eventos_bp
+from .routes.chat_routes import chat_bp
 
 from .webhooks import webhooks_bp
+from .email_worker import email_worker
+from .password_service import HashingSaturado, PASSWORD_HASH_REINTENTO_SEGUNDOS
+from . import identity_service, token_service, code_store
+from .event_hub import comprobar_backend
+# Registra los eventos del ORM que precalculan la zona y coordenadas de cada
+# trabajo, mantienen los contadores por usuario/estado y las partidas presupuestadas,
+# y anuncian los cambios por SSE
+from . import (  # pylint: disable=unused-import
+    zonas, geo, contadores, trabajo_items, trabajo_estados
+)
+from .cli import mantenimiento_cli
 
 
 def create_app():
@@ -42,6 +56,13 @@ def create_app():
 
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "dev-secret")
+    # Access token corto + refresh token largo (renovación en /api/auth/refresh)
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(
+        minutes=int(os.getenv("JWT_ACCESS_MINUTOS", "15"))
+    )
+    app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(
+        days=int(os.getenv("JWT_REFRESH_DIAS", "30"))
+    )
 
     # Configuración Stripe
     stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
@@ -103,10 +124,209 @@ def create_app():
                 except Exception:  # pylint: disable=broad-exception-caught
                     pass
 
+                # 4. ARREGLAR TABLA EMAIL_OUTBOX (Coalescencia de envíos)
+                try:
+                    conn.execute(text(
+                        "ALTER TABLE email_outbox ADD COLUMN IF NOT EXISTS "
+                        "clave_coalescencia VARCHAR(200)"
+                    ))
+                    conn.execute(text(
+                        "CREATE INDEX IF NOT EXISTS ix_email_outbox_clave_coalescencia "
+                        "ON email_outbox (clave_coalescencia)"
+                    ))
+                    conn.commit()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    conn.rollback()
+
+                # 5. RELLENAR ÍNDICE DE IDENTIDAD (usuarios anteriores a la tabla)
+                try:
+                    for tabla, rol in (('cliente', 'cliente'), ('montador', 'montador')):
+                        conn.execute(text(
+                            "INSERT INTO identidad (email_normalizado, rol, usuario_id) "
+                            f"SELECT lower(trim(u.email)), '{rol}', MIN(u.id) FROM {tabla} u "
+                            "WHERE NOT EXISTS (SELECT 1 FROM identidad i "
+                            "WHERE i.email_normalizado = lower(trim(u.email))) "
+                            "GROUP BY lower(trim(u.email))"
+                        ))
+                    conn.commit()
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    conn.rollback()
+                    print(f"⚠️ Nota DB Patch (identidad): {e}")
+
+                # 6. ÍNDICE DE CADUCIDAD EN CÓDIGOS (barrido de caducados)
+                try:
+                    conn.execute(text(
+                        "CREATE INDEX IF NOT EXISTS ix_verification_codes_expires_at "
+                        "ON verification_codes (expires_at)"
+                    ))
+                    conn.commit()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    conn.rollback()
+
+                # 7. ÍNDICE KEYSET DE TRABAJOS (paginación del panel admin)
+                try:
+                    conn.execute(text(
+                        "CREATE INDEX IF NOT EXISTS ix_trabajo_fecha_creacion_id "
+                        "ON trabajo (fecha_creacion, id)"
+                    ))
+                    conn.commit()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    conn.rollback()
+
+                # 8. ÍNDICES DEL DIRECTORIO ADMIN (fecha de registro y búsqueda por prefijo)
+                try:
+                    for tabla in ('cliente', 'montador'):
+                        conn.execute(text(
+                            f"CREATE INDEX IF NOT EXISTS ix_{tabla}_fecha_registro "
+                            f"ON {tabla} (fecha_registro)"
+                        ))
+                        # LIKE 'prefijo%' sobre lower(...) usa el índice en Postgres
+                        if conn.dialect.name == 'postgresql':
+                            for columna in ('email', 'nombre'):
+                                conn.execute(text(
+                                    f"CREATE INDEX IF NOT EXISTS ix_{tabla}_{columna}_prefijo "
+                                    f"ON {tabla} (lower({columna}) text_pattern_ops)"
+                                ))
+                    conn.commit()
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    conn.rollback()
+                    print(f"⚠️ Nota DB Patch (índices directorio): {e}")
+
+                # 9. COLUMNA updated_at (ETags) + relleno inicial
+                try:
+                    for tabla, origen in (
+                        ('trabajo', 'fecha_creacion'), ('product', 'fecha_creacion'),
+                        ('cliente', 'fecha_registro'), ('montador', 'fecha_registro')
+                    ):
+                        conn.execute(text(
+                            f"ALTER TABLE {tabla} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP"
+                        ))
+                        conn.execute(text(
+                            f"UPDATE {tabla} SET updated_at = COALESCE({origen}, CURRENT_TIMESTAMP) "
+                            "WHERE updated_at IS NULL"
+                        ))
+                    conn.commit()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    conn.rollback()
+
+                # 10. ÍNDICES DE SINCRONIZACIÓN INCREMENTAL (?since=)
+                try:
+                    conn.execute(text(
+                        "CREATE INDEX IF NOT EXISTS ix_trabajo_cliente_updated "
+                        "ON trabajo (cliente_id, updated_at)"
+                    ))
+                    conn.execute(text(
+                        "CREATE INDEX IF NOT EXISTS ix_trabajo_montador_updated "
+                        "ON trabajo (montador_id, updated_at)"
+                    ))
+                    conn.commit()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    conn.rollback()
+
+                # 11. FEED DE DISPONIBLES (zona precalculada + índice compuesto)
+                try:
+                    conn.execute(text(
+                        "ALTER TABLE trabajo ADD COLUMN IF NOT EXISTS zona VARCHAR(200)"
+                    ))
+                    conn.execute(text(
+                        "ALTER TABLE trabajo ADD COLUMN IF NOT EXISTS zona_clave VARCHAR(200)"
+                    ))
+                    conn.execute(text(
+                        "CREATE INDEX IF NOT EXISTS ix_trabajo_zona_clave ON trabajo (zona_clave)"
+                    ))
+                    conn.execute(text(
+                        "CREATE INDEX IF NOT EXISTS ix_trabajo_feed "
+                        "ON trabajo (estado, montador_id, fecha_creacion)"
+                    ))
+                    conn.commit()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    conn.rollback()
+
+                # 12. GEOLOCALIZACIÓN (lat/lng/geohash + centro de servicio)
+                try:
+                    for columna in ("lat FLOAT", "lng FLOAT", "geohash VARCHAR(12)"):
+                        conn.execute(text(
+                            f"ALTER TABLE trabajo ADD COLUMN IF NOT EXISTS {columna}"
+                        ))
+                    for columna in ("centro_lat FLOAT", "centro_lng FLOAT", "radio_km FLOAT"):
+                        conn.execute(text(
+                            f"ALTER TABLE montador ADD COLUMN IF NOT EXISTS {columna}"
+                        ))
+                    conn.execute(text(
+                        "CREATE INDEX IF NOT EXISTS ix_trabajo_feed_geohash "
+                        "ON trabajo (estado, montador_id, geohash)"
+                    ))
+                    conn.commit()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    conn.rollback()
+
+                # 13. BONO ÚNICO SOLO PARA 'BONO_REGISTRO' (antes bloqueaba
+                #     cualquier segundo movimiento del mismo tipo, p. ej. comisiones)
+                try:
+                    conn.execute(text(
+                        "CREATE UNIQUE INDEX IF NOT EXISTS uq_wallet_bono_registro "
+                        "ON gem_transaction (wallet_id) WHERE tipo = 'BONO_REGISTRO'"
+                    ))
+                    conn.execute(text(
+                        "ALTER TABLE gem_transaction DROP CONSTRAINT IF EXISTS uq_wallet_tipo_bono"
+                    ))
+                    conn.commit()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    conn.rollback()
+
+                # 14. CONTADORES DE TRABAJOS: carga inicial si la tabla está vacía
+                #     (después los mantienen los eventos; ver app/contadores.py)
+                try:
+                    conn.execute(text(
+                        "INSERT INTO contador_trabajos (rol, usuario_id, estado, total) "
+                        "SELECT rol, usuario_id, estado, total FROM ("
+                        " SELECT 'cliente' AS rol, cliente_id AS usuario_id,"
+                        "  COALESCE(estado, 'cotizacion') AS estado, COUNT(*) AS total"
+                        " FROM trabajo GROUP BY cliente_id, COALESCE(estado, 'cotizacion')"
+                        " UNION ALL"
+                        " SELECT 'montador', montador_id, COALESCE(estado, 'cotizacion'), COUNT(*)"
+                        " FROM trabajo WHERE montador_id IS NOT NULL"
+                        " GROUP BY montador_id, COALESCE(estado, 'cotizacion')"
+                        ") AS conteo WHERE NOT EXISTS (SELECT 1 FROM contador_trabajos)"
+                    ))
+                    conn.commit()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    conn.rollback()
+
+                # 15. TIPO DE TRABAJO Y PRODUCTO OUTLET (antes solo dentro de 'etiquetas')
+                #     Relleno de los antiguos: flask mantenimiento rellenar-outlet
+                try:
+                    conn.execute(text(
+                        "ALTER TABLE trabajo ADD COLUMN IF NOT EXISTS "
+                        "tipo VARCHAR(20) NOT NULL DEFAULT 'montaje'"
+                    ))
+                    conn.execute(text(
+                        "ALTER TABLE trabajo ADD COLUMN IF NOT EXISTS outlet_product_id INTEGER"
+                    ))
+                    conn.execute(text(
+                        "CREATE INDEX IF NOT EXISTS ix_trabajo_tipo ON trabajo (tipo)"
+                    ))
+                    conn.execute(text(
+                        "CREATE INDEX IF NOT EXISTS ix_trabajo_outlet_product_id "
+                        "ON trabajo (outlet_product_id)"
+                    ))
+                    conn.commit()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    conn.rollback()
+
                 print("✅ DB Patch: Todas las columnas verificadas.")
 
         except Exception as e:  # pylint: disable=broad-exception-caught
             print(f"⚠️ Nota DB Patch: {e}")
+
+        # Filtro Bloom de emails registrados (fast path de /check-email)
+        try:
+            identity_service.reconstruir_filtro()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"⚠️ Filtro Bloom no disponible (se creará al primer uso): {e}")
+
+        # Refresh tokens revocados (set en memoria de este proceso)
+        token_service.cargar_revocados()
     # ----------------------------------------------------
 
     # --- CONFIGURACIÓN CORS ---
@@ -120,13 +340,19 @@ def create_app():
         ],
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
         "allow_headers": [
-            "Content-Type", "Authorization", "X-Requested-With", "Cache-Control"
+            "Content-Type", "Authorization", "X-Requested-With", "Cache-Control",
+            "If-None-Match", "Last-Event-ID"
         ],
+        "expose_headers": ["X-Next-Cursor", "X-Sync-Cursor", "Retry-After", "ETag"],
         "supports_credentials": True
     }})
 
     jwt.init_app(app)
     migrate.init_app(app, db)
+    email_worker.init_app(app)
+    code_store.init_app(app)
+    app.cli.add_command(mantenimiento_cli)
+    comprobar_backend()
 
     # --- REGISTRO DE RUTAS ---
     app.register_blueprint(calculator_bp)
@@ -136,6 +362,19 @@ def create_app():
     app.register_blueprint(montador_bp, url_prefix='/api')
     app.register_blueprint(outlet_bp, url_prefix='/api')
     app.register_blueprint(order_bp, url_prefix='/api')
+    app.register_blueprint(eventos_bp, url_prefix='/api')
+    app.register_blueprint(chat_bp, url_prefix='/api')
     app.register_blueprint(webhooks_bp)
 
+    @app.errorhandler(HashingSaturado)
+    def hashing_saturado(_error):
+        """Pool de contraseñas saturado: el cliente reintenta en unos segundos."""
+        respuesta = jsonify({
+            'error': 'Servidor ocupado. Inténtalo de nuevo en unos segundos.',
+            'reintentar_en': PASSWORD_HASH_REINTENTO_SEGUNDOS
+        })
+        respuesta.status_code = 503
+        respuesta.headers['Retry-After'] = str(PASSWORD_HASH_REINTENTO_SEGUNDOS)
+        return respuesta
+
     return app
\ No newline at end of file
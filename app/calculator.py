@@ -18,6 +18,7 @@ from dotenv import load_dotenv
 
 from .storage import upload_image_to_gcs
 from .nlp_engine import get_nlp_model
+from .rate_limiter import limitar
 
 load_dotenv()
 
@@ -127,6 +128,27 @@ TARIFARIO = {
 }
 
 
+def talla_cama(medida):
+    """Agrupa la medida de camas y canapés: 'pequeno' (90/105), 'mediano' o 'grande' (160+)."""
+    medida = str(medida or "mediano").lower()
+    if any(m in medida for m in ["90", "105", "individual", "pequeño", "pequeno"]):
+        return "pequeno"
+    if any(m in medida for m in ["160", "180", "200", "king", "grande"]):
+        return "grande"
+    return "mediano"
+
+
+def variante_mueble(tipo, atributos):
+    """Variante que cambia el precio (talla de cama/canapé, puertas del armario) o None."""
+    atributos = atributos if isinstance(atributos, dict) else {}
+    if tipo in ("canape", "cama"):
+        return talla_cama(atributos.get("medida"))
+    if tipo == "armario":
+        puerta = str(atributos.get("tipo_puerta", "batiente")).lower()
+        return "corredera" if "corredera" in puerta else "batiente"
+    return None
+
+
 # --- CEREBRO IA ESTRICTO (ANTI-VAGOS) ---
 def analizar_con_gemini_estricto(texto_usuario):
     """
@@ -257,6 +279,7 @@ def analizar_con_spacy_basico(descripcion):
 
 # --- RUTA PRINCIPAL ---
 @calculator_bp.route('/calcular_presupuesto', methods=['POST'])
+@limitar('calcular-presupuesto', por_ip='30/60', por_token='30/60')
 def calcular_presupuesto():
     """
     Endpoint principal para cálculo de presupuestos.
@@ -392,17 +415,14 @@ def calcular_presupuesto():
 
         # B) CANAPÉS Y CAMAS (Lógica de Medidas)
         elif tipo in ["canape", "cama"]:
-            medida = str(attrs.get("medida", "mediano")).lower()
-
             # Clasificación de medidas en 3 grupos
-            es_pequeno = any(m in medida for m in ["90", "105", "individual", "pequeño", "pequeno"])
-            es_grande = any(m in medida for m in ["160", "180", "200", "king", "grande"])
+            talla = talla_cama(attrs.get("medida"))
 
-            if es_pequeno:
+            if talla == "pequeno":
                 descuento = reglas.get("pequeno", -10)
                 precio_unitario += descuento
                 detalles_factura.append("Medida pequeña (90/105): -10€")
-            elif es_grande:
+            elif talla == "grande":
                 suplemento = reglas.get("grande", 20)
                 precio_unitario += suplemento
                 detalles_factura.append("Medida grande/King: +20€")
@@ -415,6 +435,10 @@ def calcular_presupuesto():
 
         muebles_cotizados.append({
             "item": tarifas.get("display_name", {}).get("es", tipo),
+            # Para las partidas consultables (tabla trabajo_item)
+            "tipo": tipo,
+            "variante": variante_mueble(tipo, attrs),
+            "atributos": attrs,
             "cantidad": cantidad,
             "precio_unitario": precio_unitario,
             "subtotal": subtotal
@@ -0,0 +1,156 @@
+"""
+Servicio de chat del Outlet (tablas 'conversacion' y 'mensaje').
+- Un chat por (producto, comprador): se busca por índice único, sin recorrer trabajos.
+- Abrir un chat NO crea ningún Trabajo. La venta solo existe cuando el vendedor
+  la registra (registrar_venta): un Trabajo 'outlet' (trabajo_id) que sigue el
+  ciclo de la venta en efectivo (confirmar-pago -> vendido, cancelar -> disponible).
+- Historial paginado por id (keyset) y entrega en tiempo real por el hub de
+  eventos: el stream SSE de cada participante recibe 'chat_mensaje', y quien no
+  tenga SSE puede hacer long-poll (esperar_mensajes) sobre el canal 'chat:<id>'.
+"""
+import queue
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from .extensions import db
+from .models import Conversacion, Mensaje, Product, Trabajo
+from .event_hub import obtener_hub, encolar
+
+MAX_LONGITUD_MENSAJE = 2000
+ESPERA_MAXIMA_SEGUNDOS = 25  # Por debajo del timeout típico de proxies (30 s)
+
+
+def obtener_o_crear_conversacion(producto, comprador_rol, comprador_id):
+    """Devuelve (conversacion, creada). Seguro ante dos peticiones simultáneas."""
+    filtro = {
+        'product_id': producto.id, 'comprador_id': comprador_id, 'comprador_rol': comprador_rol
+    }
+    conversacion = Conversacion.query.filter_by(**filtro).first()
+    if conversacion:
+        return conversacion, False
+
+    try:
+        with db.session.begin_nested():
+            conversacion = Conversacion(vendedor_id=producto.montador_id, **filtro)
+            db.session.add(conversacion)
+        return conversacion, True
+    except IntegrityError:
+        # Otra petición lo creó entre la búsqueda y el INSERT
+        return Conversacion.query.filter_by(**filtro).one(), False
+
+
+def registrar_venta(conversacion):
+    """
+    El vendedor vende el producto al comprador del chat: reserva el producto y
+    crea el Trabajo 'outlet' de la venta. Solo compradores cliente (el ciclo de
+    la venta vive en las rutas /cliente). Bloquea la fila de la conversación
+    para no crear dos ventas; si ya tiene una en curso, devuelve la misma
+    (una venta cancelada se puede volver a registrar).
+    Lanza ValueError si no se puede vender. NO hace commit.
+    """
+    if conversacion.comprador_rol != 'cliente':
+        raise ValueError('Solo se puede registrar la venta a un cliente')
+
+    conversacion = Conversacion.query.filter_by(id=conversacion.id) \
+        .with_for_update().populate_existing().one()
+    if conversacion.trabajo_id and db.session.query(Trabajo.estado).filter_by(
+        id=conversacion.trabajo_id
+    ).scalar() not in (None, 'cancelado'):
+        return conversacion.trabajo_id
+
+    # Reserva atómica: si dos chats venden a la vez, solo uno la consigue
+    if not Product.query.filter_by(id=conversacion.product_id, estado='disponible').update({
+        Product.estado: 'reservado',
+        Product.cliente_id: conversacion.comprador_id
+    }, synchronize_session=False):
+        raise ValueError('El producto ya no está disponible')
+
+    producto = db.session.get(Product, conversacion.product_id)
+    venta = Trabajo(
+        descripcion=f"Venta Outlet: {producto.titulo}",
+        direccion="Recogida Outlet",
+        precio_calculado=float(producto.precio),
+        cliente_id=conversacion.comprador_id,
+        montador_id=conversacion.vendedor_id,
+        estado='aceptado',
+        metodo_pago='efectivo_gemas',
+        etiquetas={'outlet_product_id': producto.id, 'tipo': 'outlet'},
+        imagenes_urls=producto.imagenes_urls
+    )
+    db.session.add(venta)
+    db.session.flush()
+    conversacion.trabajo_id = venta.id
+    return venta.id
+
+
+def mensaje_a_dict(mensaje):
+    """Formato JSON de un mensaje (API y eventos)."""
+    return {
+        'id': mensaje.id,
+        'conversacion_id': mensaje.conversacion_id,
+        'autor_rol': mensaje.autor_rol,
+        'autor_id': mensaje.autor_id,
+        'texto': mensaje.texto,
+        'created_at': mensaje.created_at.isoformat() if mensaje.created_at else None
+    }
+
+
+def enviar_mensaje(conversacion, autor_rol, autor_id, texto):
+    """
+    Guarda el mensaje y programa su evento para después del commit.
+    Lanza ValueError si el texto está vacío o es demasiado largo. NO hace commit.
+    """
+    texto = (texto or '').strip()
+    if not texto:
+        raise ValueError('El mensaje está vacío')
+    if len(texto) > MAX_LONGITUD_MENSAJE:
+        raise ValueError(f'Máximo {MAX_LONGITUD_MENSAJE} caracteres')
+
+    ahora = datetime.utcnow()
+    mensaje = Mensaje(
+        conversacion_id=conversacion.id, autor_rol=autor_rol, autor_id=autor_id,
+        texto=texto, created_at=ahora
+    )
+    db.session.add(mensaje)
+    conversacion.ultimo_mensaje_at = ahora
+    db.session.flush()
+
+    encolar(db.session, conversacion.canales(), 'chat_mensaje', mensaje_a_dict(mensaje))
+    return mensaje
+
+
+def mensajes_despues(conversacion_id, despues_id, limite):
+    """Mensajes con id > despues_id, en orden (índice conversacion_id, id)."""
+    return Mensaje.query.filter(
+        Mensaje.conversacion_id == conversacion_id, Mensaje.id > despues_id
+    ).order_by(Mensaje.id).limit(limite).all()
+
+
+def esperar_mensajes(conversacion_id, despues_id, limite, espera):
+    """
+    Long-poll: devuelve en cuanto haya mensajes nuevos, o [] tras 'espera' segundos.
+    Se suscribe ANTES de volver a consultar, así no se pierde un mensaje que
+    llegue entre medias. Con varios workers requiere EVENTOS_BACKEND=redis
+    (si no, el cliente simplemente vuelve a preguntar al agotar la espera).
+    """
+    mensajes = mensajes_despues(conversacion_id, despues_id, limite)
+    espera = min(espera, ESPERA_MAXIMA_SEGUNDOS)
+    if mensajes or espera <= 0:
+        return mensajes
+
+    hub = obtener_hub()
+    suscripcion, _, _ = hub.suscribir([f'chat:{conversacion_id}'])
+    try:
+        mensajes = mensajes_despues(conversacion_id, despues_id, limite)
+        if mensajes:
+            return mensajes
+        # No retener una conexión de la BD mientras se espera
+        db.session.remove()
+        try:
+            suscripcion.cola.get(timeout=espera)
+        except queue.Empty:
+            return []
+        return mensajes_despues(conversacion_id, despues_id, limite)
+    finally:
+        hub.cancelar(suscripcion)
@@ -0,0 +1,372 @@
+"""
+Comandos de mantenimiento (Flask CLI) para operaciones masivas sobre datos legacy.
+Trabajan por lotes de ids (una sentencia + commit por lote), muestran progreso
+y se pueden reanudar con --desde-id si se interrumpen. Son idempotentes.
+
+Uso:
+    flask mantenimiento crear-wallets --lote 1000
+    flask mantenimiento sincronizar-bono-entregado
+    flask mantenimiento reset-bono-visto --email montador@kiq.es
+    flask mantenimiento purgar-bajas
+    flask mantenimiento rellenar-zonas
+    flask mantenimiento rellenar-geo
+    flask mantenimiento reconciliar-contadores
+    flask mantenimiento rellenar-outlet
+    flask mantenimiento rellenar-items
+    flask mantenimiento migrar-chats-outlet
+"""
+import json
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import exists, func, literal, select
+
+from .extensions import db
+from .models import (
+    Cliente, Montador, Wallet, GemTransaction, Trabajo, TrabajoItem, ContadorTrabajos, Product,
+    Conversacion
+)
+from .identity_service import normalizar_email
+from .sync_service import purgar_bajas
+from .zonas import zona_de_direccion, normalizar_zona, datos_outlet
+from .geo import geocodificar, codificar_geohash
+from .contadores import conteo_real
+from .trabajo_items import escribir_items
+
+mantenimiento_cli = AppGroup('mantenimiento', help='Operaciones masivas de mantenimiento.')
+
+LOTE_POR_DEFECTO = 1000
+
+
+def _procesar_por_lotes(modelo, lote, desde_id, operacion, descripcion):
+    """
+    Recorre los ids de 'modelo' en tramos (desde_id, desde_id + lote] y ejecuta
+    'operacion(id_min, id_max)' -> filas afectadas, con commit por tramo.
+    """
+    id_maximo = db.session.query(func.max(modelo.id)).scalar() or 0
+    if desde_id >= id_maximo:
+        print(f"✅ {descripcion}: nada que procesar.")
+        return 0
+
+    print(f"🔧 {descripcion}: ids {desde_id + 1}-{id_maximo} en lotes de {lote}")
+    total = 0
+    inicio = desde_id
+    while inicio < id_maximo:
+        fin = min(inicio + lote, id_maximo)
+        try:
+            afectadas = operacion(inicio, fin)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            print(f"❌ Fallo en el lote {inicio + 1}-{fin}. Reanudar con: --desde-id {inicio}")
+            raise
+        total += afectadas
+        porcentaje = (fin - desde_id) * 100 // (id_maximo - desde_id)
+        print(f"   ⏳ {porcentaje:3d}% | ids hasta {fin} | +{afectadas} (total {total})")
+        inicio = fin
+
+    print(f"✅ {descripcion}: {total} filas actualizadas.")
+    return total
+
+
+@mantenimiento_cli.command('crear-wallets')
+@click.option('--rol', type=click.Choice(['montador', 'cliente']), default='montador')
+@click.option('--lote', default=LOTE_POR_DEFECTO, show_default=True)
+@click.option('--desde-id', default=0, show_default=True, help='Reanudar tras este id.')
+def crear_wallets(rol, lote, desde_id):
+    """Crea wallets vacías (saldo 0, sin bono) a los usuarios que no tienen."""
+    modelo = Montador if rol == 'montador' else Cliente
+    columna_wallet = Wallet.montador_id if rol == 'montador' else Wallet.cliente_id
+
+    def operacion(id_min, id_max):
+        sin_wallet = select(
+            literal(0), modelo.id, literal(datetime.utcnow())
+        ).where(
+            modelo.id > id_min,
+            modelo.id <= id_max,
+            ~exists().where(columna_wallet == modelo.id)
+        )
+        resultado = db.session.execute(Wallet.__table__.insert().from_select(
+            ['saldo', columna_wallet.key, 'fecha_actualizacion'], sin_wallet
+        ))
+        return resultado.rowcount
+
+    _procesar_por_lotes(modelo, lote, desde_id, operacion, f"Wallets de {rol}es")
+
+
+@mantenimiento_cli.command('sincronizar-bono-entregado')
+@click.option('--lote', default=LOTE_POR_DEFECTO, show_default=True)
+@click.option('--desde-id', default=0, show_default=True, help='Reanudar tras este id.')
+def sincronizar_bono_entregado(lote, desde_id):
+    """Marca bono_entregado en los montadores cuya wallet ya tiene el BONO_REGISTRO."""
+    tiene_bono = exists().where(
+        Wallet.montador_id == Montador.id,
+        GemTransaction.wallet_id == Wallet.id,
+        GemTransaction.tipo == 'BONO_REGISTRO'
+    )
+
+    def operacion(id_min, id_max):
+        return Montador.query.filter(
+            Montador.id > id_min,
+            Montador.id <= id_max,
+            Montador.bono_entregado.isnot(True),
+            tiene_bono
+        ).update({Montador.bono_entregado: True}, synchronize_session=False)
+
+    _procesar_por_lotes(Montador, lote, desde_id, operacion, "Bono entregado")
+
+
+@mantenimiento_cli.command('reset-bono-visto')
+@click.option('--email', default=None, help='Solo este montador.')
+@click.option('--todos', is_flag=True, help='Todos los montadores.')
+@click.option('--lote', default=LOTE_POR_DEFECTO, show_default=True)
+@click.option('--desde-id', default=0, show_default=True, help='Reanudar tras este id.')
+def reset_bono_visto(email, todos, lote, desde_id):
+    """Vuelve a mostrar la animación del bono de bienvenida (bono_visto = False)."""
+    if email:
+        actualizados = Montador.query.filter(
+            func.lower(Montador.email) == normalizar_email(email)
+        ).update({Montador.bono_visto: False}, synchronize_session=False)
+        db.session.commit()
+        if actualizados:
+            print(f"✅ ¡Listo! Bono reseteado para {email}.")
+        else:
+            print("❌ Error: Usuario no encontrado. Verifica el email.")
+        return
+
+    if not todos:
+        raise click.UsageError('Indica --email o --todos')
+
+    def operacion(id_min, id_max):
+        return Montador.query.filter(
+            Montador.id > id_min,
+            Montador.id <= id_max,
+            Montador.bono_visto.isnot(False)
+        ).update({Montador.bono_visto: False}, synchronize_session=False)
+
+    _procesar_por_lotes(Montador, lote, desde_id, operacion, "Reset bono visto")
+
+
+@mantenimiento_cli.command('purgar-bajas')
+def comando_purgar_bajas():
+    """Borra las bajas de trabajos más antiguas que SYNC_RETENCION_DIAS."""
+    print(f"🧹 Bajas de trabajos purgadas: {purgar_bajas()}")
+
+
+@mantenimiento_cli.command('rellenar-zonas')
+@click.option('--lote', default=LOTE_POR_DEFECTO, show_default=True)
+@click.option('--desde-id', default=0, show_default=True, help='Reanudar tras este id.')
+def rellenar_zonas(lote, desde_id):
+    """Precalcula zona/zona_clave (y normaliza desglose) en los trabajos antiguos."""
+    tabla = Trabajo.__table__
+
+    def operacion(id_min, id_max):
+        pendientes = db.session.query(
+            Trabajo.id, Trabajo.direccion, Trabajo.desglose
+        ).filter(
+            Trabajo.id > id_min, Trabajo.id <= id_max, Trabajo.zona_clave.is_(None)
+        ).all()
+        for trabajo_id, direccion, desglose in pendientes:
+            zona = zona_de_direccion(direccion)
+            valores = {
+                'zona': zona,
+                'zona_clave': normalizar_zona(zona),
+                # Mantener updated_at: no es un cambio visible para los paneles
+                'updated_at': tabla.c.updated_at
+            }
+            if isinstance(desglose, str):
+                try:
+                    valores['desglose'] = json.loads(desglose)
+                except json.JSONDecodeError:
+                    valores['desglose'] = None
+            db.session.execute(tabla.update().where(tabla.c.id == trabajo_id).values(**valores))
+        return len(pendientes)
+
+    _procesar_por_lotes(Trabajo, lote, desde_id, operacion, "Zonas de trabajos")
+
+
+@mantenimiento_cli.command('rellenar-geo')
+@click.option('--lote', default=LOTE_POR_DEFECTO, show_default=True)
+@click.option('--desde-id', default=0, show_default=True, help='Reanudar tras este id.')
+@click.option('--centros', is_flag=True, help='También el centro de servicio de los montadores.')
+def rellenar_geo(lote, desde_id, centros):
+    """Geocodifica (lat/lng/geohash) los trabajos antiguos con el nomenclátor local."""
+    tabla = Trabajo.__table__
+
+    def operacion(id_min, id_max):
+        pendientes = db.session.query(Trabajo.id, Trabajo.direccion).filter(
+            Trabajo.id > id_min, Trabajo.id <= id_max, Trabajo.geohash.is_(None)
+        ).all()
+        actualizadas = 0
+        for trabajo_id, direccion in pendientes:
+            coordenadas = geocodificar(direccion)
+            if not coordenadas:
+                continue
+            db.session.execute(tabla.update().where(tabla.c.id == trabajo_id).values(
+                lat=coordenadas[0],
+                lng=coordenadas[1],
+                geohash=codificar_geohash(*coordenadas),
+                # Mantener updated_at: no es un cambio visible para los paneles
+                updated_at=tabla.c.updated_at
+            ))
+            actualizadas += 1
+        return actualizadas
+
+    _procesar_por_lotes(Trabajo, lote, desde_id, operacion, "Geolocalización de trabajos")
+
+    if centros:
+        tabla_montador = Montador.__table__
+
+        def operacion_centros(id_min, id_max):
+            pendientes = db.session.query(Montador.id, Montador.zona_servicio).filter(
+                Montador.id > id_min, Montador.id <= id_max,
+                Montador.centro_lat.is_(None), Montador.zona_servicio.isnot(None)
+            ).all()
+            actualizadas = 0
+            for montador_id, zona_servicio in pendientes:
+                centro = geocodificar(zona_servicio)
+                if not centro:
+                    continue
+                db.session.execute(tabla_montador.update().where(
+                    tabla_montador.c.id == montador_id
+                ).values(
+                    centro_lat=centro[0], centro_lng=centro[1],
+                    updated_at=tabla_montador.c.updated_at
+                ))
+                actualizadas += 1
+            return actualizadas
+
+        _procesar_por_lotes(Montador, lote, 0, operacion_centros, "Centros de montadores")
+
+
+@mantenimiento_cli.command('reconciliar-contadores')
+@click.option('--solo-informar', is_flag=True, help='Muestra las diferencias sin corregirlas.')
+def reconciliar_contadores(solo_informar):
+    """Recalcula contador_trabajos con GROUP BY y corrige las filas desviadas."""
+    reales = conteo_real()
+    guardados = {
+        (rol, usuario_id, estado): total
+        for rol, usuario_id, estado, total in db.session.query(
+            ContadorTrabajos.rol, ContadorTrabajos.usuario_id,
+            ContadorTrabajos.estado, ContadorTrabajos.total
+        )
+    }
+    diferencias = {
+        clave: reales.get(clave, 0)
+        for clave in set(reales) | set(guardados)
+        if reales.get(clave, 0) != guardados.get(clave, 0)
+    }
+    for (rol, usuario_id, estado), real in sorted(diferencias.items())[:20]:
+        guardado = guardados.get((rol, usuario_id, estado), 0)
+        print(f"   ⚠️ {rol} {usuario_id} '{estado}': {guardado} -> {real}")
+
+    if not diferencias:
+        print("✅ Contadores correctos.")
+        return
+    if solo_informar:
+        print(f"🔎 {len(diferencias)} contadores desviados (sin cambios).")
+        return
+
+    tabla = ContadorTrabajos.__table__
+    for (rol, usuario_id, estado), real in diferencias.items():
+        condicion = (
+            (tabla.c.rol == rol) & (tabla.c.usuario_id == usuario_id) & (tabla.c.estado == estado)
+        )
+        if not real:
+            db.session.execute(tabla.delete().where(condicion))
+        elif (rol, usuario_id, estado) in guardados:
+            db.session.execute(tabla.update().where(condicion).values(total=real))
+        else:
+            db.session.execute(tabla.insert().values(
+                rol=rol, usuario_id=usuario_id, estado=estado, total=real
+            ))
+    db.session.commit()
+    print(f"✅ {len(diferencias)} contadores corregidos.")
+
+
+@mantenimiento_cli.command('rellenar-outlet')
+@click.option('--lote', default=LOTE_POR_DEFECTO, show_default=True)
+@click.option('--desde-id', default=0, show_default=True, help='Reanudar tras este id.')
+def rellenar_outlet(lote, desde_id):
+    """Copia tipo/outlet_product_id de 'etiquetas' a sus columnas en los trabajos antiguos."""
+    tabla = Trabajo.__table__
+
+    def operacion(id_min, id_max):
+        candidatos = db.session.query(Trabajo.id, Trabajo.etiquetas).filter(
+            Trabajo.id > id_min, Trabajo.id <= id_max,
+            Trabajo.etiquetas.isnot(None), Trabajo.tipo != 'outlet'
+        ).all()
+        actualizadas = 0
+        for trabajo_id, etiquetas in candidatos:
+            tipo, outlet_product_id = datos_outlet(etiquetas)
+            if tipo != 'outlet':
+                continue
+            db.session.execute(tabla.update().where(tabla.c.id == trabajo_id).values(
+                tipo=tipo, outlet_product_id=outlet_product_id,
+                updated_at=tabla.c.updated_at  # No es un cambio visible
+            ))
+            actualizadas += 1
+        return actualizadas
+
+    _procesar_por_lotes(Trabajo, lote, desde_id, operacion, "Trabajos del Outlet")
+
+
+@mantenimiento_cli.command('rellenar-items')
+@click.option('--lote', default=LOTE_POR_DEFECTO, show_default=True)
+@click.option('--desde-id', default=0, show_default=True, help='Reanudar tras este id.')
+def rellenar_items(lote, desde_id):
+    """Crea las partidas (trabajo_item) de los trabajos antiguos a partir de su desglose."""
+    def operacion(id_min, id_max):
+        sin_items = db.session.query(
+            Trabajo.id, Trabajo.fecha_creacion, Trabajo.desglose
+        ).filter(
+            Trabajo.id > id_min, Trabajo.id <= id_max, Trabajo.desglose.isnot(None),
+            ~exists().where(TrabajoItem.trabajo_id == Trabajo.id)
+        ).all()
+        conexion = db.session.connection()
+        return sum(
+            escribir_items(conexion, trabajo_id, fecha, desglose)
+            for trabajo_id, fecha, desglose in sin_items
+        )
+
+    _procesar_por_lotes(Trabajo, lote, desde_id, operacion, "Partidas de trabajos")
+
+
+@mantenimiento_cli.command('migrar-chats-outlet')
+@click.option('--lote', default=LOTE_POR_DEFECTO, show_default=True)
+@click.option('--desde-id', default=0, show_default=True, help='Reanudar tras este id.')
+def migrar_chats_outlet(lote, desde_id):
+    """
+    Crea una Conversacion por cada Trabajo ficticio de chat del Outlet (tipo
+    'outlet'; ejecutar antes rellenar-outlet), enlazada con trabajo_id. Los
+    trabajos no se borran: alguno puede seguir en curso como venta.
+    """
+    def operacion(id_min, id_max):
+        candidatos = db.session.query(
+            Trabajo.id, Trabajo.cliente_id, Trabajo.montador_id, Trabajo.outlet_product_id,
+            Trabajo.fecha_creacion, Trabajo.updated_at
+        ).join(
+            Product, Product.id == Trabajo.outlet_product_id
+        ).filter(
+            Trabajo.id > id_min, Trabajo.id <= id_max, Trabajo.tipo == 'outlet',
+            Trabajo.montador_id.isnot(None)
+        ).all()
+        creadas = 0
+        for trabajo_id, cliente_id, montador_id, product_id, creado, actualizado in candidatos:
+            if db.session.query(exists().where(
+                (Conversacion.product_id == product_id)
+                & (Conversacion.comprador_id == cliente_id)
+                & (Conversacion.comprador_rol == 'cliente')
+            )).scalar():
+                continue
+            db.session.add(Conversacion(
+                product_id=product_id, comprador_rol='cliente', comprador_id=cliente_id,
+                vendedor_id=montador_id, trabajo_id=trabajo_id,
+                created_at=creado, ultimo_mensaje_at=actualizado or creado or datetime.utcnow()
+            ))
+            db.session.flush()
+            creadas += 1
+        return creadas
+
+    _procesar_por_lotes(Trabajo, lote, desde_id, operacion, "Chats del Outlet")
@@ -0,0 +1,196 @@
+"""
+Almacén de códigos de verificación / recuperación con caducidad (TTL).
+Backends (variable CODE_STORE_BACKEND):
+  - 'db' (por defecto): tabla verification_codes. Guardar es una sola
+    transacción (borra el código anterior y los caducados + inserta) y
+    verificar es una sola consulta. El barrido de caducados usa el índice
+    de expires_at; también hay comando: flask purgar-codigos
+  - 'memoria': diccionario del proceso. Solo sirve con un único proceso web.
+  - 'redis': SET con EX (Redis expira solo). Usa REDIS_URL (memory:// = falso).
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import or_
+
+from .extensions import db
+from .models import Code
+from .identity_service import normalizar_email
+from .redis_client import obtener_redis
+
+
+class AlmacenCodigosDB:
+    """Códigos en la tabla verification_codes."""
+
+    def guardar(self, email, codigo, ttl_segundos):
+        """Sustituye el código del email y purga caducados (1 transacción)."""
+        ahora = datetime.utcnow()
+        try:
+            Code.query.filter(
+                or_(Code.email == email, Code.expires_at < ahora)
+            ).delete(synchronize_session=False)
+            db.session.add(Code(
+                email=email, code=codigo,
+                expires_at=ahora + timedelta(seconds=ttl_segundos)
+            ))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def obtener(self, email):
+        """Código vigente del email o None (1 consulta)."""
+        fila = db.session.query(Code.code).filter(
+            Code.email == email, Code.expires_at > datetime.utcnow()
+        ).order_by(Code.id.desc()).first()
+        return fila[0] if fila else None
+
+    def consumir(self, email, codigo):
+        """Borra el código si coincide y está vigente (1 sentencia). True si lo consumió."""
+        borrados = Code.query.filter(
+            Code.email == email, Code.code == codigo, Code.expires_at > datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return borrados > 0
+
+    def purgar(self):
+        """Elimina los códigos caducados. Devuelve cuántos."""
+        borrados = Code.query.filter(
+            Code.expires_at < datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return borrados
+
+
+class AlmacenCodigosMemoria:
+    """Códigos en un diccionario del proceso (desarrollo / un solo worker)."""
+
+    INTERVALO_BARRIDO_SEGUNDOS = 60
+
+    def __init__(self):
+        self._codigos = {}
+        self._lock = threading.Lock()
+        self._ultimo_barrido = time.monotonic()
+
+    def guardar(self, email, codigo, ttl_segundos):
+        """Sustituye el código del email (y barre caducados de vez en cuando)."""
+        ahora = time.monotonic()
+        with self._lock:
+            self._codigos[email] = (codigo, ahora + ttl_segundos)
+            if ahora - self._ultimo_barrido > self.INTERVALO_BARRIDO_SEGUNDOS:
+                self._barrer(ahora)
+
+    def obtener(self, email):
+        """Código vigente del email o None."""
+        with self._lock:
+            valor = self._codigos.get(email)
+        if not valor or valor[1] <= time.monotonic():
+            return None
+        return valor[0]
+
+    def consumir(self, email, codigo):
+        """Borra el código si coincide y está vigente."""
+        with self._lock:
+            valor = self._codigos.get(email)
+            if not valor or valor[0] != codigo or valor[1] <= time.monotonic():
+                return False
+            del self._codigos[email]
+            return True
+
+    def purgar(self):
+        """Elimina los códigos caducados. Devuelve cuántos."""
+        with self._lock:
+            return self._barrer(time.monotonic())
+
+    def _barrer(self, ahora):
+        caducados = [email for email, (_c, expira) in self._codigos.items() if expira <= ahora]
+        for email in caducados:
+            del self._codigos[email]
+        self._ultimo_barrido = ahora
+        return len(caducados)
+
+
+class AlmacenCodigosRedis:
+    """Códigos en Redis con TTL nativo (compartido entre procesos)."""
+
+    PREFIJO = 'kiq:codigo:'
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def guardar(self, email, codigo, ttl_segundos):
+        """SET con EX: sustituye y caduca solo."""
+        self.cliente.set(self.PREFIJO + email, codigo, ex=ttl_segundos)
+
+    def obtener(self, email):
+        """Código vigente del email o None."""
+        return self.cliente.get(self.PREFIJO + email)
+
+    def consumir(self, email, codigo):
+        """Solo el primero que borra la clave lo consume (DEL devuelve 1)."""
+        if self.cliente.get(self.PREFIJO + email) != codigo:
+            return False
+        return self.cliente.delete(self.PREFIJO + email) > 0
+
+    def purgar(self):
+        """Redis expira las claves por sí mismo."""
+        return 0
+
+
+# Backend activo del proceso (evita 'global')
+_ALMACEN = {'actual': None}
+_LOCK = threading.Lock()
+
+
+def _crear_almacen():
+    tipo = os.getenv('CODE_STORE_BACKEND', 'db').lower()
+    if tipo == 'memoria':
+        return AlmacenCodigosMemoria()
+    if tipo == 'redis':
+        cliente = obtener_redis()
+        if cliente is not None:
+            return AlmacenCodigosRedis(cliente)
+        print("⚠️ CODE_STORE_BACKEND=redis sin Redis disponible: se usa la base de datos")
+    return AlmacenCodigosDB()
+
+
+def obtener_almacen():
+    """Backend configurado (se crea en el primer uso)."""
+    with _LOCK:
+        if _ALMACEN['actual'] is None:
+            _ALMACEN['actual'] = _crear_almacen()
+        return _ALMACEN['actual']
+
+
+# --- API DEL SERVICIO ---
+
+def guardar_codigo(email, codigo, minutos):
+    """Guarda el código del email durante 'minutos' (sustituye el anterior)."""
+    obtener_almacen().guardar(normalizar_email(email), codigo, int(minutos * 60))
+
+
+def obtener_codigo(email):
+    """Código vigente del email o None si no existe o ha caducado."""
+    return obtener_almacen().obtener(normalizar_email(email))
+
+
+def consumir_codigo(email, codigo):
+    """Valida y borra el código en un solo paso (no se puede reutilizar)."""
+    if not email or not codigo:
+        return False
+    return obtener_almacen().consumir(normalizar_email(email), str(codigo))
+
+
+def init_app(app):
+    """Registra el comando CLI 'flask purgar-codigos'."""
+    app.cli.add_command(comando_purgar_codigos)
+
+
+@click.command('purgar-codigos')
+def comando_purgar_codigos():
+    """Borra los códigos de verificación caducados."""
+    borrados = obtener_almacen().purgar()
+    print(f"🧹 Códigos caducados eliminados: {borrados}")
@@ -0,0 +1,148 @@
+"""
+Contadores de trabajos por usuario y estado (tabla 'contador_trabajos').
+Se actualizan en la MISMA transacción que el cambio del trabajo:
+- eventos del ORM (alta, baja, cambio de estado o de montador),
+- mover_trabajo() para los UPDATE directos (p. ej. aceptar_trabajo).
+Así los badges de los paneles y el "primer trabajo gratis" son lecturas por
+clave primaria en vez de COUNT(*) sobre 'trabajo'.
+Si alguna vez se desincronizan: flask mantenimiento reconciliar-contadores
+"""
+from collections import Counter
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.dialects.postgresql import insert as insert_postgresql
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+
+from .extensions import db
+from .models import ContadorTrabajos, Trabajo
+
+ESTADO_POR_DEFECTO = 'cotizacion'
+
+# Agrupaciones que enseñan los paneles (badges)
+BADGES = {
+    'presupuestos': ('cotizacion', 'pendiente'),
+    'activos': ('aceptado', 'en_progreso'),
+    'en_revision': ('revision_cliente',),
+    'completados': ('completado', 'aprobado_cliente_stripe'),
+    'incidencias': ('incidencia', 'cancelado_incidencia'),
+}
+
+_INSERTS_CON_UPSERT = {'postgresql': insert_postgresql, 'sqlite': insert_sqlite}
+
+
+def _claves(cliente_id, montador_id, estado):
+    """Filas de contador a las que cuenta un trabajo."""
+    estado = estado or ESTADO_POR_DEFECTO
+    claves = []
+    if cliente_id is not None:
+        claves.append(('cliente', cliente_id, estado))
+    if montador_id is not None:
+        claves.append(('montador', montador_id, estado))
+    return claves
+
+
+def ajustar_contador(connection, rol, usuario_id, estado, delta):
+    """Suma 'delta' al contador (lo crea si no existe) en una sentencia."""
+    tabla = ContadorTrabajos.__table__
+    insertar = _INSERTS_CON_UPSERT.get(connection.dialect.name)
+    if insertar:
+        connection.execute(insertar(tabla).values(
+            rol=rol, usuario_id=usuario_id, estado=estado, total=delta
+        ).on_conflict_do_update(
+            index_elements=['rol', 'usuario_id', 'estado'],
+            set_={'total': tabla.c.total + delta}
+        ))
+        return
+
+    actualizadas = connection.execute(tabla.update().where(
+        tabla.c.rol == rol, tabla.c.usuario_id == usuario_id, tabla.c.estado == estado
+    ).values(total=tabla.c.total + delta)).rowcount
+    if not actualizadas:
+        connection.execute(tabla.insert().values(
+            rol=rol, usuario_id=usuario_id, estado=estado, total=delta
+        ))
+
+
+def mover_trabajo(connection, antes, despues):
+    """
+    Aplica el cambio de un trabajo a los contadores.
+    'antes' y 'despues' son (cliente_id, montador_id, estado) o None (alta/baja).
+    """
+    deltas = Counter()
+    for clave in _claves(*antes) if antes else ():
+        deltas[clave] -= 1
+    for clave in _claves(*despues) if despues else ():
+        deltas[clave] += 1
+    for (rol, usuario_id, estado), delta in deltas.items():
+        if delta:
+            ajustar_contador(connection, rol, usuario_id, estado, delta)
+
+
+def contadores_de(rol, usuario_id):
+    """{'por_estado': {...}, 'activos': n, ...} para los badges de un usuario."""
+    filas = db.session.query(ContadorTrabajos.estado, ContadorTrabajos.total).filter(
+        ContadorTrabajos.rol == rol,
+        ContadorTrabajos.usuario_id == usuario_id,
+        ContadorTrabajos.total > 0
+    ).all()
+    por_estado = dict(filas)
+    resumen = {
+        badge: sum(por_estado.get(estado, 0) for estado in estados)
+        for badge, estados in BADGES.items()
+    }
+    return {'por_estado': por_estado, 'total': sum(por_estado.values()), **resumen}
+
+
+def conteo_real():
+    """{(rol, usuario_id, estado): total} calculado con GROUP BY sobre 'trabajo'."""
+    estado = func.coalesce(Trabajo.estado, ESTADO_POR_DEFECTO)
+    reales = {}
+    for rol, columna in (('cliente', Trabajo.cliente_id), ('montador', Trabajo.montador_id)):
+        filas = db.session.query(columna, estado, func.count(Trabajo.id)).filter(
+            columna.isnot(None)
+        ).group_by(columna, estado).all()
+        for usuario_id, estado_fila, total in filas:
+            reales[(rol, usuario_id, estado_fila)] = total
+    return reales
+
+
+# --- MANTENIMIENTO AUTOMÁTICO (eventos del ORM, dentro del mismo flush) ---
+
+def _valores_anteriores(target):
+    """(cliente_id, montador_id, estado) tal como estaban en la base de datos."""
+    estado = inspect(target)
+    valores = []
+    for campo in ('cliente_id', 'montador_id', 'estado'):
+        historial = estado.attrs[campo].history
+        valores.append(historial.deleted[0] if historial.deleted else getattr(target, campo))
+    return tuple(valores)
+
+
+def _valores_actuales(target):
+    return (target.cliente_id, target.montador_id, target.estado)
+
+
+def _al_crear(_mapper, connection, target):
+    mover_trabajo(connection, None, _valores_actuales(target))
+
+
+def _al_borrar(_mapper, connection, target):
+    mover_trabajo(connection, _valores_anteriores(target), None)
+
+
+def _al_modificar(_mapper, connection, target):
+    antes, despues = _valores_anteriores(target), _valores_actuales(target)
+    if antes != despues:
+        mover_trabajo(connection, antes, despues)
+
+
+def _conservar_valor_anterior(_target, _valor, _anterior, _iniciador):
+    """Sin lógica: solo fuerza active_history (valor previo aunque esté expirado)."""
+
+
+for _campo in (Trabajo.cliente_id, Trabajo.montador_id, Trabajo.estado):
+    event.listen(_campo, 'set', _conservar_valor_anterior, active_history=True)
+
+event.listen(Trabajo, 'after_insert', _al_crear)
+event.listen(Trabajo, 'after_delete', _al_borrar)
+event.listen(Trabajo, 'after_update', _al_modificar)
@@ -1,9 +1,21 @@
 """
 Módulo para el envío de correos electrónicos transaccionales usando Resend.
+Las rutas nunca hablan con Resend directamente: encolan el correo en el
+outbox (tabla email_outbox) y el worker de email_worker.py lo entrega.
+El HTML sale de las plantillas Jinja2 de app/templates/emails/.
 """
 import os
+import json
+import threading
 import resend
+from cachetools import LRUCache
 from dotenv import load_dotenv
+from jinja2 import Environment, FileSystemLoader
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from .extensions import db
+from .models import EmailOutbox
 
 # Cargar variables de entorno
 load_dotenv()
@@ -14,56 +26,143 @@ resend.api_key = os.getenv('RESEND_API_KEY')
 # Configuración del remitente
 REMITENTE_DEFAULT = "Kiq Montajes <info@kiq.es>"
 
-def enviar_email_generico(destinatario, asunto, contenido_html):
+# --- PLANTILLAS (Jinja2) ---
+# Se compilan UNA vez por proceso al importar el módulo. Autoescape activado:
+# nombres y títulos que escribe el usuario nunca se inyectan como HTML.
+_DIRECTORIO_PLANTILLAS = os.path.join(os.path.dirname(__file__), 'templates', 'emails')
+_ENTORNO_PLANTILLAS = Environment(
+    loader=FileSystemLoader(_DIRECTORIO_PLANTILLAS),
+    autoescape=True,
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True
+)
+_PLANTILLAS = {
+    nombre: _ENTORNO_PLANTILLAS.get_template(nombre)
+    for nombre in _ENTORNO_PLANTILLAS.list_templates()
+}
+# Caché de HTML ya renderizado (mismo contexto -> mismo HTML), útil en
+# notificaciones masivas donde muchos destinatarios reciben el mismo correo.
+_CACHE_RENDER = LRUCache(maxsize=512)
+_CACHE_RENDER_LOCK = threading.Lock()
+
+
+def renderizar_email(nombre_plantilla, **contexto):
+    """Renderiza una plantilla precompilada, reutilizando el resultado si se repite."""
+    clave = (nombre_plantilla, json.dumps(contexto, sort_keys=True, default=str))
+    with _CACHE_RENDER_LOCK:
+        html = _CACHE_RENDER.get(clave)
+    if html is None:
+        html = _PLANTILLAS[nombre_plantilla].render(**contexto)
+        with _CACHE_RENDER_LOCK:
+            _CACHE_RENDER[clave] = html
+    return html
+
+
+def entregar_email(destinatario, asunto, contenido_html):
     """
-    Función base para enviar cualquier correo.
+    Envía un correo a Resend de forma SÍNCRONA y devuelve el ID del proveedor.
+    Lanza la excepción del proveedor si falla (el worker decide si reintentar).
+    """
+    params = {
+        "from": REMITENTE_DEFAULT,
+        "to": [destinatario],
+        "subject": asunto,
+        "html": contenido_html,
+    }
+    email = resend.Emails.send(params)
+    return email.get('id')
+
+
+def entregar_lote(mensajes):
+    """
+    Envía varios correos en UNA llamada a la Batch API de Resend.
+    :param mensajes: lista de tuplas (destinatario, asunto, contenido_html)
+    :return: lista de IDs del proveedor, en el mismo orden.
+    """
+    if len(mensajes) == 1:
+        return [entregar_email(*mensajes[0])]
+
+    params = [{
+        "from": REMITENTE_DEFAULT,
+        "to": [destinatario],
+        "subject": asunto,
+        "html": contenido_html,
+    } for destinatario, asunto, contenido_html in mensajes]
+
+    respuesta = resend.Batch.send(params)
+    return [item.get('id') for item in respuesta.get('data', [])]
+
+
+def enviar_email_inmediato(destinatario, asunto, contenido_html):
+    """
+    Envío directo sin pasar por el outbox (scripts manuales y diagnóstico).
     Captura cualquier error para evitar romper el flujo principal.
     """
     try:
-        params = {
-            "from": REMITENTE_DEFAULT,
-            "to": [destinatario],
-            "subject": asunto,
-            "html": contenido_html,
-        }
-
-        email = resend.Emails.send(params)
-        print(f"📧 Email enviado a {destinatario}: ID {email.get('id')}")
+        email_id = entregar_email(destinatario, asunto, contenido_html)
+        print(f"📧 Email enviado a {destinatario}: ID {email_id}")
         return True
 
     except Exception as error: # pylint: disable=broad-exception-caught
         print(f"❌ Error enviando email: {error}")
         return False
 
+
+def enviar_email_generico(destinatario, asunto, contenido_html, clave=None):
+    """
+    Función base para enviar cualquier correo.
+    Solo lo guarda en el outbox y despierta al worker, así la latencia de la
+    petición no depende de Resend.
+    La fila se escribe en su PROPIA transacción (conexión aparte): no hace
+    commit ni rollback de la sesión de quien llama.
+    :param clave: Si se indica y ya hay un envío pendiente con esa clave
+                  (ej: el mismo código pedido 3 veces seguidas), se reemplaza
+                  su contenido en lugar de encolar otro correo.
+    """
+    tabla = EmailOutbox.__table__
+    try:
+        with db.engine.begin() as conexion:
+            fusionados = 0
+            if clave:
+                fusionados = conexion.execute(tabla.update().where(
+                    tabla.c.clave_coalescencia == clave,
+                    tabla.c.estado == 'pendiente',
+                    tabla.c.intentos == 0
+                ).values(
+                    destinatario=destinatario,
+                    asunto=asunto,
+                    contenido_html=contenido_html
+                )).rowcount
+
+            if not fusionados:
+                conexion.execute(tabla.insert().values(
+                    destinatario=destinatario,
+                    asunto=asunto,
+                    contenido_html=contenido_html,
+                    clave_coalescencia=clave
+                ))
+
+    except SQLAlchemyError as error:
+        print(f"❌ Error encolando email: {error}")
+        return False
+
+    worker = current_app.extensions.get('email_worker')
+    if worker:
+        worker.despertar()
+    return True
+
 def enviar_resumen_presupuesto(email_cliente, nombre_cliente, precio, items_resumen):
     """
     Envía un correo bonito al cliente con el precio final.
     """
-    # Construimos una lista HTML simple de los muebles
-    lista_items = "".join(
-        [f"<li>{item['item']} (x{item['cantidad']})</li>" for item in items_resumen]
+    html_content = renderizar_email(
+        'resumen_presupuesto.html',
+        nombre_cliente=nombre_cliente,
+        precio=precio,
+        items_resumen=items_resumen
     )
 
-    html_content = f"""
-    <div style="font-family: sans-serif; color: #333; max-width: 600px; margin: 0 auto;">
-        <h1 style="color: #6d28d9;">¡Hola, {nombre_cliente}!</h1>
-        <p>Gracias por confiar en <strong>Kiq Montajes</strong>.
-           Aquí tienes el resumen de tu solicitud:</p>
-        
-        <div style="background-color: #f3f4f6; padding: 20px; border-radius: 10px; margin: 20px 0;">
-            <h2 style="margin-top: 0;">Tu Presupuesto: {precio}€</h2>
-            <p>Incluye desplazamiento y montaje profesional.</p>
-            <ul>
-                {lista_items}
-            </ul>
-        </div>
-
-        <p>Un montador experto de tu zona (Málaga) revisará tu solicitud en breve.</p>
-        <hr style="border: 0; border-top: 1px solid #eee; margin: 30px 0;">
-        <p style="font-size: 12px; color: #999;">Kiq Technologies © 2025</p>
-    </div>
-    """
-
     return enviar_email_generico(
         destinatario=email_cliente,
         asunto=f"🚀 Tu presupuesto Kiq: {precio}€",
@@ -74,22 +173,32 @@ def enviar_codigo_verificacion(email_destino, codigo):
     """
     Envía el código OTP al usuario para verificar su cuenta.
     """
-    html_content = f"""
-    <div style="font-family: sans-serif; text-align: center; padding: 20px; max-width: 500px; margin: 0 auto; border: 1px solid #eee; border-radius: 10px;">
-        <h2 style="color: #333;">Verifica tu correo en Kiq</h2>
-        <p>Estás a un paso de completar tu solicitud. Usa este código:</p>
-        
-        <div style="background: #f3f4f6; padding: 15px; font-size: 32px; font-weight: bold; letter-spacing: 5px; color: #6d28d9; margin: 25px 0; border-radius: 8px;">
-            {codigo}
-        </div>
-        
-        <p style="font-size: 14px; color: #666;">Si no has solicitado esto, ignora este correo.</p>
-        <p style="font-size: 12px; color: #999; margin-top: 20px;">Este código expira en 15 minutos.</p>
-    </div>
-    """
-    
+    html_content = renderizar_email('codigo_verificacion.html', codigo=codigo)
+
     return enviar_email_generico(
         destinatario=email_destino,
         asunto=f"🔐 Tu código de seguridad: {codigo}",
-        contenido_html=html_content
-    )
\ No newline at end of file
+        contenido_html=html_content,
+        clave=f"codigo:{email_destino}"
+    )
+
+def enviar_codigo_recuperacion(email_destino, codigo):
+    """
+    Envía el código para restablecer la contraseña.
+    """
+    return enviar_email_generico(
+        destinatario=email_destino,
+        asunto="Recuperar Contraseña - KIQ",
+        contenido_html=renderizar_email('recuperar_password.html', codigo=codigo),
+        clave=f"reset:{email_destino}"
+    )
+
+def enviar_bienvenida(email_destino, nombre):
+    """
+    Envía el correo de bienvenida tras registrarse desde el chat.
+    """
+    return enviar_email_generico(
+        destinatario=email_destino,
+        asunto="Bienvenido a KIQ",
+        contenido_html=renderizar_email('bienvenida.html', nombre=nombre)
+    )
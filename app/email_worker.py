@@ -0,0 +1,232 @@
+"""
+Worker de entrega de emails (drena la tabla email_outbox).
+Corre como hilo de fondo dentro de cada proceso web (se arranca al encolar
+el primer correo) o como proceso dedicado con: flask email-worker
+Entrega "al menos una vez": con reintentos y backoff exponencial.
+Agrupa los pendientes en llamadas a la Batch API de Resend (máx. 100 por
+llamada) y fusiona los duplicados exactos de un mismo lote. Si la llamada
+batch falla, reenvía uno a uno para que solo se reintente el correo malo.
+"""
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy.exc import SQLAlchemyError
+
+from .extensions import db
+from .models import EmailOutbox
+from .email_service import entregar_lote, entregar_email
+
+# --- CONFIGURACIÓN DEL WORKER ---
+# Resend admite como máximo 100 correos por llamada batch
+TAMANO_LOTE = min(int(os.getenv('EMAIL_WORKER_LOTE', '100')), 100)
+MAX_INTENTOS = int(os.getenv('EMAIL_WORKER_MAX_INTENTOS', '6'))
+BACKOFF_BASE_SEGUNDOS = 30
+BACKOFF_MAX_SEGUNDOS = 3600
+# Cada cuánto revisa la cola aunque nadie le despierte (para los reintentos)
+INTERVALO_SONDEO_SEGUNDOS = float(os.getenv('EMAIL_WORKER_SONDEO', '15'))
+# Tiempo máximo que se retiene un correo tras el aviso para juntar una ráfaga
+VENTANA_AGRUPACION_SEGUNDOS = float(os.getenv('EMAIL_WORKER_VENTANA_MS', '250')) / 1000
+# Una fila 'enviando' más antigua que esto (proceso caído a mitad) se vuelve a reclamar
+PLAZO_ENVIO_SEGUNDOS = int(os.getenv('EMAIL_WORKER_PLAZO_ENVIO', '600'))
+
+# Copia de una fila reclamada: se envía sin sesión ni bloqueos abiertos
+Envio = namedtuple('Envio', 'id intentos destinatario asunto contenido_html')
+
+
+def calcular_backoff(intentos):
+    """Segundos de espera antes del siguiente intento (exponencial + jitter)."""
+    espera = min(BACKOFF_BASE_SEGUNDOS * (2 ** max(intentos - 1, 0)), BACKOFF_MAX_SEGUNDOS)
+    return espera + random.uniform(0, espera * 0.1)
+
+
+class EmailWorker:
+    """
+    Extensión Flask (patrón init_app) que entrega los emails del outbox.
+    El hilo se crea de forma perezosa y por PID, así sobrevive al fork de Gunicorn.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._evento = threading.Event()
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._pid = None
+
+    def init_app(self, app):
+        """Registra el worker en la app y el comando CLI 'flask email-worker'."""
+        self.app = app
+        app.config.setdefault(
+            'EMAIL_WORKER_EN_PROCESO', os.getenv('EMAIL_WORKER_EN_PROCESO', '1') == '1'
+        )
+        app.extensions['email_worker'] = self
+        app.cli.add_command(comando_email_worker)
+
+    def despertar(self):
+        """Avisa al hilo de que hay correo nuevo (y lo arranca si hace falta)."""
+        if self.app is None or not self.app.config.get('EMAIL_WORKER_EN_PROCESO'):
+            return
+        self._asegurar_hilo()
+        self._evento.set()
+
+    def _asegurar_hilo(self):
+        with self._lock:
+            if self._hilo and self._hilo.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._hilo = threading.Thread(
+                target=self.ejecutar, name='kiq-email-worker', daemon=True
+            )
+            self._hilo.start()
+
+    def ejecutar(self):
+        """Bucle principal: vacía la cola y espera aviso (o sondeo)."""
+        while True:
+            self._evento.clear()
+            with self.app.app_context():
+                try:
+                    while self.procesar_lote() == TAMANO_LOTE:
+                        pass
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    print(f"❌ Error en worker de email: {e}")
+                finally:
+                    db.session.remove()
+            if self._evento.wait(timeout=INTERVALO_SONDEO_SEGUNDOS):
+                # Nos han avisado: esperamos un instante para juntar la ráfaga
+                time.sleep(VENTANA_AGRUPACION_SEGUNDOS)
+
+    def procesar_lote(self, limite=TAMANO_LOTE):
+        """
+        Entrega un lote de emails vencidos. Devuelve cuántas filas procesó.
+        1) Reclama las filas (estado 'enviando') con FOR UPDATE SKIP LOCKED y
+           hace commit: los bloqueos se sueltan ANTES de llamar a Resend.
+        2) Envía y guarda el resultado de cada fila en otra transacción.
+        (SQLite ignora SKIP LOCKED, pero allí solo hay un proceso).
+        """
+        try:
+            lote = self._reclamar_lote(limite)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            print(f"❌ Error BD en outbox de email: {e}")
+            return 0
+
+        if lote:
+            resultados = self._entregar_lote(lote)
+            try:
+                self._guardar_resultados(resultados)
+                db.session.commit()
+            except SQLAlchemyError as e:
+                # Las filas siguen 'enviando' y se reclaman al vencer el plazo
+                db.session.rollback()
+                print(f"❌ Error BD guardando envíos de email: {e}")
+        return len(lote)
+
+    @staticmethod
+    def _reclamar_lote(limite):
+        """
+        Marca como 'enviando' los pendientes vencidos (y los 'enviando' cuyo
+        plazo caducó) y hace commit. Devuelve las copias a enviar.
+        """
+        ahora = datetime.utcnow()
+        filas = EmailOutbox.query.filter(
+            EmailOutbox.estado.in_(('pendiente', 'enviando')),
+            EmailOutbox.proximo_intento <= ahora
+        ).order_by(EmailOutbox.proximo_intento).limit(limite).with_for_update(
+            skip_locked=True
+        ).all()
+
+        lote = []
+        for fila in filas:
+            fila.estado = 'enviando'
+            fila.intentos += 1
+            fila.proximo_intento = ahora + timedelta(seconds=PLAZO_ENVIO_SEGUNDOS)
+            lote.append(Envio(
+                fila.id, fila.intentos, fila.destinatario, fila.asunto, fila.contenido_html
+            ))
+        db.session.commit()
+        return lote
+
+    @staticmethod
+    def _entregar_lote(lote):
+        """
+        Envía el lote en una sola llamada. Devuelve [(envio, id_proveedor o error)].
+        Envíos idénticos (mismo destinatario, asunto y HTML) se mandan una vez.
+        Si la llamada batch falla, se reenvía cada correo por separado.
+        """
+        grupos = {}
+        for envio in lote:
+            firma = (envio.destinatario, envio.asunto, envio.contenido_html)
+            grupos.setdefault(firma, []).append(envio)
+
+        firmas = list(grupos)
+        try:
+            ids_proveedor = entregar_lote(firmas)
+        except Exception as error: # pylint: disable=broad-exception-caught
+            if len(firmas) == 1:
+                ids_proveedor = [error]
+            else:
+                print(f"⚠️ Falló el envío batch ({error}), se envía uno a uno")
+                ids_proveedor = [EmailWorker._entregar_uno(firma) for firma in firmas]
+
+        resultados = []
+        for indice, firma in enumerate(firmas):
+            # Respuesta incompleta del proveedor: se reintenta lo que falta
+            resultado = ids_proveedor[indice] if indice < len(ids_proveedor) \
+                else RuntimeError("Sin ID en respuesta batch")
+            resultados.extend((envio, resultado) for envio in grupos[firma])
+
+        enviados = sum(1 for _, r in resultados if not isinstance(r, Exception))
+        print(f"📧 Lote de {len(lote)} emails: {enviados} entregados en {len(firmas)} envíos")
+        return resultados
+
+    @staticmethod
+    def _entregar_uno(firma):
+        """Envío individual: devuelve el ID del proveedor o la excepción."""
+        try:
+            return entregar_email(*firma)
+        except Exception as error: # pylint: disable=broad-exception-caught
+            return error
+
+    @staticmethod
+    def _guardar_resultados(resultados):
+        """Actualiza cada fila según su resultado (sin commit)."""
+        ahora = datetime.utcnow()
+        for envio, resultado in resultados:
+            if isinstance(resultado, Exception):
+                valores = EmailWorker._programar_reintento(envio, resultado)
+            else:
+                valores = {
+                    'estado': 'enviado', 'enviado_at': ahora,
+                    'proveedor_id': resultado, 'ultimo_error': None
+                }
+            EmailOutbox.query.filter_by(id=envio.id).update(
+                valores, synchronize_session=False
+            )
+
+    @staticmethod
+    def _programar_reintento(envio, error):
+        """Valores para reintentar la fila más tarde (o descartarla)."""
+        valores = {'ultimo_error': str(error)[:500]}
+        if envio.intentos >= MAX_INTENTOS:
+            valores['estado'] = 'fallido'
+            print(f"❌ Email #{envio.id} descartado tras {envio.intentos} intentos")
+        else:
+            espera = calcular_backoff(envio.intentos)
+            valores['estado'] = 'pendiente'
+            valores['proximo_intento'] = datetime.utcnow() + timedelta(seconds=espera)
+            print(f"⚠️ Email #{envio.id} falló, reintento en {int(espera)}s: {error}")
+        return valores
+
+
+email_worker = EmailWorker()
+
+
+@click.command('email-worker')
+def comando_email_worker():
+    """Ejecuta el worker de emails como proceso dedicado (bloqueante)."""
+    print("📬 Worker de emails iniciado. Ctrl+C para salir.")
+    email_worker.ejecutar()
@@ -0,0 +1,30 @@
+"""
+ETags y GET condicionales para los endpoints que el frontend consulta en bucle.
+La versión de cada listado se calcula con una consulta agregada barata
+(COUNT / MAX(id) / MAX(updated_at) del ámbito del usuario). Si coincide con
+If-None-Match se responde 304 sin cargar ni serializar las filas.
+"""
+import hashlib
+
+from flask import request, make_response
+
+
+def calcular_etag(*partes):
+    """Huella corta y estable de los valores que definen la versión."""
+    crudo = '|'.join('' if p is None else str(p) for p in partes)
+    return hashlib.blake2b(crudo.encode('utf-8'), digest_size=10).hexdigest()
+
+
+def respuesta_no_modificado(etag):
+    """Respuesta 304 si el cliente ya tiene esta versión; None en otro caso."""
+    if etag and request.if_none_match.contains_weak(etag):
+        respuesta = make_response('', 304)
+        return con_etag(respuesta, etag)
+    return None
+
+
+def con_etag(respuesta, etag):
+    """Añade el ETag (débil) y obliga a revalidar siempre (datos privados)."""
+    respuesta.set_etag(etag, weak=True)
+    respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta
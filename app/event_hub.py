@@ -0,0 +1,244 @@
+"""
+Hub de eventos en tiempo real (Server-Sent Events) para los paneles.
+- Fan-out dentro del proceso: cada conexión SSE es una cola suscrita a sus canales.
+- Backend entre procesos (EVENTOS_BACKEND):
+    'local' (por defecto): solo este proceso (desarrollo, pruebas, un worker).
+    'redis': PUBLISH/SUBSCRIBE sobre REDIS_URL; todos los workers reciben todo.
+  Con varios procesos (WEB_CONCURRENCY > 1, o el despliegue del Procfile con
+  el proceso 'sse' aparte: EVENTOS_SSE_SEPARADO=1 en TODOS sus procesos) el
+  backend local numeraría los eventos por proceso y no vería los de los demás:
+  comprobar_backend() impide arrancar cualquiera de ellos sin Redis accesible.
+- Canales: 'cliente:<id>', 'montador:<id>' y 'zona:<zona_clave>' (trabajos
+  pendientes nuevos o retirados). Se puede suscribir por prefijo: 'zona:*'.
+- Búfer de repetición (EVENTOS_BUFER): al reconectar con Last-Event-ID se
+  reenvían los eventos perdidos, o 'resync' si ya no están en el búfer.
+Los eventos se encolan en la sesión y se publican DESPUÉS del commit: nunca se
+anuncia un cambio que luego hizo rollback.
+"""
+import itertools
+import json
+import os
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .redis_client import obtener_redis, obtener_redis_suscripciones
+
+TAMANO_BUFER = int(os.getenv('EVENTOS_BUFER', '1000'))
+TAMANO_COLA = 200  # eventos sin leer por conexión antes de forzar 'resync'
+CANAL_REDIS = 'kiq:eventos'
+_CLAVE_PENDIENTES = 'eventos_pendientes'
+
+
+def _a_json(valor):
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return str(valor)
+
+
+class BackendLocal:
+    """Entrega directa dentro del proceso (sustituto de Redis en pruebas)."""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._entregar = None
+
+    def iniciar(self, entregar):
+        """Registra la función que reparte cada evento recibido."""
+        self._entregar = entregar
+
+    def publicar(self, canales, tipo, datos):
+        """Asigna id y entrega en este mismo proceso."""
+        with self._lock:
+            evento_id = next(self._ids)
+        self._entregar({'id': evento_id, 'canales': canales, 'tipo': tipo, 'datos': datos})
+
+
+class BackendRedis:
+    """
+    PUBLISH/SUBSCRIBE: ids globales con INCR y un hilo oyente por proceso.
+    'cliente' (timeouts cortos) para los comandos; 'cliente_pubsub' (sin
+    socket_timeout) para la conexión que espera en listen().
+    """
+
+    CLAVE_ID = 'kiq:eventos:id'
+
+    def __init__(self, cliente, cliente_pubsub):
+        self.cliente = cliente
+        self.cliente_pubsub = cliente_pubsub
+        self._entregar = None
+
+    def iniciar(self, entregar):
+        """Arranca el hilo que escucha el canal de Redis."""
+        self._entregar = entregar
+        threading.Thread(target=self._escuchar, name='kiq-eventos-redis', daemon=True).start()
+
+    def publicar(self, canales, tipo, datos):
+        """Id global (INCR) + PUBLISH; cada proceso lo reparte al recibirlo."""
+        evento = {'id': self.cliente.incr(self.CLAVE_ID), 'canales': canales,
+                  'tipo': tipo, 'datos': datos}
+        self.cliente.publish(CANAL_REDIS, json.dumps(evento, default=_a_json))
+
+    def _escuchar(self):
+        while True:
+            try:
+                suscripcion = self.cliente_pubsub.pubsub(ignore_subscribe_messages=True)
+                suscripcion.subscribe(CANAL_REDIS)
+                for mensaje in suscripcion.listen():
+                    if mensaje.get('type') == 'message':
+                        self._entregar(json.loads(mensaje['data']))
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"⚠️ Hub de eventos: conexión con Redis perdida ({e}). Reintentando...")
+                threading.Event().wait(2)
+
+
+class Suscripcion:
+    """Una conexión SSE: sus canales y su cola de eventos."""
+
+    def __init__(self, canales):
+        self.canales = tuple(canales)
+        self.cola = queue.Queue(maxsize=TAMANO_COLA)
+        self.desbordada = False
+
+    def acepta(self, evento):
+        """True si algún canal del evento coincide (exacto o por prefijo 'x:*')."""
+        for mio in self.canales:
+            for canal in evento['canales']:
+                if canal == mio or (mio.endswith('*') and canal.startswith(mio[:-1])):
+                    return True
+        return False
+
+
+class HubEventos:
+    """Reparte los eventos a las suscripciones de este proceso y guarda el búfer."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._suscripciones = set()
+        self._bufer = deque(maxlen=TAMANO_BUFER)
+        self._lock = threading.Lock()
+        backend.iniciar(self._entregar)
+
+    def publicar(self, canales, tipo, datos):
+        """Publica ya (usar encolar() dentro de una transacción)."""
+        self.backend.publicar(list(canales), tipo, datos)
+
+    def suscribir(self, canales, ultimo_id=None):
+        """
+        Registra una conexión. Devuelve (suscripcion, perdidos, resync):
+        los eventos del búfer posteriores a ultimo_id y si hay un hueco.
+        """
+        suscripcion = Suscripcion(canales)
+        with self._lock:
+            self._suscripciones.add(suscripcion)
+            if ultimo_id is None:
+                return suscripcion, [], False
+            # Hueco: el búfer ya no llega tan atrás, o el id es de antes de un reinicio
+            resync = not self._bufer or not (
+                self._bufer[0]['id'] <= ultimo_id + 1 and ultimo_id <= self._bufer[-1]['id']
+            )
+            perdidos = [e for e in self._bufer if e['id'] > ultimo_id and suscripcion.acepta(e)]
+        return suscripcion, perdidos, resync
+
+    def cancelar(self, suscripcion):
+        """Da de baja la conexión."""
+        with self._lock:
+            self._suscripciones.discard(suscripcion)
+
+    def conexiones(self):
+        """Nº de conexiones SSE abiertas en este proceso."""
+        with self._lock:
+            return len(self._suscripciones)
+
+    def _entregar(self, evento):
+        with self._lock:
+            self._bufer.append(evento)
+            destinatarios = [s for s in self._suscripciones if s.acepta(evento)]
+        for suscripcion in destinatarios:
+            try:
+                suscripcion.cola.put_nowait(evento)
+            except queue.Full:
+                # Cliente demasiado lento: se le pedirá recargar en vez de crecer sin límite
+                suscripcion.desbordada = True
+
+
+# Un hub por proceso (se recrea tras el fork de Gunicorn; evita 'global')
+_ESTADO = {'hub': None, 'pid': None}
+_LOCK = threading.Lock()
+
+
+def obtener_hub():
+    """Hub de este proceso (lo crea con el backend configurado)."""
+    with _LOCK:
+        if _ESTADO['hub'] is None or _ESTADO['pid'] != os.getpid():
+            cliente = obtener_redis() if os.getenv('EVENTOS_BACKEND') == 'redis' else None
+            if cliente is not None and not hasattr(cliente, 'pubsub'):
+                cliente = None  # RedisFalso (memory://) no tiene PUB/SUB
+            backend = BackendRedis(cliente, obtener_redis_suscripciones()) \
+                if cliente else BackendLocal()
+            _ESTADO['hub'] = HubEventos(backend)
+            _ESTADO['pid'] = os.getpid()
+        return _ESTADO['hub']
+
+
+def procesos_multiples():
+    """
+    True si los eventos cruzan procesos: varios workers, o el despliegue con el
+    proceso 'sse' aparte (lo publica 'web', lo entrega 'sse').
+    """
+    return int(os.getenv('WEB_CONCURRENCY') or 1) > 1 or \
+        os.getenv('EVENTOS_SSE_SEPARADO') == '1' or os.getenv('EVENTOS_PROCESO_SSE') == '1'
+
+
+def comprobar_backend():
+    """Al arrancar: con varios procesos exige Redis y que responda (si no, RuntimeError)."""
+    if not procesos_multiples():
+        return
+    mensaje = ("Eventos en tiempo real con varios procesos: configura EVENTOS_BACKEND=redis "
+               "y un REDIS_URL accesible (el backend local solo sirve con un único proceso).")
+    backend = obtener_hub().backend
+    if not isinstance(backend, BackendRedis):
+        raise RuntimeError(mensaje)
+    try:
+        backend.cliente.ping()
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        raise RuntimeError(f"{mensaje} Redis no responde: {e}") from e
+
+
+def formatear_sse(evento):
+    """Evento -> bloque de texto SSE (id, event, data)."""
+    datos = json.dumps(evento['datos'], default=_a_json, ensure_ascii=False)
+    return f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {datos}\n\n"
+
+
+# --- PUBLICACIÓN TRAS EL COMMIT ---
+
+def encolar(session, canales, tipo, datos):
+    """Programa el evento para cuando la transacción de 'session' haga commit."""
+    session.info.setdefault(_CLAVE_PENDIENTES, []).append((canales, tipo, datos))
+
+
+def _publicar_pendientes(session):
+    pendientes = session.info.pop(_CLAVE_PENDIENTES, None)
+    if not pendientes:
+        return
+    try:
+        hub = obtener_hub()
+        for canales, tipo, datos in pendientes:
+            hub.publicar(canales, tipo, datos)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        # Los paneles se recuperan con la siguiente carga/sincronización
+        print(f"⚠️ No se pudieron publicar {len(pendientes)} eventos: {e}")
+
+
+def _descartar_pendientes(session, _transaccion_anterior):
+    session.info.pop(_CLAVE_PENDIENTES, None)
+
+
+event.listen(Session, 'after_commit', _publicar_pendientes)
+event.listen(Session, 'after_soft_rollback', _descartar_pendientes)
@@ -0,0 +1,78 @@
+"""
+Exportaciones en streaming (NDJSON / CSV) para el panel admin.
+Las filas se leen de la BD por bloques (yield_per) y se envían al cliente
+según se generan: la memoria no crece con el número de filas y el primer
+byte (cabecera) sale inmediatamente.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from flask import Response, stream_with_context
+
+FORMATOS = ('ndjson', 'csv')
+# Tamaño aproximado de cada trozo enviado (menos llamadas a write del servidor)
+BYTES_POR_TROZO = 64 * 1024
+
+
+def _a_texto(valor):
+    return valor.isoformat() if isinstance(valor, datetime) else valor
+
+
+def _generar_ndjson(filas, convertir):
+    trozo = []
+    tamano = 0
+    for fila in filas:
+        linea = json.dumps(convertir(fila), ensure_ascii=False, default=_a_texto) + '\n'
+        trozo.append(linea)
+        tamano += len(linea)
+        if tamano >= BYTES_POR_TROZO:
+            yield ''.join(trozo)
+            trozo, tamano = [], 0
+    if trozo:
+        yield ''.join(trozo)
+
+
+def _generar_csv(filas, convertir, columnas):
+    buffer = io.StringIO()
+    escritor = csv.DictWriter(buffer, fieldnames=columnas, extrasaction='ignore')
+    # BOM para que Excel abra bien las tildes; la cabecera sale en el primer trozo
+    buffer.write('\ufeff')
+    escritor.writeheader()
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    for fila in filas:
+        escritor.writerow({k: _a_texto(v) for k, v in convertir(fila).items()})
+        if buffer.tell() >= BYTES_POR_TROZO:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def respuesta_exportacion(nombre, filas, convertir, columnas, formato='ndjson'):
+    """
+    Respuesta HTTP en streaming.
+    - filas: iterable perezoso (p. ej. consulta.yield_per(1000)).
+    - convertir: fila -> dict.
+    - columnas: orden de columnas del CSV.
+    """
+    if formato == 'csv':
+        cuerpo = _generar_csv(filas, convertir, columnas)
+        tipo = 'text/csv; charset=utf-8'
+    else:
+        cuerpo = _generar_ndjson(filas, convertir)
+        tipo = 'application/x-ndjson; charset=utf-8'
+
+    fecha = datetime.utcnow().strftime('%Y%m%d')
+    respuesta = Response(stream_with_context(cuerpo), content_type=tipo)
+    respuesta.headers['Content-Disposition'] = (
+        f'attachment; filename="{nombre}_{fecha}.{formato}"'
+    )
+    # Evita que un proxy (nginx/Render) acumule la respuesta entera
+    respuesta.headers['X-Accel-Buffering'] = 'no'
+    return respuesta
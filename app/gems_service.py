@@ -116,6 +116,62 @@ def actualizar_gemas(wallet_id, cantidad, tipo_transaccion, descripcion, trabajo
     return True
 
 
+def debitar_gemas_montador(montador_id, cantidad, descripcion, trabajo_id=None):
+    """
+    Débito ATÓMICO de la wallet de un montador, sin lectura previa:
+    UPDATE wallet SET saldo = saldo - :c WHERE montador_id = :m AND saldo >= :c.
+    Dos débitos concurrentes no pueden dejar el saldo en negativo (la condición
+    se evalúa sobre la fila bloqueada). Añade el movimiento, pero NO hace commit.
+
+    :param cantidad: Positivo (gemas a descontar).
+    :return: True si se debitó, False si no hay wallet o el saldo es insuficiente.
+    """
+    tabla = Wallet.__table__
+    wallet_id = db.session.execute(
+        tabla.update().where(
+            tabla.c.montador_id == montador_id,
+            tabla.c.saldo >= cantidad
+        ).values(saldo=tabla.c.saldo - cantidad).returning(tabla.c.id)
+    ).scalar()
+    if wallet_id is None:
+        return False
+
+    db.session.add(GemTransaction(
+        wallet_id=wallet_id,
+        cantidad=-cantidad,
+        tipo='PAGO_SERVICIO',
+        descripcion=descripcion,
+        trabajo_id=trabajo_id
+    ))
+    return True
+
+
+def abonar_gemas_montador(montador_id, cantidad, descripcion, trabajo_id=None):
+    """
+    Crédito ATÓMICO (UPDATE saldo = saldo + :c) en la wallet de un montador,
+    sin lectura previa. Añade el movimiento, pero NO hace commit.
+
+    :return: True si se abonó, False si el montador no tiene wallet.
+    """
+    tabla = Wallet.__table__
+    wallet_id = db.session.execute(
+        tabla.update().where(tabla.c.montador_id == montador_id).values(
+            saldo=tabla.c.saldo + cantidad
+        ).returning(tabla.c.id)
+    ).scalar()
+    if wallet_id is None:
+        return False
+
+    db.session.add(GemTransaction(
+        wallet_id=wallet_id,
+        cantidad=cantidad,
+        tipo='RECARGA',
+        descripcion=descripcion,
+        trabajo_id=trabajo_id
+    ))
+    return True
+
+
 # --- Funciones de utilidad que usan actualizar_gemas ---
 
 def pagar_comision_servicio(wallet_id, coste_gemas, trabajo_id):
@@ -0,0 +1,217 @@
+"""
+Geolocalización offline de trabajos (sin llamadas a APIs externas).
+- geocodificar(): dirección libre -> (lat, lng) con un nomenclátor local de la
+  provincia de Málaga (y capitales andaluzas) o el código postal.
+- Geohash (base32) guardado en cada trabajo: los trabajos cercanos comparten
+  prefijo, así que "cerca de X" es un escaneo de rangos sobre un índice.
+- Distancia equirectangular calculable dentro del SQL (sin sqrt, al cuadrado).
+Los trabajos se geocodifican al guardarse (eventos del ORM).
+"""
+import math
+import re
+
+from sqlalchemy import and_, event, inspect, or_
+
+from .models import Trabajo
+from .zonas import normalizar_zona
+
+KM_POR_GRADO = 111.32
+PRECISION_GEOHASH = 7  # celdas de ~150 m
+RADIO_POR_DEFECTO_KM = 25.0
+MAX_CELDAS_COBERTURA = 16
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Nomenclátor: nombre normalizado -> (lat, lng)
+NOMENCLATOR = {
+    # Málaga capital y barrios
+    'malaga': (36.7213, -4.4214),
+    'teatinos': (36.7190, -4.4730),
+    'churriana': (36.6660, -4.5015),
+    'campanillas': (36.7380, -4.5620),
+    'el palo': (36.7220, -4.3640),
+    'pedregalejo': (36.7210, -4.3830),
+    'puerto de la torre': (36.7440, -4.4960),
+    'ciudad jardin': (36.7360, -4.4270),
+    'carretera de cadiz': (36.7000, -4.4480),
+    # Costa del Sol occidental
+    'torremolinos': (36.6218, -4.4998),
+    'benalmadena': (36.5989, -4.5168),
+    'arroyo de la miel': (36.6010, -4.5333),
+    'fuengirola': (36.5396, -4.6247),
+    'mijas': (36.5958, -4.6373),
+    'las lagunas': (36.5560, -4.6460),
+    'marbella': (36.5101, -4.8825),
+    'puerto banus': (36.4869, -4.9527),
+    'nueva andalucia': (36.4983, -4.9517),
+    'san pedro alcantara': (36.4854, -4.9917),
+    'san pedro de alcantara': (36.4854, -4.9917),
+    'benahavis': (36.5236, -5.0460),
+    'estepona': (36.4276, -5.1459),
+    'casares': (36.4450, -5.2740),
+    'manilva': (36.3768, -5.2503),
+    'ojen': (36.5657, -4.8560),
+    'istan': (36.5827, -4.9486),
+    # Valle del Guadalhorce e interior
+    'alhaurin de la torre': (36.6633, -4.5617),
+    'alhaurin el grande': (36.6423, -4.6870),
+    'cartama': (36.7102, -4.6327),
+    'coin': (36.6592, -4.7569),
+    'alora': (36.8233, -4.7040),
+    'pizarra': (36.7667, -4.7104),
+    'almogia': (36.8276, -4.5402),
+    'casabermeja': (36.8929, -4.4284),
+    'colmenar': (36.9047, -4.3352),
+    'antequera': (37.0194, -4.5612),
+    'archidona': (37.0964, -4.3885),
+    'ronda': (36.7423, -5.1671),
+    # Axarquía
+    'rincon de la victoria': (36.7177, -4.2775),
+    'velez malaga': (36.7808, -4.1006),
+    'torre del mar': (36.7413, -4.0934),
+    'algarrobo': (36.7717, -4.0426),
+    'torrox': (36.7583, -3.9526),
+    'nerja': (36.7582, -3.8749),
+    'frigiliana': (36.7895, -3.8960),
+    'competa': (36.8335, -3.9738),
+    # Capitales andaluzas y otras
+    'sevilla': (37.3891, -5.9845),
+    'granada': (37.1773, -3.5986),
+    'cordoba': (37.8882, -4.7794),
+    'cadiz': (36.5271, -6.2886),
+    'jerez de la frontera': (36.6850, -6.1261),
+    'algeciras': (36.1408, -5.4562),
+    'almeria': (36.8340, -2.4637),
+    'jaen': (37.7796, -3.7849),
+    'huelva': (37.2614, -6.9447),
+}
+# Los nombres más largos primero ("velez malaga" antes que "malaga")
+_NOMBRES = sorted(NOMENCLATOR, key=len, reverse=True)
+# Código postal de Málaga capital (29001-29018)
+_CP_MALAGA_CAPITAL = re.compile(r'\b290(0[1-9]|1[0-8])\b')
+
+
+def geocodificar(direccion):
+    """Dirección libre -> (lat, lng), o None si no se reconoce ninguna localidad."""
+    texto = ' ' + re.sub(r'[^a-z0-9]+', ' ', normalizar_zona(direccion)) + ' '
+    for nombre in _NOMBRES:
+        if f' {nombre} ' in texto:
+            return NOMENCLATOR[nombre]
+    if _CP_MALAGA_CAPITAL.search(direccion or ''):
+        return NOMENCLATOR['malaga']
+    return None
+
+
+# --- GEOHASH ---
+
+def codificar_geohash(lat, lng, precision=PRECISION_GEOHASH):
+    """Geohash estándar en base32."""
+    rango_lat, rango_lng = [-90.0, 90.0], [-180.0, 180.0]
+    resultado, bits, valor, es_lng = [], 0, 0, True
+    while len(resultado) < precision:
+        rango, coordenada = (rango_lng, lng) if es_lng else (rango_lat, lat)
+        medio = (rango[0] + rango[1]) / 2
+        valor <<= 1
+        if coordenada >= medio:
+            valor |= 1
+            rango[0] = medio
+        else:
+            rango[1] = medio
+        es_lng = not es_lng
+        bits += 1
+        if bits == 5:
+            resultado.append(_BASE32[valor])
+            bits, valor = 0, 0
+    return ''.join(resultado)
+
+
+def _tamano_celda(precision):
+    """(alto, ancho) en grados de una celda geohash."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def prefijos_cobertura(lat, lng, radio_km):
+    """
+    Prefijos geohash cuyas celdas cubren el círculo (su caja envolvente).
+    Se elige la precisión más fina que no pase de MAX_CELDAS_COBERTURA celdas.
+    """
+    dlat = radio_km / KM_POR_GRADO
+    dlng = radio_km / (KM_POR_GRADO * max(math.cos(math.radians(lat)), 0.01))
+    lat_min, lat_max = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    lng_min, lng_max = max(lng - dlng, -180.0), min(lng + dlng, 180.0)
+
+    for precision in range(PRECISION_GEOHASH, 0, -1):
+        alto, ancho = _tamano_celda(precision)
+        filas = math.ceil((lat_max - lat_min) / alto) + 1
+        columnas = math.ceil((lng_max - lng_min) / ancho) + 1
+        if filas * columnas <= MAX_CELDAS_COBERTURA or precision == 1:
+            break
+
+    prefijos = set()
+    for i in range(filas + 1):
+        lat_i = min(lat_min + i * alto, lat_max)
+        for j in range(columnas + 1):
+            lng_i = min(lng_min + j * ancho, lng_max)
+            prefijos.add(codificar_geohash(lat_i, lng_i, precision))
+    return sorted(prefijos)
+
+
+def _siguiente_prefijo(prefijo):
+    """
+    Menor geohash que ya no empieza por 'prefijo' ('u6z' -> 'u7'), o None si no
+    hay (todo 'z'). Solo usa caracteres del alfabeto base32, así que el rango no
+    depende de la collation de la base de datos (un '{' sí dependería).
+    """
+    while prefijo and prefijo[-1] == _BASE32[-1]:
+        prefijo = prefijo[:-1]
+    if not prefijo:
+        return None
+    return prefijo[:-1] + _BASE32[_BASE32.index(prefijo[-1]) + 1]
+
+
+def filtro_prefijos(columna, prefijos):
+    """OR de rangos [prefijo, siguiente prefijo) -> escaneos de rango sobre el índice."""
+    rangos = []
+    for p in prefijos:
+        siguiente = _siguiente_prefijo(p)
+        rangos.append(
+            columna >= p if siguiente is None else and_(columna >= p, columna < siguiente)
+        )
+    return or_(*rangos)
+
+
+def distancia2_sql(col_lat, col_lng, lat, lng):
+    """Distancia equirectangular al cuadrado (en grados²) como expresión SQL."""
+    k = math.cos(math.radians(lat))
+    d_lat = col_lat - lat
+    d_lng = (col_lng - lng) * k
+    return d_lat * d_lat + d_lng * d_lng
+
+
+def radio2_grados(radio_km):
+    """Radio en km -> mismo cuadrado en grados² que distancia2_sql."""
+    return (radio_km / KM_POR_GRADO) ** 2
+
+
+def km_desde_distancia2(distancia2):
+    """Inverso de distancia2_sql para mostrar la distancia en km."""
+    return round(math.sqrt(max(distancia2, 0.0)) * KM_POR_GRADO, 1)
+
+
+# --- GEOCODIFICACIÓN AL GUARDAR ---
+
+def _geocodificar_trabajo(_mapper, _connection, target):
+    """before_insert / before_update: recalcula lat/lng/geohash si cambia la dirección."""
+    direccion_cambiada = inspect(target).attrs.direccion.history.has_changes()
+    if target.geohash is not None and not direccion_cambiada:
+        return
+    coordenadas = geocodificar(target.direccion)
+    if coordenadas:
+        target.lat, target.lng = coordenadas
+        target.geohash = codificar_geohash(*coordenadas)
+    else:
+        target.lat = target.lng = target.geohash = None
+
+
+event.listen(Trabajo, 'before_insert', _geocodificar_trabajo)
+event.listen(Trabajo, 'before_update', _geocodificar_trabajo)
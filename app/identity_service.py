@@ -0,0 +1,226 @@
+"""
+Servicio de Identidad: resuelve un email a (rol, usuario) con una sola
+consulta indexada sobre la tabla 'identidad', en vez de buscar en Cliente
+y luego en Montador. Los emails se comparan normalizados (minúsculas).
+La tabla se mantiene sola con eventos de SQLAlchemy al crear/borrar usuarios.
+
+Delante de la tabla hay un filtro Bloom por proceso: si el filtro dice que un
+email NO está registrado, respondemos sin tocar la BD (caso típico del chat,
+que llama a /check-email en cada email que escribe el usuario).
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+
+from sqlalchemy import and_, event
+
+from .extensions import db
+from .models import Identidad, Cliente, Montador
+
+
+def normalizar_email(email):
+    """Forma canónica de un email para búsquedas (sin espacios, minúsculas)."""
+    return (email or '').strip().lower()
+
+
+# --- FILTRO BLOOM (por proceso) ---
+BLOOM_TASA_FP = float(os.getenv('BLOOM_TASA_FP', '0.01'))
+# Cada cuántos segundos se incorporan los registros hechos en OTROS procesos
+BLOOM_SYNC_SEGUNDOS = float(os.getenv('BLOOM_SYNC_SEGUNDOS', '5'))
+# Ids por DEBAJO del último sincronizado que se vuelven a leer en cada sync: un
+# registro con id menor puede confirmarse después que uno mayor ya leído
+BLOOM_VENTANA_IDS = int(os.getenv('BLOOM_VENTANA_IDS', '1000'))
+# Reconstrucción completa periódica: recoge cualquier hueco que escape a la ventana
+BLOOM_RECONSTRUIR_SEGUNDOS = float(os.getenv('BLOOM_RECONSTRUIR_SEGUNDOS', '3600'))
+BLOOM_CAPACIDAD_MINIMA = 10000
+
+
+class FiltroBloom:
+    """Filtro Bloom sencillo (bytearray + doble hashing con blake2b)."""
+
+    def __init__(self, capacidad, tasa_fp=BLOOM_TASA_FP):
+        self.capacidad = capacidad
+        self.num_bits = max(8, int(-capacidad * math.log(tasa_fp) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacidad * math.log(2)))
+        self.elementos = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _posiciones(self, valor):
+        digest = hashlib.blake2b(valor.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def agregar(self, valor):
+        """Añade un valor al filtro (volver a añadir uno que ya estaba no cuenta)."""
+        nuevo = False
+        for pos in self._posiciones(valor):
+            byte, bit = pos >> 3, 1 << (pos & 7)
+            if not self._bits[byte] & bit:
+                self._bits[byte] |= bit
+                nuevo = True
+        self.elementos += nuevo
+
+    def __contains__(self, valor):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._posiciones(valor))
+
+
+# Estado mutable del proceso en diccionarios (evita 'global', como en nlp_engine)
+_FILTRO = {'bloom': None, 'ultimo_id': 0, 'sincronizado': 0.0, 'reconstruido': 0.0}
+_METRICAS = {'consultas': 0, 'descartes': 0, 'posibles': 0, 'falsos_positivos': 0}
+_LOCK = threading.Lock()
+
+
+def reconstruir_filtro():
+    """Crea el filtro desde cero con todas las identidades (arranque del proceso)."""
+    total = db.session.query(db.func.count(Identidad.id)).scalar() or 0
+    bloom = FiltroBloom(max(total * 2, BLOOM_CAPACIDAD_MINIMA))
+    ultimo_id = 0
+    consulta = db.session.query(Identidad.id, Identidad.email_normalizado).order_by(
+        Identidad.id
+    ).yield_per(5000)
+    for identidad_id, email_normalizado in consulta:
+        bloom.agregar(email_normalizado)
+        ultimo_id = identidad_id
+
+    with _LOCK:
+        ahora = time.monotonic()
+        _FILTRO.update(bloom=bloom, ultimo_id=ultimo_id, sincronizado=ahora, reconstruido=ahora)
+    print(f"🌸 Filtro Bloom de emails listo: {bloom.elementos} emails, "
+          f"{bloom.num_bits // 8 // 1024} KB")
+
+
+def _sincronizar_filtro():
+    """
+    Incorpora los emails registrados en otros procesos (1 consulta cada
+    BLOOM_SYNC_SEGUNDOS). Relee los últimos BLOOM_VENTANA_IDS ids ya vistos:
+    un id menor que se confirma tarde no se queda fuera del filtro (sería un
+    falso negativo: "email nuevo" para uno ya registrado).
+    """
+    ahora = time.monotonic()
+    if _FILTRO['bloom'] is None or \
+            ahora - _FILTRO['reconstruido'] >= BLOOM_RECONSTRUIR_SEGUNDOS:
+        reconstruir_filtro()
+        return
+    if ahora - _FILTRO['sincronizado'] < BLOOM_SYNC_SEGUNDOS:
+        return
+
+    nuevos = db.session.query(Identidad.id, Identidad.email_normalizado).filter(
+        Identidad.id > _FILTRO['ultimo_id'] - BLOOM_VENTANA_IDS
+    ).order_by(Identidad.id).all()
+
+    with _LOCK:
+        bloom = _FILTRO['bloom']
+        for identidad_id, email_normalizado in nuevos:
+            bloom.agregar(email_normalizado)
+            _FILTRO['ultimo_id'] = max(_FILTRO['ultimo_id'], identidad_id)
+        _FILTRO['sincronizado'] = time.monotonic()
+
+    # Si el filtro se llena, su tasa de falsos positivos se dispara: se rehace
+    if bloom.elementos > bloom.capacidad:
+        reconstruir_filtro()
+
+
+def existe_email(email):
+    """
+    True si el email ya pertenece a un Cliente o Montador.
+    El filtro Bloom descarta sin BD los emails nuevos; solo los "posibles"
+    bajan a la consulta indexada sobre 'identidad'.
+    """
+    email_normalizado = normalizar_email(email)
+    _sincronizar_filtro()
+
+    if email_normalizado not in _FILTRO['bloom']:
+        with _LOCK:
+            _METRICAS['consultas'] += 1
+            _METRICAS['descartes'] += 1
+        return False
+
+    existe = db.session.query(Identidad.id).filter_by(
+        email_normalizado=email_normalizado
+    ).first() is not None
+
+    with _LOCK:
+        _METRICAS['consultas'] += 1
+        _METRICAS['posibles'] += 1
+        if not existe:
+            _METRICAS['falsos_positivos'] += 1
+    return existe
+
+
+def metricas_filtro():
+    """Contadores del filtro Bloom de este proceso (para el panel admin)."""
+    with _LOCK:
+        datos = dict(_METRICAS)
+        bloom = _FILTRO['bloom']
+
+    negativos_reales = datos['descartes'] + datos['falsos_positivos']
+    datos['tasa_falsos_positivos'] = (
+        round(datos['falsos_positivos'] / negativos_reales, 4) if negativos_reales else 0.0
+    )
+    datos['tasa_fp_objetivo'] = BLOOM_TASA_FP
+    if bloom:
+        datos.update(
+            elementos=bloom.elementos,
+            capacidad=bloom.capacidad,
+            bits=bloom.num_bits,
+            hashes=bloom.num_hashes
+        )
+    return datos
+
+
+def buscar_usuario_por_email(email):
+    """
+    Devuelve (rol, usuario) para el email, o (None, None) si no existe.
+    Una sola consulta: identidad + LEFT JOIN a la tabla que corresponda.
+    """
+    fila = db.session.query(Identidad.rol, Cliente, Montador).outerjoin(
+        Cliente, and_(Identidad.rol == 'cliente', Cliente.id == Identidad.usuario_id)
+    ).outerjoin(
+        Montador, and_(Identidad.rol == 'montador', Montador.id == Identidad.usuario_id)
+    ).filter(
+        Identidad.email_normalizado == normalizar_email(email)
+    ).first()
+
+    if not fila:
+        return None, None
+
+    rol, cliente, montador = fila
+    usuario = cliente if rol == 'cliente' else montador
+    if usuario is None:
+        return None, None
+    return rol, usuario
+
+
+# --- MANTENIMIENTO AUTOMÁTICO (se ejecuta dentro del mismo flush/transacción) ---
+
+def _registrar_identidad(rol):
+    def _after_insert(_mapper, connection, target):
+        email_normalizado = normalizar_email(target.email)
+        connection.execute(Identidad.__table__.insert().values(
+            email_normalizado=email_normalizado,
+            rol=rol,
+            usuario_id=target.id
+        ))
+        # Si luego hay rollback solo queda un falso positivo (inofensivo)
+        with _LOCK:
+            if _FILTRO['bloom'] is not None:
+                _FILTRO['bloom'].agregar(email_normalizado)
+    return _after_insert
+
+
+def _borrar_identidad(rol):
+    def _after_delete(_mapper, connection, target):
+        connection.execute(Identidad.__table__.delete().where(and_(
+            Identidad.__table__.c.rol == rol,
+            Identidad.__table__.c.usuario_id == target.id
+        )))
+    return _after_delete
+
+
+event.listen(Cliente, 'after_insert', _registrar_identidad('cliente'))
+event.listen(Montador, 'after_insert', _registrar_identidad('montador'))
+event.listen(Cliente, 'after_delete', _borrar_identidad('cliente'))
+event.listen(Montador, 'after_delete', _borrar_identidad('montador'))
@@ -1,13 +1,15 @@
 """
 Define los modelos de la base de datos para la aplicación.
-Incluye Link, Cliente, Trabajo, Montador, Sistema de Gemas, Verificación, PRODUCTOS y PEDIDOS.
+Incluye Link, Cliente, Trabajo, Montador, Identidad, Sistema de Gemas, Verificación,
+Tokens Revocados, Outbox de Emails, Partidas, Bajas y Contadores de Trabajos, PRODUCTOS, PEDIDOS
+y CHAT del Outlet.
 """
 from datetime import datetime
 import random
-from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import UniqueConstraint # <--- IMPORTANTE
 # Imports locales
 from .extensions import db
+from .password_service import generar_hash, verificar_password
 
 
 # --- MODELO DE VERIFICACIÓN (Code) ---
@@ -18,7 +20,7 @@ class Code(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), nullable=False, index=True)
     code = db.Column(db.String(6), nullable=False)
-    expires_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def is_valid(self):
@@ -31,6 +33,57 @@ class Code(db.Model):
         return str(random.randint(100000, 999999))
 
 
+# --- TOKENS REVOCADOS (Refresh JWT) ---
+class TokenRevocado(db.Model):
+    """
+    Refresh tokens revocados (rotación y logout).
+    Se cargan en memoria al arrancar; las filas caducadas se purgan solas.
+    """
+    __tablename__ = 'token_revocado'
+
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), unique=True, nullable=False)
+    expira_en = db.Column(db.DateTime, nullable=False, index=True)
+    revocado_en = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<TokenRevocado {self.jti}>"
+
+
+# --- OUTBOX DE EMAILS ---
+class EmailOutbox(db.Model):
+    """
+    Cola persistente de emails pendientes de envío.
+    Las rutas solo insertan filas; el worker de email_worker.py las entrega
+    con reintentos, así ningún correo se pierde si el proveedor cae.
+    """
+    __tablename__ = 'email_outbox'
+    ESTADOS_OUTBOX = ['pendiente', 'enviando', 'enviado', 'fallido']
+
+    id = db.Column(db.Integer, primary_key=True)
+    destinatario = db.Column(db.String(120), nullable=False)
+    asunto = db.Column(db.String(200), nullable=False)
+    contenido_html = db.Column(db.Text, nullable=False)
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    proximo_intento = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    ultimo_error = db.Column(db.String(500), nullable=True)
+    proveedor_id = db.Column(db.String(100), nullable=True)
+    # Clave para fusionar envíos repetidos (ej: 'codigo:<email>').
+    # Si ya hay uno pendiente con la misma clave, se reemplaza en vez de duplicar.
+    clave_coalescencia = db.Column(db.String(200), nullable=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    enviado_at = db.Column(db.DateTime, nullable=True)
+
+    # El worker consulta (estado IN ('pendiente', 'enviando') AND proximo_intento <= ahora)
+    __table_args__ = (
+        db.Index('ix_email_outbox_estado_proximo', 'estado', 'proximo_intento'),
+    )
+
+    def __repr__(self):
+        return f"<EmailOutbox {self.id} -> {self.destinatario} ({self.estado})>"
+
+
 # --- MODELO DE ENLACES ---
 class Link(db.Model):
     """Modelo para los enlaces acortados de imágenes."""
@@ -79,9 +132,14 @@ class GemTransaction(db.Model):
     trabajo_id = db.Column(db.Integer, db.ForeignKey('trabajo.id'), nullable=True)
 
     # RESTRICCIÓN DE SEGURIDAD: Evita doble bono.
-    # Solo puede haber una transacción de tipo 'BONO_REGISTRO' por wallet.
+    # Solo puede haber una transacción de tipo 'BONO_REGISTRO' por wallet
+    # (índice parcial: el resto de tipos, p. ej. comisiones, se repiten).
     __table_args__ = (
-        UniqueConstraint('wallet_id', 'tipo', name='uq_wallet_tipo_bono'),
+        db.Index(
+            'uq_wallet_bono_registro', 'wallet_id', unique=True,
+            postgresql_where=db.text("tipo = 'BONO_REGISTRO'"),
+            sqlite_where=db.text("tipo = 'BONO_REGISTRO'")
+        ),
     )
 
     def __repr__(self):
@@ -90,6 +148,27 @@ class GemTransaction(db.Model):
 
 # --- USUARIOS ---
 
+class Identidad(db.Model):
+    """
+    Índice unificado de emails: email normalizado -> (rol, id de usuario).
+    Se mantiene solo (eventos en identity_service.py) al crear/borrar Clientes
+    y Montadores. Permite resolver login y existencia en UNA consulta indexada.
+    """
+    __tablename__ = 'identidad'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Email en minúsculas y sin espacios: el índice único es case-insensitive
+    email_normalizado = db.Column(db.String(120), unique=True, nullable=False)
+    rol = db.Column(db.String(20), nullable=False)  # 'cliente' o 'montador'
+    usuario_id = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('rol', 'usuario_id', name='uq_identidad_rol_usuario'),
+    )
+
+    def __repr__(self):
+        return f"<Identidad {self.email_normalizado} -> {self.rol} #{self.usuario_id}>"
+
 class Cliente(db.Model):
     """Modelo para los Clientes."""
     id = db.Column(db.Integer, primary_key=True)
@@ -97,7 +176,13 @@ class Cliente(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     telefono = db.Column(db.String(20))
-    fecha_registro = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    fecha_registro = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, index=True
+    )
+    # Última modificación (ETags / GET condicionales)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
     foto_url = db.Column(db.String(500), nullable=True)
     direccion = db.Column(db.String(200), nullable=True)
 
@@ -117,11 +202,11 @@ class Cliente(db.Model):
 
     def set_password(self, password):
         """Crea el hash de la contraseña."""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generar_hash(password)
 
     def check_password(self, password):
         """Verifica el hash de la contraseña."""
-        return check_password_hash(self.password_hash, password)
+        return verificar_password(self.password_hash, password)
 
 class Montador(db.Model):
     """Modelo para los Montadores."""
@@ -131,7 +216,17 @@ class Montador(db.Model):
     password_hash = db.Column(db.String(256), nullable=False)
     telefono = db.Column(db.String(20), nullable=True)
     zona_servicio = db.Column(db.String(200), nullable=True)
-    fecha_registro = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Centro y radio de servicio para el feed "cerca de mí" (ver app/geo.py)
+    centro_lat = db.Column(db.Float, nullable=True)
+    centro_lng = db.Column(db.Float, nullable=True)
+    radio_km = db.Column(db.Float, nullable=True)
+    fecha_registro = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, index=True
+    )
+    # Última modificación (ETags / GET condicionales)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
     foto_url = db.Column(db.String(500), nullable=True)
     stripe_account_id = db.Column(db.String(100), nullable=True)
 
@@ -156,11 +251,11 @@ class Montador(db.Model):
 
     def set_password(self, password):
         """Crea el hash de la contraseña."""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generar_hash(password)
 
     def check_password(self, password):
         """Verifica el hash de la contraseña."""
-        return check_password_hash(self.password_hash, password)
+        return verificar_password(self.password_hash, password)
 
     def __repr__(self):
         return f"<Montador {self.id} - {self.nombre}>"
@@ -176,10 +271,21 @@ class Trabajo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     descripcion = db.Column(db.Text, nullable=False)
     direccion = db.Column(db.String(200), nullable=False)
+    # Zona precalculada al guardar (ver app/zonas.py)
+    zona = db.Column(db.String(200), nullable=True)
+    zona_clave = db.Column(db.String(200), nullable=True, index=True)
+    # Geolocalización precalculada al guardar (ver app/geo.py)
+    lat = db.Column(db.Float, nullable=True)
+    lng = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True)
     precio_calculado = db.Column(db.Float, nullable=False)
     # Estados
     estado = db.Column(db.String(50), default='cotizacion')
     fecha_creacion = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Última modificación (ETags / GET condicionales)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
     cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=False)
     montador_id = db.Column(db.Integer, db.ForeignKey('montador.id'), nullable=True)
     payment_intent_id = db.Column(db.String(100), nullable=True, unique=True)
@@ -189,15 +295,107 @@ class Trabajo(db.Model):
     )
     imagenes_urls = db.Column(db.JSON, nullable=True)
     etiquetas = db.Column(db.JSON, nullable=True)
+    # Derivados de etiquetas al guardar (ver app/zonas.py): 'montaje' | 'outlet'
+    tipo = db.Column(
+        db.String(20), nullable=False, default='montaje', server_default='montaje', index=True
+    )
+    # Sin ForeignKey: el producto puede haberse borrado
+    outlet_product_id = db.Column(db.Integer, nullable=True, index=True)
     desglose = db.Column(db.JSON, nullable=True)
     foto_finalizacion = db.Column(db.String(512), nullable=True)
     
     # Campo legacy
     precio_estimado = db.Column(db.Float, nullable=True)
 
+    __table_args__ = (
+        # Listados paginados por cursor (panel admin)
+        db.Index('ix_trabajo_fecha_creacion_id', 'fecha_creacion', 'id'),
+        # Sincronización incremental (?since=) de los paneles
+        db.Index('ix_trabajo_cliente_updated', 'cliente_id', 'updated_at'),
+        db.Index('ix_trabajo_montador_updated', 'montador_id', 'updated_at'),
+        # Feed de trabajos disponibles (pendiente + sin montador, más recientes)
+        db.Index('ix_trabajo_feed', 'estado', 'montador_id', 'fecha_creacion'),
+        # Feed por cercanía: rangos de prefijo geohash dentro de los disponibles
+        db.Index('ix_trabajo_feed_geohash', 'estado', 'montador_id', 'geohash'),
+    )
+
     def __repr__(self):
         return f"<Trabajo {self.id} - {self.estado}>"
 
+# --- PARTIDAS PRESUPUESTADAS DE TRABAJOS ---
+class TrabajoItem(db.Model):
+    """
+    Una partida presupuestada de un trabajo (p. ej. 2 x Canapé grande).
+    Copia normalizada de desglose['muebles_cotizados'] escrita al publicar
+    (ver app/trabajo_items.py) para poder agregar con índices.
+    """
+    __tablename__ = 'trabajo_item'
+
+    id = db.Column(db.Integer, primary_key=True)
+    trabajo_id = db.Column(
+        db.Integer, db.ForeignKey('trabajo.id', ondelete='CASCADE'), nullable=False, index=True
+    )
+    tipo = db.Column(db.String(50), nullable=False)  # Clave del TARIFARIO: 'canape', 'otro'...
+    variante = db.Column(db.String(30), nullable=True)  # 'grande', 'corredera'...
+    nombre = db.Column(db.String(100), nullable=True)  # Texto mostrado ("Canapé Abatible")
+    cantidad = db.Column(db.Integer, nullable=False, default=1)
+    precio_unitario = db.Column(db.Float, nullable=True)
+    subtotal = db.Column(db.Float, nullable=True)
+    atributos = db.Column(db.JSON, nullable=True)
+    # Copia de Trabajo.fecha_creacion: los agregados por fecha no necesitan JOIN
+    fecha = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_trabajo_item_tipo_variante_fecha', 'tipo', 'variante', 'fecha'),
+        db.Index('ix_trabajo_item_fecha', 'fecha'),
+    )
+
+    def __repr__(self):
+        return f"<TrabajoItem {self.cantidad} x {self.tipo} (trabajo {self.trabajo_id})>"
+
+
+# --- BAJAS DE TRABAJOS (Tombstones para la sincronización incremental) ---
+class TrabajoBaja(db.Model):
+    """
+    Un trabajo que ha salido del listado de un usuario: borrado, o montador
+    desasignado. Los paneles que sincronizan con ?since= lo quitan de su lista.
+    """
+    __tablename__ = 'trabajo_baja'
+
+    id = db.Column(db.Integer, primary_key=True)
+    trabajo_id = db.Column(db.Integer, nullable=False)
+    # Sin ForeignKey: el trabajo (o el usuario) puede ya no existir
+    cliente_id = db.Column(db.Integer, nullable=True)
+    montador_id = db.Column(db.Integer, nullable=True)
+    motivo = db.Column(db.String(20), nullable=False, default='borrado')
+    fecha = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        db.Index('ix_trabajo_baja_cliente_fecha', 'cliente_id', 'fecha'),
+        db.Index('ix_trabajo_baja_montador_fecha', 'montador_id', 'fecha'),
+    )
+
+    def __repr__(self):
+        return f"<TrabajoBaja {self.trabajo_id} ({self.motivo})>"
+
+
+# --- CONTADORES DE TRABAJOS (desnormalizados) ---
+class ContadorTrabajos(db.Model):
+    """
+    Nº de trabajos de cada usuario por estado, mantenido en la misma transacción
+    que los cambios de Trabajo (ver app/contadores.py). Se lee por clave primaria.
+    """
+    __tablename__ = 'contador_trabajos'
+
+    rol = db.Column(db.String(20), primary_key=True)  # 'cliente' | 'montador'
+    usuario_id = db.Column(db.Integer, primary_key=True)
+    estado = db.Column(db.String(50), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ContadorTrabajos {self.rol} {self.usuario_id} {self.estado}={self.total}>"
+
+
 # --- PRODUCTOS (OUTLET) ---
 class Product(db.Model):
     """Muebles de segunda mano (Listado)."""
@@ -209,6 +407,10 @@ class Product(db.Model):
     estado = db.Column(db.String(50), default='disponible', nullable=False)
     ubicacion = db.Column(db.String(200), nullable=True)
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    # Última modificación (ETags / GET condicionales)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
     imagenes_urls = db.Column(db.JSON, nullable=True)
     cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=True)
     montador_id = db.Column(db.Integer, db.ForeignKey('montador.id'), nullable=True)
@@ -259,4 +461,75 @@ class Order(db.Model):
     )
 
     def __repr__(self):
-        return f"<Order #{self.id} - {self.total}€ - {self.estado}>"
\ No newline at end of file
+        return f"<Order #{self.id} - {self.total}€ - {self.estado}>"
+
+
+# --- CHAT DEL OUTLET ---
+class Conversacion(db.Model):
+    """
+    Chat entre un comprador (cliente o montador) y el vendedor de un producto.
+    Los mensajes van en 'mensaje'; 'trabajo_id' enlaza el Trabajo 'outlet' de la
+    venta, que solo existe si el vendedor la registró (POST .../vender).
+    """
+    __tablename__ = 'conversacion'
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    # Los ids de cliente y montador se solapan: el rol forma parte de la clave
+    comprador_rol = db.Column(db.String(20), nullable=False)  # 'cliente' | 'montador'
+    comprador_id = db.Column(db.Integer, nullable=False)
+    vendedor_id = db.Column(db.Integer, db.ForeignKey('montador.id'), nullable=False)
+    trabajo_id = db.Column(db.Integer, nullable=True)  # Venta registrada (Trabajo 'outlet') o None; sin ForeignKey
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    ultimo_mensaje_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Un chat por producto y comprador (búsqueda de iniciar-chat)
+        db.Index(
+            'uq_conversacion_producto_comprador',
+            'product_id', 'comprador_id', 'comprador_rol', unique=True
+        ),
+        # Bandejas de entrada, ordenadas por actividad
+        db.Index('ix_conversacion_vendedor_actividad', 'vendedor_id', 'ultimo_mensaje_at'),
+        db.Index(
+            'ix_conversacion_comprador_actividad',
+            'comprador_rol', 'comprador_id', 'ultimo_mensaje_at'
+        ),
+    )
+
+    def participa(self, rol, usuario_id):
+        """True si el usuario (rol, id) es el comprador o el vendedor."""
+        return (rol == self.comprador_rol and usuario_id == self.comprador_id) or \
+            (rol == 'montador' and usuario_id == self.vendedor_id)
+
+    def canales(self):
+        """Canales SSE de los dos participantes y del propio chat (long-poll)."""
+        return [
+            f'chat:{self.id}',
+            f'{self.comprador_rol}:{self.comprador_id}',
+            f'montador:{self.vendedor_id}'
+        ]
+
+    def __repr__(self):
+        return f"<Conversacion {self.id} producto={self.product_id}>"
+
+
+class Mensaje(db.Model):
+    """Un mensaje de un chat. El historial se pagina por id (keyset)."""
+    __tablename__ = 'mensaje'
+
+    id = db.Column(db.Integer, primary_key=True)
+    conversacion_id = db.Column(
+        db.Integer, db.ForeignKey('conversacion.id', ondelete='CASCADE'), nullable=False
+    )
+    autor_rol = db.Column(db.String(20), nullable=False)
+    autor_id = db.Column(db.Integer, nullable=False)
+    texto = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_mensaje_conversacion_id', 'conversacion_id', 'id'),
+    )
+
+    def __repr__(self):
+        return f"<Mensaje {self.id} chat={self.conversacion_id}>"
@@ -0,0 +1,110 @@
+"""
+Utilidades de paginación por cursor (keyset) para los listados grandes.
+En vez de OFFSET (que recorre todas las filas anteriores) se filtra por la
+última clave vista, p. ej. (fecha_creacion, id), aprovechando el índice.
+El cursor viaja como texto opaco (base64 de un JSON) en la cabecera X-Next-Cursor.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+LIMITE_POR_DEFECTO = 100
+LIMITE_MAXIMO = 500
+
+
+class CursorInvalido(ValueError):
+    """El cursor recibido no se puede decodificar."""
+
+
+def _serializar(valor):
+    if isinstance(valor, datetime):
+        return {'dt': valor.isoformat()}
+    return valor
+
+
+def _deserializar(valor):
+    if isinstance(valor, dict) and 'dt' in valor:
+        return datetime.fromisoformat(valor['dt'])
+    return valor
+
+
+def codificar_cursor(*valores):
+    """(fecha, id) -> 'eyJ...' (opaco para el frontend)."""
+    crudo = json.dumps([_serializar(v) for v in valores], separators=(',', ':'))
+    return base64.urlsafe_b64encode(crudo.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Inverso de codificar_cursor. None si no hay cursor; CursorInvalido si está mal."""
+    if not cursor:
+        return None
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        return [_deserializar(v) for v in valores]
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as e:
+        raise CursorInvalido(str(e)) from e
+
+
+def leer_limite(valor, defecto=LIMITE_POR_DEFECTO, maximo=LIMITE_MAXIMO):
+    """Tamaño de página pedido (?limite=) acotado a [1, maximo]."""
+    try:
+        return max(1, min(int(valor), maximo))
+    except (TypeError, ValueError):
+        return defecto
+
+
+def paginar_desc(consulta, columnas, cursor, limite, clave=None):
+    """
+    Aplica orden descendente por 'columnas' y el filtro keyset del cursor.
+    Devuelve (filas, siguiente_cursor). Pide limite+1 filas para saber si hay más.
+    'columnas' debe ser una clave única, p. ej. (Trabajo.fecha_creacion, Trabajo.id).
+    'clave' (opcional) extrae esos valores de una fila cuando no son atributos
+    directos, p. ej. lambda fila: (fila[0].fecha_creacion, fila[0].id).
+    """
+    valores = decodificar_cursor(cursor)
+    if valores is not None:
+        if len(valores) != len(columnas):
+            raise CursorInvalido('Número de claves incorrecto')
+        consulta = consulta.filter(tuple_(*columnas) < tuple_(*valores))
+
+    filas = consulta.order_by(*[c.desc() for c in columnas]).limit(limite + 1).all()
+
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        ultima = filas[-1]
+        valores_ultima = clave(ultima) if clave else [getattr(ultima, c.key) for c in columnas]
+        siguiente = codificar_cursor(*valores_ultima)
+    return filas, siguiente
+
+
+def paginar_asc(consulta, columnas, cursor, limite, clave):
+    """
+    Igual que paginar_desc pero en orden ascendente (p. ej. por distancia).
+    'columnas' pueden ser expresiones SQL; 'clave' es obligatoria y debe
+    devolver sus valores para una fila.
+    """
+    valores = decodificar_cursor(cursor)
+    if valores is not None:
+        if len(valores) != len(columnas):
+            raise CursorInvalido('Número de claves incorrecto')
+        consulta = consulta.filter(tuple_(*columnas) > tuple_(*valores))
+
+    filas = consulta.order_by(*[c.asc() for c in columnas]).limit(limite + 1).all()
+
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = codificar_cursor(*clave(filas[-1]))
+    return filas, siguiente
+
+
+def respuesta_paginada(respuesta, siguiente_cursor):
+    """Añade X-Next-Cursor a la respuesta (el cuerpo sigue siendo la lista)."""
+    if siguiente_cursor:
+        respuesta.headers['X-Next-Cursor'] = siguiente_cursor
+    return respuesta
@@ -0,0 +1,168 @@
+"""
+Servicio de contraseñas: el hashing (scrypt/pbkdf2 de werkzeug) se ejecuta en
+un pool de procesos acotado, fuera del hilo de la petición, para que una
+ráfaga de logins escale con los núcleos en vez de bloquear los workers.
+También mide cada hash y permite subir el coste: los hashes antiguos se
+regeneran de forma transparente en el siguiente login correcto.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+)
+
+# --- CONFIGURACIÓN ---
+# Coste objetivo en formato werkzeug: 'scrypt:32768:8:1', 'pbkdf2:sha256:600000'...
+PASSWORD_HASH_METODO = os.getenv('PASSWORD_HASH_METODO', 'scrypt:32768:8:1')
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 2)))
+# Máximo de hashes en vuelo por proceso web (el resto espera su turno)
+PASSWORD_HASH_MAX_COLA = int(
+    os.getenv('PASSWORD_HASH_MAX_COLA', str(PASSWORD_HASH_WORKERS * 4))
+)
+PASSWORD_HASH_TIMEOUT_SEGUNDOS = 10
+# Segundos que se sugieren al cliente (Retry-After) si el pool está saturado
+PASSWORD_HASH_REINTENTO_SEGUNDOS = 5
+
+# Estado por proceso (el pool se crea tras el fork de Gunicorn, por PID)
+_POOL = {'executor': None, 'pid': None}
+_POOL_LOCK = threading.Lock()
+_COLA = threading.BoundedSemaphore(PASSWORD_HASH_MAX_COLA)
+_METRICAS = {}
+_METRICAS_LOCK = threading.Lock()
+
+
+class HashingSaturado(Exception):
+    """El pool no terminó el hash a tiempo (saturado, no roto): la app responde 503."""
+
+
+def _crear_pool():
+    """
+    Pool con 'forkserver' (o 'spawn' donde no exista): hacer fork() de un worker
+    con hilos puede heredar locks tomados por otro hilo y colgar al hijo.
+    """
+    metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(
+        max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context(metodo)
+    )
+
+
+def iniciar_pool():
+    """
+    Crea el pool de este proceso. Gunicorn lo llama en post_fork (gunicorn.conf.py)
+    para que no se cree en mitad de una petición; fuera de Gunicorn se crea en el
+    primer hash.
+    """
+    _obtener_pool()
+
+
+def _obtener_pool():
+    with _POOL_LOCK:
+        if _POOL['executor'] is None or _POOL['pid'] != os.getpid():
+            _POOL['executor'] = _crear_pool()
+            _POOL['pid'] = os.getpid()
+        return _POOL['executor']
+
+
+def _descartar_pool():
+    with _POOL_LOCK:
+        if _POOL['executor'] is not None:
+            _POOL['executor'].shutdown(wait=False, cancel_futures=True)
+        _POOL['executor'] = None
+
+
+def _registrar_tiempo(operacion, milisegundos):
+    with _METRICAS_LOCK:
+        datos = _METRICAS.setdefault(
+            operacion, {'total': 0, 'ms_acumulados': 0.0, 'ms_max': 0.0, 'ms_ultimo': 0.0}
+        )
+        datos['total'] += 1
+        datos['ms_acumulados'] += milisegundos
+        datos['ms_max'] = max(datos['ms_max'], milisegundos)
+        datos['ms_ultimo'] = milisegundos
+
+
+def _ejecutar(operacion, funcion, *args):
+    """
+    Ejecuta 'funcion' en el pool (o en línea si el pool está roto).
+    Si la espera de turno o el hash tardan más de PASSWORD_HASH_TIMEOUT_SEGUNDOS
+    lanza HashingSaturado: el pool sigue vivo y NO se calcula en línea
+    (duplicaría la CPU bajo carga).
+    """
+    inicio = time.perf_counter()
+    # También la espera de turno está acotada: con la cola llena no se bloquea el hilo
+    if not _COLA.acquire(timeout=PASSWORD_HASH_TIMEOUT_SEGUNDOS):
+        print(f"⚠️ Cola de hashing llena ({operacion}), se responde 503")
+        raise HashingSaturado(operacion)
+    try:
+        futuro = _obtener_pool().submit(funcion, *args)
+        resultado = futuro.result(timeout=PASSWORD_HASH_TIMEOUT_SEGUNDOS)
+    except FuturesTimeoutError as e:
+        # Antes que OSError: en Python 3.11+ TimeoutError es subclase de OSError
+        futuro.cancel()
+        print(f"⚠️ Pool de hashing saturado ({operacion}), se responde 503")
+        raise HashingSaturado(operacion) from e
+    except (BrokenProcessPool, OSError, RuntimeError) as e:
+        print(f"⚠️ Pool de hashing no disponible, se calcula en línea: {e}")
+        _descartar_pool()
+        resultado = funcion(*args)
+    finally:
+        _COLA.release()
+    _registrar_tiempo(operacion, (time.perf_counter() - inicio) * 1000)
+    return resultado
+
+
+def generar_hash(password):
+    """Crea el hash de una contraseña con el coste configurado."""
+    return _ejecutar('generar', generate_password_hash, password, PASSWORD_HASH_METODO)
+
+
+def verificar_password(password_hash, password):
+    """Comprueba una contraseña contra su hash (fuera del hilo de la petición)."""
+    if not password_hash or not password:
+        return False
+    return _ejecutar('verificar', check_password_hash, password_hash, password)
+
+
+def _prefijo_de(metodo):
+    """
+    Parámetros tal y como werkzeug los escribe en el hash ('scrypt' ->
+    'scrypt:32768:8:1'), con sus mismos valores por defecto y sin hashear nada.
+    """
+    nombre, *args = metodo.split(':')
+    if nombre == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    if nombre == 'pbkdf2' and len(args) <= 2:
+        algoritmo = args[0] if args else 'sha256'
+        iteraciones = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{algoritmo}:{iteraciones}"
+    raise ValueError(f"PASSWORD_HASH_METODO no válido: '{metodo}'")
+
+
+# Prefijo de los hashes con el coste actual (necesita_rehash compara con él)
+PASSWORD_HASH_PREFIJO = _prefijo_de(PASSWORD_HASH_METODO)
+
+
+def necesita_rehash(password_hash):
+    """True si el hash se generó con parámetros distintos a los actuales."""
+    return password_hash.split('$', 1)[0] != PASSWORD_HASH_PREFIJO
+
+
+def metricas_hashing():
+    """Tiempos de hashing de este proceso (para el panel admin)."""
+    with _METRICAS_LOCK:
+        datos = {operacion: dict(valores) for operacion, valores in _METRICAS.items()}
+    for valores in datos.values():
+        valores['ms_medio'] = round(valores['ms_acumulados'] / valores['total'], 2)
+        valores['ms_acumulados'] = round(valores['ms_acumulados'], 2)
+        valores['ms_max'] = round(valores['ms_max'], 2)
+        valores['ms_ultimo'] = round(valores['ms_ultimo'], 2)
+    return {
+        'metodo': PASSWORD_HASH_METODO,
+        'workers': PASSWORD_HASH_WORKERS,
+        'operaciones': datos
+    }
@@ -0,0 +1,192 @@
+"""
+Limitador de peticiones con ventana deslizante (aproximación de dos ventanas fijas:
+la anterior pondera según lo que queda de ella). Se comprueba ANTES de tocar la BD,
+hashear contraseñas, enviar emails o llamar a la IA, y responde un 429 barato.
+
+Límites por IP, por email (cuerpo JSON) y por token (cabecera Authorization).
+Contadores en memoria del proceso, o compartidos en Redis si RATE_LIMIT_REDIS=1
+y hay REDIS_URL. Se desactiva con RATE_LIMIT_ACTIVO=0.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import request, jsonify
+
+from .identity_service import normalizar_email
+from .redis_client import obtener_redis
+
+RATE_LIMIT_ACTIVO = os.getenv('RATE_LIMIT_ACTIVO', '1') == '1'
+# Proxies de confianza delante de la app (Render añade 1 a X-Forwarded-For)
+RATE_LIMIT_PROXIES = int(os.getenv('RATE_LIMIT_PROXIES', '1'))
+INTERVALO_LIMPIEZA_SEGUNDOS = 60
+
+
+def _parsear_limite(limite):
+    """'10/60' -> (10 peticiones, 60 segundos)."""
+    if not limite:
+        return None
+    cantidad, segundos = limite.split('/')
+    return int(cantidad), int(segundos)
+
+
+class ContadorMemoria:
+    """Contadores por clave en un diccionario del proceso."""
+
+    def __init__(self):
+        self._ventanas = {}
+        self._lock = threading.Lock()
+        self._ultima_limpieza = time.monotonic()
+
+    def registrar(self, clave, segundos, ahora):
+        """Suma una petición y devuelve (peticiones_ventana_anterior, peticiones_actual)."""
+        inicio = int(ahora // segundos) * segundos
+        with self._lock:
+            ventana_inicio, actual, anterior = self._ventanas.get(clave, (inicio, 0, 0))
+            if ventana_inicio != inicio:
+                anterior = actual if ventana_inicio == inicio - segundos else 0
+                actual = 0
+            actual += 1
+            self._ventanas[clave] = (inicio, actual, anterior)
+
+            if ahora - self._ultima_limpieza > INTERVALO_LIMPIEZA_SEGUNDOS:
+                self._limpiar(ahora)
+        return anterior, actual
+
+    def _limpiar(self, ahora):
+        # Sin la duración de cada regla: se borra lo que lleva >1h sin actividad
+        caducadas = [c for c, (inicio, _a, _p) in self._ventanas.items() if ahora - inicio > 3600]
+        for clave in caducadas:
+            del self._ventanas[clave]
+        self._ultima_limpieza = ahora
+
+
+class ContadorRedis:
+    """Contadores compartidos entre procesos (INCR + EXPIRE por ventana)."""
+
+    PREFIJO = 'kiq:rl:'
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def registrar(self, clave, segundos, ahora):
+        """Suma una petición y devuelve (peticiones_ventana_anterior, peticiones_actual)."""
+        ventana = int(ahora // segundos)
+        clave_actual = f"{self.PREFIJO}{clave}:{ventana}"
+        actual = self.cliente.incr(clave_actual)
+        if actual == 1:
+            self.cliente.expire(clave_actual, segundos * 2)
+        anterior = self.cliente.get(f"{self.PREFIJO}{clave}:{ventana - 1}")
+        return int(anterior or 0), actual
+
+
+# Estado del proceso (evita 'global')
+_ESTADO = {'contador': None}
+_METRICAS = {}
+_LOCK = threading.Lock()
+
+
+def _obtener_contador():
+    with _LOCK:
+        if _ESTADO['contador'] is None:
+            cliente = obtener_redis() if os.getenv('RATE_LIMIT_REDIS') == '1' else None
+            _ESTADO['contador'] = ContadorRedis(cliente) if cliente else ContadorMemoria()
+        return _ESTADO['contador']
+
+
+def _comprobar(clave, limite, ahora):
+    """Devuelve 0 si se permite o los segundos a esperar si se supera el límite."""
+    cantidad, segundos = limite
+    anterior, actual = _obtener_contador().registrar(clave, segundos, ahora)
+    transcurrido = ahora % segundos
+    estimado = anterior * (segundos - transcurrido) / segundos + actual
+    if estimado <= cantidad:
+        return 0
+    if actual > cantidad:
+        return max(1, math.ceil(segundos - transcurrido))
+    # Hay que esperar a que la ventana anterior pese lo suficiente menos
+    exceso = estimado - cantidad
+    return max(1, math.ceil(exceso * segundos / max(anterior, 1)))
+
+
+def ip_cliente():
+    """IP real del cliente teniendo en cuenta los proxies de confianza."""
+    ruta = request.access_route
+    if RATE_LIMIT_PROXIES and len(ruta) >= RATE_LIMIT_PROXIES:
+        return ruta[-RATE_LIMIT_PROXIES]
+    return ruta[0] if ruta else (request.remote_addr or 'desconocida')
+
+
+def _huella(valor):
+    return hashlib.blake2b(valor.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def _registrar_metrica(nombre, rechazada):
+    with _LOCK:
+        datos = _METRICAS.setdefault(nombre, {'permitidas': 0, 'rechazadas': 0})
+        datos['rechazadas' if rechazada else 'permitidas'] += 1
+
+
+def limitar(nombre, por_ip=None, por_email=None, por_token=None):
+    """
+    Decorador de rutas. Límites en formato 'peticiones/segundos', ej: '5/600'.
+    - por_ip: IP del cliente.
+    - por_email: campo 'email' del cuerpo JSON (normalizado).
+    - por_token: cabecera Authorization (se guarda su huella, sin decodificar el JWT).
+    """
+    reglas = {
+        'ip': _parsear_limite(por_ip),
+        'email': _parsear_limite(por_email),
+        'token': _parsear_limite(por_token)
+    }
+
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            if not RATE_LIMIT_ACTIVO or request.method == 'OPTIONS':
+                return vista(*args, **kwargs)
+
+            claves = []
+            if reglas['ip']:
+                claves.append(('ip', ip_cliente()))
+            if reglas['email']:
+                datos = request.get_json(silent=True)
+                email = normalizar_email(datos.get('email')) if isinstance(datos, dict) else ''
+                if email:
+                    claves.append(('email', _huella(email)))
+            if reglas['token']:
+                cabecera = request.headers.get('Authorization', '')
+                if cabecera:
+                    claves.append(('token', _huella(cabecera)))
+
+            ahora = time.time()
+            espera = 0
+            for tipo, valor in claves:
+                espera = max(espera, _comprobar(f"{nombre}:{tipo}:{valor}", reglas[tipo], ahora))
+
+            _registrar_metrica(nombre, espera > 0)
+            if espera:
+                respuesta = jsonify({
+                    'error': 'Demasiadas peticiones. Inténtalo más tarde.',
+                    'reintentar_en': espera
+                })
+                respuesta.status_code = 429
+                respuesta.headers['Retry-After'] = str(espera)
+                return respuesta
+            return vista(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def metricas_rate_limit():
+    """Peticiones permitidas/rechazadas por regla en este proceso."""
+    with _LOCK:
+        reglas = {nombre: dict(valores) for nombre, valores in _METRICAS.items()}
+    return {
+        'activo': RATE_LIMIT_ACTIVO,
+        'backend': type(_obtener_contador()).__name__,
+        'reglas': reglas
+    }
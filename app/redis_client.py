@@ -0,0 +1,119 @@
+"""
+Cliente Redis opcional y compartido por los servicios (códigos, rate limiting...).
+Si no hay REDIS_URL o la librería 'redis' no está instalada, devuelve None y
+cada servicio usa su backend local. Con REDIS_URL=memory:// se usa RedisFalso,
+un sustituto en memoria con la misma interfaz (útil en desarrollo y pruebas).
+"""
+import os
+import threading
+import time
+
+try:
+    import redis
+except ImportError:  # Dependencia opcional
+    redis = None
+
+
+class RedisFalso:
+    """Subconjunto de comandos Redis en memoria (strings con TTL y contadores)."""
+
+    def __init__(self):
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def _vigente(self, clave):
+        valor = self._datos.get(clave)
+        if valor is None:
+            return None
+        if valor[1] is not None and valor[1] <= time.monotonic():
+            del self._datos[clave]
+            return None
+        return valor
+
+    def get(self, clave):
+        """GET clave."""
+        with self._lock:
+            valor = self._vigente(clave)
+            return valor[0] if valor else None
+
+    def set(self, clave, valor, ex=None):
+        """SET clave valor [EX segundos]."""
+        with self._lock:
+            self._datos[clave] = (str(valor), time.monotonic() + ex if ex else None)
+        return True
+
+    def delete(self, *claves):
+        """DEL clave [clave ...] -> número de claves borradas."""
+        with self._lock:
+            return sum(1 for clave in claves if self._vigente(clave) and self._datos.pop(clave))
+
+    def incr(self, clave, cantidad=1):
+        """INCRBY clave cantidad (conserva el TTL)."""
+        with self._lock:
+            valor = self._vigente(clave)
+            nuevo = int(valor[0]) + cantidad if valor else cantidad
+            self._datos[clave] = (str(nuevo), valor[1] if valor else None)
+            return nuevo
+
+    def expire(self, clave, segundos):
+        """EXPIRE clave segundos."""
+        with self._lock:
+            valor = self._vigente(clave)
+            if not valor:
+                return False
+            self._datos[clave] = (valor[0], time.monotonic() + segundos)
+            return True
+
+    def mget(self, claves):
+        """MGET clave [clave ...]."""
+        with self._lock:
+            return [valor[0] if valor else None for valor in map(self._vigente, claves)]
+
+
+# Un cliente por URL y proceso (evita 'global')
+_CLIENTES = {}
+_LOCK = threading.Lock()
+
+
+def obtener_redis(url=None):
+    """Cliente Redis para la URL (o REDIS_URL), o None si no está disponible."""
+    url = url or os.getenv('REDIS_URL')
+    if not url:
+        return None
+
+    with _LOCK:
+        if url in _CLIENTES:
+            return _CLIENTES[url]
+
+        if url.startswith('memory://'):
+            cliente = RedisFalso()
+        elif redis is None:
+            print("⚠️ REDIS_URL definido pero la librería 'redis' no está instalada")
+            cliente = None
+        else:
+            cliente = redis.Redis.from_url(
+                url, decode_responses=True, socket_timeout=2, socket_connect_timeout=2
+            )
+        _CLIENTES[url] = cliente
+        return cliente
+
+
+def obtener_redis_suscripciones(url=None):
+    """
+    Cliente para PUB/SUB, o None. La conexión queda bloqueada en listen()
+    esperando mensajes: sin socket_timeout (cortaría cada canal inactivo más
+    de 2 s y se perderían los eventos publicados mientras se reconecta).
+    Las conexiones muertas se detectan con keepalive y health_check_interval.
+    """
+    url = url or os.getenv('REDIS_URL')
+    if not url or url.startswith('memory://') or redis is None:
+        return None
+
+    with _LOCK:
+        clave = ('pubsub', url)
+        if clave not in _CLIENTES:
+            _CLIENTES[clave] = redis.Redis.from_url(
+                url, decode_responses=True, socket_connect_timeout=2,
+                socket_keepalive=True, health_check_interval=30
+            )
+        return _CLIENTES[clave]
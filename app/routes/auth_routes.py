@@ -15,7 +15,9 @@ import random
 import os   # ✅ NECESARIO para leer variables de entorno
 from datetime import datetime, timedelta
 # pylint: disable=no-name-in-module
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response
+from sqlalchemy import func, literal, or_, select, union_all
+from sqlalchemy.exc import IntegrityError
 from flask_cors import cross_origin
 import cloudinary           # ✅ NECESARIO para configurar
 import cloudinary.uploader
@@ -23,14 +25,29 @@ import cloudinary.uploader
 from flask_jwt_extended import (
     create_access_token, jwt_required, get_jwt_identity, get_jwt
 )
-from werkzeug.security import generate_password_hash, check_password_hash
 
 from app import db
 # Importamos tus modelos REALES (Agregado Wallet aquí para evitar C0415)
-from app.models import Cliente, Montador, Trabajo, Code, Wallet
+from app.models import Cliente, Montador, Trabajo, Wallet
 # IMPORTAMOS LOS SERVICIOS ROBUSTOS
-from app.email_service import enviar_codigo_verificacion, enviar_email_generico
+from app.email_service import (
+    enviar_codigo_verificacion, enviar_codigo_recuperacion, enviar_bienvenida
+)
 from app.gems_service import asignar_bono_bienvenida
+from app.password_service import (
+    generar_hash, verificar_password, necesita_rehash, metricas_hashing, HashingSaturado
+)
+from app.identity_service import (
+    existe_email, buscar_usuario_por_email, metricas_filtro
+)
+from app.token_service import emitir_tokens, revocar_token
+from app.code_store import guardar_codigo, obtener_codigo, consumir_codigo
+from app.rate_limiter import limitar, metricas_rate_limit
+from app.pagination import paginar_desc, leer_limite, respuesta_paginada
+from app.export_service import respuesta_exportacion, FORMATOS
+from app.etag import calcular_etag, respuesta_no_modificado, con_etag
+from app.geo import geocodificar
+from app.trabajo_items import resumen_items
 
 # ==========================================
 # 0. CONFIGURACIÓN CLOUDINARY (Integrada)
@@ -45,12 +62,13 @@ cloudinary.config(
 auth_bp = Blueprint('auth', __name__)
 
 # ==========================================
-# 1. SISTEMA DE CÓDIGOS (Send/Verify) - DB
+# 1. SISTEMA DE CÓDIGOS (Send/Verify) - Almacén con TTL
 # ==========================================
 
 @auth_bp.route('/auth/send-code', methods=['POST'])
+@limitar('send-code', por_ip='10/600', por_email='3/600')
 def send_verification_code():
-    """Genera y envía un código de verificación (Guardado en DB)."""
+    """Genera y envía un código de verificación (almacén de códigos con TTL)."""
     data = request.json
     email = data.get('email')
 
@@ -58,27 +76,15 @@ def send_verification_code():
         return jsonify({"error": "Email requerido"}), 400
 
     # Verificamos si ya existe para avisar al usuario
-    if (Cliente.query.filter_by(email=email).first() or
-            Montador.query.filter_by(email=email).first()):
+    if existe_email(email):
         return jsonify({
             "status": "registrado",
             "message": "Este email ya está registrado."
         }), 200
 
-    # Limpiar códigos anteriores
-    try:
-        Code.query.filter_by(email=email).delete()
-        db.session.commit()
-    except Exception: # pylint: disable=broad-exception-caught
-        db.session.rollback()
-
+    # Sustituye el código anterior (una sola operación en el almacén)
     code_str = str(random.randint(100000, 999999))
-    expires_at = datetime.utcnow() + timedelta(minutes=10)
-
-    # Guardar en DB
-    new_code = Code(email=email, code=code_str, expires_at=expires_at)
-    db.session.add(new_code)
-    db.session.commit()
+    guardar_codigo(email, code_str, minutos=10)
 
     # USAMOS EL SERVICIO CENTRALIZADO 📧
     if enviar_codigo_verificacion(email, code_str):
@@ -88,8 +94,9 @@ def send_verification_code():
 
 
 @auth_bp.route('/auth/verify-code', methods=['POST'])
+@limitar('verify-code', por_ip='30/600', por_email='10/600')
 def verify_code():
-    """Verifica si el código es correcto contra la DB."""
+    """Verifica si el código es correcto (sin consumirlo)."""
     data = request.json
     email = data.get('email')
     code_input = data.get('code')
@@ -97,17 +104,14 @@ def verify_code():
     if not email or not code_input:
         return jsonify({"error": "Faltan datos"}), 400
 
-    record = Code.query.filter_by(email=email).first()
+    codigo_guardado = obtener_codigo(email)
 
-    if not record:
+    if not codigo_guardado:
         return jsonify({"error": "Código no encontrado o expirado"}), 400
 
-    if record.code != code_input:
+    if codigo_guardado != str(code_input):
         return jsonify({"error": "Código incorrecto"}), 400
 
-    if datetime.utcnow() > record.expires_at:
-        return jsonify({"error": "El código ha caducado"}), 400
-
     return jsonify({"message": "Código correcto"}), 200
 
 
@@ -116,6 +120,7 @@ def verify_code():
 # ==========================================
 
 @auth_bp.route('/login-universal', methods=['POST'])
+@limitar('login', por_ip='20/60', por_email='10/300')
 def login_universal():
     """Login que busca en ambas tablas (Cliente y Montador)."""
     data = request.json
@@ -125,50 +130,52 @@ def login_universal():
     email = data['email']
     password = data['password']
 
-    # 1. Intentar CLIENTE
-    cliente = Cliente.query.filter_by(email=email).first()
-    if cliente and check_password_hash(cliente.password_hash, password):
-        token = create_access_token(
-            identity=str(cliente.id),
-            additional_claims={"rol": "cliente"}
-        )
+    # 1. Resolver el email en el índice de identidad (1 consulta)
+    rol, usuario = buscar_usuario_por_email(email)
+    credenciales_ok = usuario is not None and verificar_password(
+        usuario.password_hash, password
+    )
+    if credenciales_ok:
+        _actualizar_hash_si_obsoleto(usuario, password)
+
+    # 2. CLIENTE
+    if credenciales_ok and rol == 'cliente':
+        token, refresh_token = emitir_tokens(usuario.id, "cliente")
         return jsonify({
             'token': token,
+            'refresh_token': refresh_token,
             'user': {
-                'id': cliente.id,
-                'nombre': cliente.nombre,
-                'email': cliente.email,
+                'id': usuario.id,
+                'nombre': usuario.nombre,
+                'email': usuario.email,
                 'tipo': 'cliente',
-                'telefono': cliente.telefono,
-                'foto_url': cliente.foto_url
+                'telefono': usuario.telefono,
+                'foto_url': usuario.foto_url
             },
             'role': 'cliente',
             'redirect': '/panel-cliente'
         }), 200
 
-    # 2. Intentar MONTADOR
-    montador = Montador.query.filter_by(email=email).first()
-    if montador and check_password_hash(montador.password_hash, password):
-        token = create_access_token(
-            identity=str(montador.id),
-            additional_claims={"rol": "montador"}
-        )
+    # 3. MONTADOR
+    if credenciales_ok and rol == 'montador':
+        token, refresh_token = emitir_tokens(usuario.id, "montador")
         return jsonify({
             'token': token,
+            'refresh_token': refresh_token,
             'user': {
-                'id': montador.id,
-                'nombre': montador.nombre,
-                'email': montador.email,
+                'id': usuario.id,
+                'nombre': usuario.nombre,
+                'email': usuario.email,
                 'tipo': 'montador',
-                'telefono': montador.telefono,
-                'foto_url': montador.foto_url,
-                'zona': montador.zona_servicio
+                'telefono': usuario.telefono,
+                'foto_url': usuario.foto_url,
+                'zona': usuario.zona_servicio
             },
             'role': 'montador',
             'redirect': '/panel-montador'
         }), 200
 
-    # 3. Admin (Hardcoded por seguridad temporal)
+    # 4. Admin (Hardcoded por seguridad temporal)
     if email == 'admin@kiq.es' and password == 'admin123':
         token = create_access_token(identity='0', additional_claims={'rol': 'admin'})
         return jsonify({"success": True, "token": token, "role": "admin"}), 200
@@ -176,12 +183,48 @@ def login_universal():
     return jsonify({'message': 'Credenciales incorrectas'}), 401
 
 
+def _actualizar_hash_si_obsoleto(usuario, password):
+    """Re-hashea con el coste actual si el hash guardado usa parámetros antiguos."""
+    if not necesita_rehash(usuario.password_hash):
+        return
+    try:
+        usuario.password_hash = generar_hash(password)
+        db.session.commit()
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        db.session.rollback()
+        print(f"⚠️ No se pudo actualizar el hash de {usuario.email}: {e}")
+
+
 @auth_bp.route('/auth/login', methods=['POST'])
 def login_standard():
     """Alias para login universal."""
     return login_universal()
 
 
+@auth_bp.route('/auth/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh_token_rotado():
+    """
+    Renueva la sesión con el refresh token (sin contraseña ni hashing).
+    Rotación: el refresh usado queda revocado y se entrega un par nuevo.
+    """
+    claims = get_jwt()
+    if not revocar_token(claims):
+        # Otra petición ya lo usó (reintento o token robado)
+        return jsonify({'message': 'Refresh token ya utilizado'}), 401
+
+    token, refresh_token = emitir_tokens(get_jwt_identity(), claims.get('rol', 'cliente'))
+    return jsonify({'token': token, 'refresh_token': refresh_token}), 200
+
+
+@auth_bp.route('/auth/logout', methods=['POST'])
+@jwt_required(refresh=True)
+def logout():
+    """Cierra la sesión revocando el refresh token."""
+    revocar_token(get_jwt())
+    return jsonify({'message': 'Sesión cerrada'}), 200
+
+
 # ==========================================
 # 3. REGISTROS (Genérico, Montador y Cliente-Chat)
 # ==========================================
@@ -202,16 +245,15 @@ def register_montador():
     if not all([nombre, email, password, codigo_usuario]):
         return jsonify({'error': 'Faltan datos obligatorios'}), 400
 
-    # Verificar Código en DB
-    record = Code.query.filter_by(email=email).first()
-    if not record or record.code != codigo_usuario:
-        return jsonify({'error': 'Código de verificación incorrecto'}), 400
-
     # Verificar existencia
-    if (Cliente.query.filter_by(email=email).first() or
-            Montador.query.filter_by(email=email).first()):
+    if existe_email(email):
         return jsonify({'error': 'El usuario ya existe'}), 400
 
+    # Validar el código SIN consumirlo: se consume tras crear la cuenta, así un
+    # fallo al guardar (o un 503 del hashing) no obliga a pedir otro código
+    if obtener_codigo(email) != str(codigo_usuario):
+        return jsonify({'error': 'Código de verificación incorrecto'}), 400
+
     try:
         # 1. Crear el Montador
         nuevo_montador = Montador(
@@ -219,30 +261,25 @@ def register_montador():
             nombre=nombre,
             telefono=telefono,
             zona_servicio=zona,
-            password_hash=generate_password_hash(password),
+            password_hash=generar_hash(password),
             bono_entregado=True  # 🎁 Marcamos que ha recibido el bono
         )
 
         db.session.add(nuevo_montador)
         # Hacemos commit AQUÍ para asegurar que tenemos el ID
         db.session.commit()
+        consumir_codigo(email, codigo_usuario)
 
         # 2. ASIGNAR BONO DE FORMA ROBUSTA (Delegado al servicio)
         # Esto crea la wallet si no existe y asigna las gemas con seguridad
         asignar_bono_bienvenida(nuevo_montador.id, 'montador')
 
-        # 3. Limpiar código usado
-        db.session.delete(record)
-        db.session.commit()
-
-        token = create_access_token(
-            identity=str(nuevo_montador.id),
-            additional_claims={"rol": "montador"}
-        )
+        token, refresh_token = emitir_tokens(nuevo_montador.id, "montador")
 
         return jsonify({
             'message': 'Montador registrado con éxito',
             'access_token': token,
+            'refresh_token': refresh_token,
             'user': {
                 'id': nuevo_montador.id,
                 'nombre': nuevo_montador.nombre,
@@ -252,6 +289,13 @@ def register_montador():
             }
         }), 201
 
+    except IntegrityError:
+        # Registro simultáneo con el mismo email (índice único de identidad)
+        db.session.rollback()
+        return jsonify({'error': 'El usuario ya existe'}), 400
+    except HashingSaturado:
+        db.session.rollback()
+        raise  # 503 (manejador de la app)
     except Exception as e:  # pylint: disable=broad-exception-caught
         db.session.rollback()
         print(f"Error Registro Montador: {e}")
@@ -272,11 +316,10 @@ def register():
     if not email or not password or not nombre:
         return jsonify({'message': 'Faltan datos obligatorios'}), 400
 
-    if (Cliente.query.filter_by(email=email).first() or
-            Montador.query.filter_by(email=email).first()):
+    if existe_email(email):
         return jsonify({'message': 'El email ya está registrado'}), 400
 
-    hashed_pw = generate_password_hash(password)
+    hashed_pw = generar_hash(password)
 
     try:
         nuevo_usuario = None
@@ -299,14 +342,12 @@ def register():
             db.session.add(nuevo_usuario)
             db.session.commit()
 
-        token = create_access_token(
-            identity=str(nuevo_usuario.id),
-            additional_claims={"rol": tipo}
-        )
+        token, refresh_token = emitir_tokens(nuevo_usuario.id, tipo)
 
         return jsonify({
             'message': 'Usuario creado exitosamente',
             'token': token,
+            'refresh_token': refresh_token,
             'user': {
                 'id': nuevo_usuario.id,
                 'nombre': nombre,
@@ -315,6 +356,10 @@ def register():
             }
         }), 201
 
+    except IntegrityError:
+        # Registro simultáneo con el mismo email (índice único de identidad)
+        db.session.rollback()
+        return jsonify({'message': 'El email ya está registrado'}), 400
     except Exception as e:  # pylint: disable=broad-exception-caught
         db.session.rollback()
         print(f"Error genérico registro: {e}")
@@ -335,15 +380,14 @@ def publicar_y_registrar():
         if not email or not password:
             return jsonify({"error": "Faltan credenciales"}), 400
 
-        if (Cliente.query.filter_by(email=email).first() or
-                Montador.query.filter_by(email=email).first()):
+        if existe_email(email):
             return jsonify({"error": "El usuario ya existe"}), 400
 
         nuevo_cliente = Cliente(
             email=email,
             nombre=nombre,
             telefono=telefono,
-            password_hash=generate_password_hash(password)
+            password_hash=generar_hash(password)
         )
         db.session.add(nuevo_cliente)
         db.session.flush()
@@ -361,24 +405,25 @@ def publicar_y_registrar():
         db.session.add(nuevo_trabajo)
         db.session.commit()
 
-        token = create_access_token(
-            identity=str(nuevo_cliente.id),
-            additional_claims={"rol": "cliente"}
-        )
+        token, refresh_token = emitir_tokens(nuevo_cliente.id, "cliente")
 
-        # USAMOS EMAIL GENÉRICO 📧
-        enviar_email_generico(
-            email,
-            "Bienvenido a KIQ",
-            f"<h1>Hola {nombre}</h1><p>Tu cuenta y tu presupuesto han sido creados correctamente.</p>"
-        )
+        # USAMOS EL SERVICIO CENTRALIZADO 📧
+        enviar_bienvenida(email, nombre)
 
         return jsonify({
             "message": "Cuenta creada",
             "access_token": token,
+            "refresh_token": refresh_token,
             "usuario": {"nombre": nombre, "tipo": "cliente", "telefono": telefono}
         }), 201
 
+    except IntegrityError:
+        # Registro simultáneo con el mismo email (índice único de identidad)
+        db.session.rollback()
+        return jsonify({"error": "El usuario ya existe"}), 400
+    except HashingSaturado:
+        db.session.rollback()
+        raise  # 503 (manejador de la app)
     except Exception as e:  # pylint: disable=broad-exception-caught
         db.session.rollback()
         print(f"❌ Error publicar-y-registrar: {e}")
@@ -392,9 +437,10 @@ def login_y_publicar():
     email = data.get('email')
     password = data.get('password')
 
-    cliente = Cliente.query.filter_by(email=email).first()
-    if not cliente or not check_password_hash(cliente.password_hash, password):
+    rol, cliente = buscar_usuario_por_email(email)
+    if rol != 'cliente' or not verificar_password(cliente.password_hash, password):
         return jsonify({"error": "Credenciales inválidas"}), 401
+    _actualizar_hash_si_obsoleto(cliente, password)
 
     try:
         nuevo_trabajo = Trabajo(
@@ -410,11 +456,12 @@ def login_y_publicar():
         db.session.add(nuevo_trabajo)
         db.session.commit()
 
-        token = create_access_token(
-            identity=str(cliente.id),
-            additional_claims={"rol": "cliente"}
-        )
-        return jsonify({"message": "Trabajo guardado", "access_token": token}), 200
+        token, refresh_token = emitir_tokens(cliente.id, "cliente")
+        return jsonify({
+            "message": "Trabajo guardado",
+            "access_token": token,
+            "refresh_token": refresh_token
+        }), 200
 
     except Exception as e:  # pylint: disable=broad-exception-caught
         db.session.rollback()
@@ -434,37 +481,41 @@ def get_perfil():
     role = claims.get("rol", "cliente")
 
     user = None
+    saldo = None
     datos_extra = {}
 
     if role == 'cliente':
         user = Cliente.query.get(int(user_id))
     elif role == 'montador':
-        user = Montador.query.get(int(user_id))
-        if user:
-            # Si la wallet no existe (usuarios antiguos), se crea al vuelo
-            # NOTA: Aunque el registro ahora es robusto, mantenemos esto para usuarios legacy.
-            saldo = 0
-            if user.wallet:
-                saldo = user.wallet.saldo
-            else:
-                # Fallback seguridad usuarios legacy (No damos bono, solo creamos wallet vacía)
-                w = Wallet(saldo=0, montador_id=user.id)
-                db.session.add(w)
-                db.session.commit()
-                saldo = 0
-
+        # Montador + saldo en una consulta. Solo lectura: las wallets que falten
+        # (usuarios legacy) se crean con 'flask mantenimiento crear-wallets'
+        fila = db.session.query(Montador, Wallet.saldo).outerjoin(
+            Wallet, Wallet.montador_id == Montador.id
+        ).filter(Montador.id == int(user_id)).first()
+        if fila:
+            user, saldo = fila[0], fila[1] or 0
             datos_extra = {
                 "saldo_gemas": saldo,
                 "stripe_account_id": user.stripe_account_id,
                 "stripe_boarding_completado": bool(user.stripe_account_id),
                 "bono_entregado": user.bono_entregado,
-                "bono_visto": user.bono_visto
+                "bono_visto": user.bono_visto,
+                "zona_servicio": user.zona_servicio,
+                "centro_lat": user.centro_lat,
+                "centro_lng": user.centro_lng,
+                "radio_km": user.radio_km
             }
 
     if not user:
         return jsonify({"error": "Usuario no encontrado"}), 404
 
-    return jsonify({
+    # El perfil solo cambia si cambia la fila del usuario o su saldo
+    etag = calcular_etag('perfil', role, user.id, user.updated_at, saldo)
+    no_modificado = respuesta_no_modificado(etag)
+    if no_modificado:
+        return no_modificado
+
+    return con_etag(make_response(jsonify({
         "id": user.id,
         "nombre": user.nombre,
         "email": user.email,
@@ -472,7 +523,7 @@ def get_perfil():
         "telefono": getattr(user, 'telefono', ''),
         "foto_url": getattr(user, 'foto_url', None),
         **datos_extra
-    }), 200
+    }), 200), etag)
 
 
 @auth_bp.route('/perfil', methods=['PUT'])
@@ -499,10 +550,14 @@ def update_perfil():
     if 'telefono' in data:
         usuario.telefono = data['telefono']
     if 'password' in data and data['password']:
-        usuario.password_hash = generate_password_hash(data['password'])
+        usuario.password_hash = generar_hash(data['password'])
 
-    if role == 'montador' and 'zona_servicio' in data:
-        usuario.zona_servicio = data['zona_servicio']
+    if role == 'montador':
+        if 'zona_servicio' in data:
+            usuario.zona_servicio = data['zona_servicio']
+        error = _actualizar_centro_servicio(usuario, data)
+        if error:
+            return jsonify({'message': error}), 400
 
     try:
         db.session.commit()
@@ -512,48 +567,61 @@ def update_perfil():
         return jsonify({'message': f'Error al actualizar: {str(e)}'}), 500
 
 
+def _actualizar_centro_servicio(montador, data):
+    """
+    Centro y radio del feed "cerca de mí". Si cambia la zona_servicio y no se
+    manda centro, se toma el de su primera localidad reconocida (app/geo.py).
+    Devuelve un mensaje de error o None.
+    """
+    try:
+        if 'centro_lat' in data or 'centro_lng' in data:
+            lat, lng = data.get('centro_lat'), data.get('centro_lng')
+            if lat is None or lng is None:
+                montador.centro_lat = montador.centro_lng = None
+            else:
+                lat, lng = float(lat), float(lng)
+                if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                    return 'Coordenadas fuera de rango'
+                montador.centro_lat, montador.centro_lng = lat, lng
+        elif 'zona_servicio' in data:
+            centro = geocodificar(data['zona_servicio'])
+            if centro:
+                montador.centro_lat, montador.centro_lng = centro
+
+        if 'radio_km' in data:
+            radio = data['radio_km']
+            montador.radio_km = None if radio is None else float(radio)
+            if montador.radio_km is not None and montador.radio_km <= 0:
+                return 'El radio debe ser mayor que 0'
+    except (TypeError, ValueError):
+        return 'Centro o radio de servicio inválido'
+    return None
+
+
 # ==========================================
 # 5. RECUPERACIÓN DE CONTRASEÑA
 # ==========================================
 
 @auth_bp.route('/auth/reset-password-request', methods=['POST'])
+@limitar('reset-password-request', por_ip='10/600', por_email='3/900')
 def reset_password_request():
     """Pide código para resetear password."""
     data = request.json
     email = data.get('email')
 
-    usuario = (Cliente.query.filter_by(email=email).first() or
-               Montador.query.filter_by(email=email).first())
-
-    if usuario:
-        # Limpiar códigos previos
-        try:
-            Code.query.filter_by(email=email).delete()
-            db.session.commit()
-        except Exception: # pylint: disable=broad-exception-caught
-            db.session.rollback()
-
+    if existe_email(email):
         code_str = str(random.randint(100000, 999999))
-        expires_at = datetime.utcnow() + timedelta(minutes=15)
-
-        new_code = Code(email=email, code=code_str, expires_at=expires_at)
-        db.session.add(new_code)
-        db.session.commit()
+        guardar_codigo(email, code_str, minutos=15)
 
-        content = f"""
-        <h2>Recuperación KIQ</h2>
-        <p>Has solicitado restablecer tu contraseña.</p>
-        <p>Tu código de seguridad es:</p>
-        <h1 style="color: #6d28d9; letter-spacing: 5px;">{code_str}</h1>
-        """
-        # USAMOS EMAIL GENÉRICO 📧
-        enviar_email_generico(email, "Recuperar Contraseña - KIQ", content)
+        # USAMOS EL SERVICIO CENTRALIZADO 📧
+        enviar_codigo_recuperacion(email, code_str)
 
     # Respondemos siempre 200 por seguridad (para no revelar qué emails existen)
     return jsonify({'message': 'Si el email existe, se ha enviado un código.'}), 200
 
 
 @auth_bp.route('/auth/reset-password', methods=['POST'])
+@limitar('reset-password', por_ip='30/600', por_email='10/600')
 def reset_password():
     """Cambia la contraseña usando el código."""
     data = request.json
@@ -564,23 +632,17 @@ def reset_password():
     if not email or not code_input or not new_password:
         return jsonify({'error': 'Faltan datos'}), 400
 
-    # Verificación DB
-    record = Code.query.filter_by(email=email).first()
-    if not record or record.code != code_input:
-        return jsonify({'error': 'Código inválido o expirado'}), 400
-
-    cliente = Cliente.query.filter_by(email=email).first()
-    montador = Montador.query.filter_by(email=email).first()
-
-    if cliente:
-        cliente.password_hash = generate_password_hash(new_password)
-    elif montador:
-        montador.password_hash = generate_password_hash(new_password)
-    else:
+    _rol, usuario = buscar_usuario_por_email(email)
+    if not usuario:
         return jsonify({'error': 'Usuario no encontrado'}), 404
 
-    db.session.delete(record)
+    # Validar el código SIN consumirlo: se consume cuando la contraseña ya está guardada
+    if obtener_codigo(email) != str(code_input):
+        return jsonify({'error': 'Código inválido o expirado'}), 400
+
+    usuario.password_hash = generar_hash(new_password)
     db.session.commit()
+    consumir_codigo(email, code_input)  # Ya no se puede reutilizar
 
     return jsonify({'message': 'Contraseña actualizada con éxito'}), 200
 
@@ -593,8 +655,7 @@ def reset_password():
 def check_email():
     """Verifica si el email existe."""
     email = request.json.get('email')
-    if (Cliente.query.filter_by(email=email).first() or
-            Montador.query.filter_by(email=email).first()):
+    if existe_email(email):
         return jsonify({"status": "existente"}), 200
     return jsonify({"status": "nuevo"}), 200
 
@@ -607,84 +668,260 @@ def _validar_admin_token():
     token = auth_header.split(" ")[1]
     return token == 'kiq2025master'
 
+@auth_bp.route('/admin/metricas', methods=['GET'])
+def admin_get_metricas():
+    """Métricas internas de este proceso (filtro Bloom, hashing, rate limit)."""
+    if not _validar_admin_token():
+        return jsonify({'error': 'Acceso denegado. Token inválido.'}), 401
+
+    return jsonify({
+        "pid": os.getpid(),
+        "filtro_emails": metricas_filtro(),
+        "hash_passwords": metricas_hashing(),
+        "rate_limit": metricas_rate_limit()
+    }), 200
+
 @auth_bp.route('/admin/todos-los-trabajos', methods=['GET'])
 def admin_get_todos_los_trabajos():
-    """Panel Admin Seguro."""
+    """
+    Panel Admin Seguro. Una sola consulta (JOIN cliente/montador, solo las
+    columnas necesarias) paginada por cursor sobre (fecha_creacion, id).
+    Filtros opcionales: ?estado=, ?montador_id=, ?desde=AAAA-MM-DD, ?hasta=AAAA-MM-DD,
+    ?limite=. La siguiente página se pide con ?cursor=<cabecera X-Next-Cursor>.
+    """
     # Validación Estándar Bearer Token
     if not _validar_admin_token():
         return jsonify({'error': 'Acceso denegado. Token inválido.'}), 401
 
-    trabajos = Trabajo.query.order_by(Trabajo.fecha_creacion.desc()).all()
-    lista_final = []
-
-    for t in trabajos:
-        cliente = Cliente.query.get(t.cliente_id)
-        montador_nombre = "Sin asignar"
-        if t.montador_id:
-            m = Montador.query.get(t.montador_id)
-            if m:
-                montador_nombre = m.nombre
-
-        precio_final = getattr(t, 'precio_calculado', 0)
-        if hasattr(t, 'precio_estimado') and t.precio_estimado:
-            precio_final = t.precio_estimado
-
-        lista_final.append({
-            "id": t.id,
-            "fecha": t.fecha_creacion.strftime('%Y-%m-%d %H:%M'),
-            "cliente": cliente.nombre if cliente else "Desconocido",
-            "email_cliente": cliente.email if cliente else "",
-            "telefono_cliente": cliente.telefono if cliente else "",
-            "descripcion": t.descripcion,
-            "precio": precio_final,
-            "montador": montador_nombre,
-            "estado": t.estado
-        })
-
-    return jsonify(lista_final), 200
+    try:
+        consulta = _consulta_admin_trabajos(request.args)
+        filas, siguiente = paginar_desc(
+            consulta, (Trabajo.fecha_creacion, Trabajo.id),
+            request.args.get('cursor'), leer_limite(request.args.get('limite'))
+        )
+    except ValueError as e:
+        return jsonify({'error': f'Parámetros inválidos: {e}'}), 400
+
+    lista_final = [_fila_admin_trabajo(f) for f in filas]
+    return respuesta_paginada(jsonify(lista_final), siguiente), 200
+
+
+def _consulta_admin_trabajos(args):
+    """Proyección trabajo + cliente + montador con los filtros del panel admin."""
+    consulta = db.session.query(
+        Trabajo.id, Trabajo.fecha_creacion, Trabajo.descripcion, Trabajo.estado,
+        Trabajo.precio_calculado, Trabajo.precio_estimado,
+        Cliente.nombre.label('cliente_nombre'),
+        Cliente.email.label('cliente_email'),
+        Cliente.telefono.label('cliente_telefono'),
+        Montador.nombre.label('montador_nombre')
+    ).outerjoin(Cliente, Cliente.id == Trabajo.cliente_id).outerjoin(
+        Montador, Montador.id == Trabajo.montador_id
+    )
+
+    if args.get('estado'):
+        consulta = consulta.filter(Trabajo.estado == args['estado'])
+    if args.get('montador_id'):
+        consulta = consulta.filter(Trabajo.montador_id == int(args['montador_id']))
+    if args.get('desde'):
+        consulta = consulta.filter(
+            Trabajo.fecha_creacion >= datetime.strptime(args['desde'], '%Y-%m-%d')
+        )
+    if args.get('hasta'):
+        consulta = consulta.filter(
+            Trabajo.fecha_creacion < datetime.strptime(args['hasta'], '%Y-%m-%d')
+            + timedelta(days=1)
+        )
+    return consulta
+
+
+def _fila_admin_trabajo(t):
+    """Mismo formato JSON que el panel admin ya consume."""
+    return {
+        "id": t.id,
+        "fecha": t.fecha_creacion.strftime('%Y-%m-%d %H:%M'),
+        "cliente": t.cliente_nombre or "Desconocido",
+        "email_cliente": t.cliente_email or "",
+        "telefono_cliente": t.cliente_telefono or "",
+        "descripcion": t.descripcion,
+        "precio": t.precio_estimado or t.precio_calculado,
+        "montador": t.montador_nombre or "Sin asignar",
+        "estado": t.estado
+    }
+
+@auth_bp.route('/admin/items-presupuestados', methods=['GET'])
+def admin_get_items_presupuestados():
+    """
+    Muebles presupuestados por tipo y variante (p. ej. canapés grandes).
+    Filtros: ?desde=AAAA-MM-DD y ?hasta=AAAA-MM-DD (por defecto los últimos
+    30 días), ?tipo=canape. Un GROUP BY sobre trabajo_item.
+    """
+    if not _validar_admin_token():
+        return jsonify({'error': 'Acceso denegado. Token inválido.'}), 401
+
+    args = request.args
+    try:
+        hasta = datetime.strptime(args['hasta'], '%Y-%m-%d') + timedelta(days=1) \
+            if args.get('hasta') else datetime.utcnow()
+        desde = datetime.strptime(args['desde'], '%Y-%m-%d') \
+            if args.get('desde') else hasta - timedelta(days=30)
+    except ValueError as e:
+        return jsonify({'error': f'Parámetros inválidos: {e}'}), 400
+
+    filas = resumen_items(desde, hasta, args.get('tipo'))
+    return jsonify([{
+        "tipo": f.tipo,
+        "variante": f.variante,
+        "unidades": int(f.unidades or 0),
+        "trabajos": f.trabajos,
+        "importe": round(f.importe or 0, 2)
+    } for f in filas]), 200
 
 @auth_bp.route('/admin/usuarios', methods=['GET'])
 def admin_get_usuarios():
-    """Obtiene lista combinada de Clientes y Montadores para el Admin."""
+    """
+    Directorio de Clientes y Montadores para el Admin (paginado por cursor).
+    Filtros: ?tipo=cliente|montador, ?q= (prefijo de email o nombre),
+    ?desde=AAAA-MM-DD, ?hasta=AAAA-MM-DD, ?limite=, ?cursor= (X-Next-Cursor).
+    """
     if not _validar_admin_token():
         return jsonify({'error': 'Acceso denegado. Token inválido.'}), 401
 
-    lista_usuarios = []
-
-    # 1. Obtener Montadores y sus Gemas
-    montadores = Montador.query.all()
-    for m in montadores:
-        # Calcular saldo seguro
-        saldo_actual = 0
-        if m.wallet:
-            saldo_actual = m.wallet.saldo
-            
-        lista_usuarios.append({
-            "id": m.id,
-            "tipo": "montador",
-            "nombre": m.nombre,
-            "email": m.email,
-            "telefono": m.telefono,
-            "zona": m.zona_servicio,
-            "saldo": saldo_actual,  # <--- ¡AQUÍ ESTÁ LA CLAVE!
-            "fecha": m.fecha_registro.strftime('%Y-%m-%d') if m.fecha_registro else "N/A"
-        })
-
-    # 2. Obtener Clientes
-    clientes = Cliente.query.all()
-    for c in clientes:
-        lista_usuarios.append({
-            "id": c.id,
-            "tipo": "cliente",
-            "nombre": c.nombre,
-            "email": c.email,
-            "telefono": c.telefono,
-            "zona": "N/A",
-            "saldo": 0, # Clientes no tienen gemas
-            "fecha": c.fecha_registro.strftime('%Y-%m-%d') if c.fecha_registro else "N/A"
-        })
-
-    return jsonify(lista_usuarios), 200
+    usuarios = _consulta_admin_usuarios()
+    consulta = db.session.query(usuarios)
+    args = request.args
+
+    try:
+        if args.get('tipo'):
+            consulta = consulta.filter(usuarios.c.tipo == args['tipo'])
+        if args.get('q'):
+            prefijo = _escapar_like(args['q'].strip().lower()) + '%'
+            consulta = consulta.filter(or_(
+                func.lower(usuarios.c.email).like(prefijo, escape='\\'),
+                func.lower(usuarios.c.nombre).like(prefijo, escape='\\')
+            ))
+        if args.get('desde'):
+            consulta = consulta.filter(
+                usuarios.c.fecha_registro >= datetime.strptime(args['desde'], '%Y-%m-%d')
+            )
+        if args.get('hasta'):
+            consulta = consulta.filter(
+                usuarios.c.fecha_registro < datetime.strptime(args['hasta'], '%Y-%m-%d')
+                + timedelta(days=1)
+            )
+
+        # (tipo, id) desempata: los ids de cliente y montador se repiten
+        filas, siguiente = paginar_desc(
+            consulta, (usuarios.c.fecha_registro, usuarios.c.tipo, usuarios.c.id),
+            args.get('cursor'), leer_limite(args.get('limite'))
+        )
+    except ValueError as e:
+        return jsonify({'error': f'Parámetros inválidos: {e}'}), 400
+
+    lista_usuarios = [_fila_admin_usuario(u) for u in filas]
+    return respuesta_paginada(jsonify(lista_usuarios), siguiente), 200
+
+
+def _escapar_like(texto):
+    """Escapa los comodines de LIKE para buscar el texto literal."""
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _consulta_admin_usuarios():
+    """
+    Montadores (LEFT JOIN wallet para el saldo) UNION ALL clientes, con las
+    mismas columnas. Devuelve la subconsulta 'usuarios' para filtrar/ordenar.
+    """
+    montadores = select(
+        Montador.id.label('id'),
+        literal('montador').label('tipo'),
+        Montador.nombre.label('nombre'),
+        Montador.email.label('email'),
+        Montador.telefono.label('telefono'),
+        Montador.zona_servicio.label('zona'),
+        func.coalesce(Wallet.saldo, 0).label('saldo'),
+        Montador.fecha_registro.label('fecha_registro')
+    ).outerjoin(Wallet, Wallet.montador_id == Montador.id)
+
+    clientes = select(
+        Cliente.id.label('id'),
+        literal('cliente').label('tipo'),
+        Cliente.nombre.label('nombre'),
+        Cliente.email.label('email'),
+        Cliente.telefono.label('telefono'),
+        literal('N/A').label('zona'),
+        literal(0).label('saldo'),  # Clientes no tienen gemas
+        Cliente.fecha_registro.label('fecha_registro')
+    )
+    return union_all(montadores, clientes).subquery('usuarios')
+
+
+def _fila_admin_usuario(u):
+    """Mismo formato JSON que el panel admin ya consume."""
+    return {
+        "id": u.id,
+        "tipo": u.tipo,
+        "nombre": u.nombre,
+        "email": u.email,
+        "telefono": u.telefono,
+        "zona": u.zona,
+        "saldo": u.saldo or 0,
+        "fecha": u.fecha_registro.strftime('%Y-%m-%d') if u.fecha_registro else "N/A"
+    }
+
+
+# --- EXPORTACIONES (streaming, para contabilidad) ---
+FILAS_POR_BLOQUE_EXPORTACION = 1000
+
+
+@auth_bp.route('/admin/exportar/trabajos', methods=['GET'])
+def admin_exportar_trabajos():
+    """
+    Descarga todos los trabajos en streaming: ?formato=ndjson (defecto) o csv.
+    Acepta los mismos filtros que /admin/todos-los-trabajos.
+    """
+    if not _validar_admin_token():
+        return jsonify({'error': 'Acceso denegado. Token inválido.'}), 401
+
+    formato = request.args.get('formato', 'ndjson')
+    if formato not in FORMATOS:
+        return jsonify({'error': f'Formato no soportado. Usa: {", ".join(FORMATOS)}'}), 400
+
+    try:
+        consulta = _consulta_admin_trabajos(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Parámetros inválidos: {e}'}), 400
+
+    filas = consulta.order_by(
+        Trabajo.fecha_creacion.desc(), Trabajo.id.desc()
+    ).yield_per(FILAS_POR_BLOQUE_EXPORTACION)
+
+    return respuesta_exportacion(
+        'trabajos', filas, _fila_admin_trabajo,
+        ['id', 'fecha', 'cliente', 'email_cliente', 'telefono_cliente',
+         'descripcion', 'precio', 'montador', 'estado'],
+        formato
+    )
+
+
+@auth_bp.route('/admin/exportar/usuarios', methods=['GET'])
+def admin_exportar_usuarios():
+    """Descarga todos los usuarios (montadores + clientes) en streaming."""
+    if not _validar_admin_token():
+        return jsonify({'error': 'Acceso denegado. Token inválido.'}), 401
+
+    formato = request.args.get('formato', 'ndjson')
+    if formato not in FORMATOS:
+        return jsonify({'error': f'Formato no soportado. Usa: {", ".join(FORMATOS)}'}), 400
+
+    usuarios = _consulta_admin_usuarios()
+    filas = db.session.query(usuarios).yield_per(FILAS_POR_BLOQUE_EXPORTACION)
+
+    return respuesta_exportacion(
+        'usuarios', filas, _fila_admin_usuario,
+        ['id', 'tipo', 'nombre', 'email', 'telefono', 'zona', 'saldo', 'fecha'],
+        formato
+    )
 
 # ==========================================
 # 7. SUBIDA DE FOTO DE PERFIL (NUEVO)
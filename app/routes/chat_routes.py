@@ -0,0 +1,186 @@
+"""
+Rutas del chat del Outlet (comprador <-> vendedor de un producto).
+El chat se abre con POST /api/outlet/iniciar-chat; aquí se listan las
+conversaciones, se lee el historial, se envían mensajes y el vendedor
+registra la venta (POST .../vender).
+Tiempo real: evento 'chat_mensaje' en /api/eventos/stream, o long-poll con
+GET .../mensajes?despues=<ultimo_id>&espera=25
+"""
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import aliased
+
+from app.extensions import db
+from app.models import Conversacion, Mensaje, Product, Cliente, Montador
+from app.pagination import CursorInvalido, paginar_desc, leer_limite, respuesta_paginada
+from app.chat_service import (
+    enviar_mensaje, esperar_mensajes, mensaje_a_dict, registrar_venta
+)
+
+chat_bp = Blueprint('chat', __name__)
+
+
+def _usuario():
+    """(rol, id) del token."""
+    return get_jwt().get('rol', 'cliente'), int(get_jwt_identity())
+
+
+def _conversacion_de(conversacion_id, rol, usuario_id):
+    """La conversación si el usuario participa en ella; si no, None."""
+    conversacion = db.session.get(Conversacion, conversacion_id)
+    if not conversacion or not conversacion.participa(rol, usuario_id):
+        return None
+    return conversacion
+
+
+@chat_bp.route('/chat/conversaciones', methods=['GET'])
+@jwt_required()
+def get_conversaciones():
+    """
+    Bandeja de chats del usuario (como comprador o como vendedor), los más
+    activos primero. Paginado: ?limite= y ?cursor= (cabecera X-Next-Cursor).
+    """
+    rol, usuario_id = _usuario()
+    como_comprador = and_(
+        Conversacion.comprador_rol == rol, Conversacion.comprador_id == usuario_id
+    )
+    filtro = or_(como_comprador, Conversacion.vendedor_id == usuario_id) \
+        if rol == 'montador' else como_comprador
+
+    # Una consulta: producto + nombre del vendedor y del comprador (cliente o montador)
+    vendedor = aliased(Montador)
+    comprador_montador = aliased(Montador)
+    consulta = db.session.query(
+        Conversacion, Product.titulo, Product.imagenes_urls, Product.precio, Product.estado,
+        vendedor.nombre.label('vendedor_nombre'),
+        func.coalesce(Cliente.nombre, comprador_montador.nombre).label('comprador_nombre')
+    ).join(
+        Product, Product.id == Conversacion.product_id
+    ).join(
+        vendedor, vendedor.id == Conversacion.vendedor_id
+    ).outerjoin(Cliente, and_(
+        Conversacion.comprador_rol == 'cliente', Cliente.id == Conversacion.comprador_id
+    )).outerjoin(comprador_montador, and_(
+        Conversacion.comprador_rol == 'montador',
+        comprador_montador.id == Conversacion.comprador_id
+    )).filter(filtro)
+
+    try:
+        filas, siguiente = paginar_desc(
+            consulta, (Conversacion.ultimo_mensaje_at, Conversacion.id),
+            request.args.get('cursor'), leer_limite(request.args.get('limite'), defecto=30),
+            clave=lambda fila: (fila[0].ultimo_mensaje_at, fila[0].id)
+        )
+    except CursorInvalido:
+        return jsonify({"error": "Parámetros de paginación inválidos"}), 400
+    except Exception as e: # pylint: disable=broad-exception-caught
+        print(f"Error en get_conversaciones: {e}")
+        return jsonify({"error": "Error al obtener los chats"}), 500
+
+    res = []
+    for c, titulo, imagenes, precio, estado, vendedor_nombre, comprador_nombre in filas:
+        soy_vendedor = rol == 'montador' and c.vendedor_id == usuario_id
+        res.append({
+            "id": c.id,
+            "producto": {
+                "id": c.product_id,
+                "titulo": titulo,
+                "precio": float(precio),
+                "estado": estado,
+                "imagen": imagenes[0] if imagenes else None
+            },
+            "soy_vendedor": soy_vendedor,
+            "con": comprador_nombre if soy_vendedor else vendedor_nombre,
+            "ultimo_mensaje_at": c.ultimo_mensaje_at.isoformat(),
+            "job_id": c.trabajo_id  # Venta registrada por el vendedor (si la hay)
+        })
+    return respuesta_paginada(jsonify(res), siguiente), 200
+
+
+@chat_bp.route('/chat/conversaciones/<int:conversacion_id>/mensajes', methods=['GET'])
+@jwt_required()
+def get_mensajes(conversacion_id):
+    """
+    Historial, más recientes primero: ?limite= y ?cursor= (X-Next-Cursor).
+    Nuevos: ?despues=<id> devuelve los posteriores en orden; con &espera=<s>
+    (máx. 25) la petición espera a que llegue alguno (long-poll).
+    """
+    rol, usuario_id = _usuario()
+    conversacion = _conversacion_de(conversacion_id, rol, usuario_id)
+    if not conversacion:
+        return jsonify({"error": "Chat no encontrado"}), 404
+
+    limite = leer_limite(request.args.get('limite'), defecto=50)
+    try:
+        if 'despues' in request.args:
+            espera = float(request.args.get('espera', 0))
+            mensajes = esperar_mensajes(
+                conversacion_id, int(request.args['despues']), limite, max(0.0, espera)
+            )
+            return jsonify([mensaje_a_dict(m) for m in mensajes]), 200
+
+        mensajes, siguiente = paginar_desc(
+            Mensaje.query.filter(Mensaje.conversacion_id == conversacion_id),
+            (Mensaje.id,), request.args.get('cursor'), limite
+        )
+    except (CursorInvalido, ValueError):
+        return jsonify({"error": "Parámetros inválidos"}), 400
+    except Exception as e: # pylint: disable=broad-exception-caught
+        print(f"Error en get_mensajes: {e}")
+        return jsonify({"error": "Error al obtener los mensajes"}), 500
+
+    return respuesta_paginada(jsonify([mensaje_a_dict(m) for m in mensajes]), siguiente), 200
+
+
+@chat_bp.route('/chat/conversaciones/<int:conversacion_id>/mensajes', methods=['POST'])
+@jwt_required()
+def post_mensaje(conversacion_id):
+    """Envía un mensaje: {"texto": "..."}"""
+    rol, usuario_id = _usuario()
+    conversacion = _conversacion_de(conversacion_id, rol, usuario_id)
+    if not conversacion:
+        return jsonify({"error": "Chat no encontrado"}), 404
+
+    try:
+        mensaje = enviar_mensaje(
+            conversacion, rol, usuario_id, (request.json or {}).get('texto')
+        )
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e: # pylint: disable=broad-exception-caught
+        db.session.rollback()
+        print(f"Error en post_mensaje: {e}")
+        return jsonify({"error": "No se pudo enviar el mensaje"}), 500
+
+    return jsonify(mensaje_a_dict(mensaje)), 201
+
+
+@chat_bp.route('/chat/conversaciones/<int:conversacion_id>/vender', methods=['POST'])
+@jwt_required()
+def vender(conversacion_id):
+    """
+    El vendedor vende el producto al comprador (cliente) de este chat: el
+    producto pasa a 'reservado' y se crea el Trabajo de la venta (job_id).
+    """
+    rol, usuario_id = _usuario()
+    conversacion = _conversacion_de(conversacion_id, rol, usuario_id)
+    if not conversacion:
+        return jsonify({"error": "Chat no encontrado"}), 404
+    if rol != 'montador' or conversacion.vendedor_id != usuario_id:
+        return jsonify({"error": "Solo el vendedor puede registrar la venta"}), 403
+
+    try:
+        job_id = registrar_venta(conversacion)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e: # pylint: disable=broad-exception-caught
+        db.session.rollback()
+        print(f"Error en vender: {e}")
+        return jsonify({"error": "No se pudo registrar la venta"}), 500
+
+    return jsonify({"success": True, "conversacion_id": conversacion_id, "job_id": job_id}), 200
@@ -4,13 +4,19 @@ pagos (Stripe/Gemas) y gestión de estado de servicios.
 """
 import json
 import stripe
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response
 from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
+from sqlalchemy import or_
 from sqlalchemy.exc import SQLAlchemyError
 
-from app.models import Cliente, Trabajo, Montador, Product
+from app.models import Cliente, Trabajo, Montador, Product, TrabajoBaja
 from app.extensions import db
 from app.email_service import enviar_resumen_presupuesto
+from app.etag import calcular_etag, respuesta_no_modificado, con_etag
+from app.pagination import CursorInvalido, paginar_desc, leer_limite, respuesta_paginada
+from app.sync_service import nuevo_cursor, leer_cursor, bajas_desde, CursorCaducado
+from app.contadores import contadores_de
+from app.trabajo_estados import transicionar, puede_transicionar
 
 cliente_bp = Blueprint('cliente', __name__)
 
@@ -90,7 +96,13 @@ def publicar_trabajo_logueado():
 @cliente_bp.route('/cliente/mis-trabajos', methods=['GET'])
 @jwt_required()
 def get_mis_trabajos():
-    """Obtiene los trabajos del cliente (incluyendo cotizaciones)."""
+    """
+    Obtiene los trabajos del cliente (incluyendo cotizaciones), más recientes
+    primero, con los datos del montador asignado en la MISMA consulta.
+    Paginado: ?limite= (100 por defecto) y ?cursor= (cabecera X-Next-Cursor).
+    Con ?since=<cursor> devuelve solo lo creado/modificado y las bajas desde
+    ese cursor. El cursor de la próxima sincronización va en X-Sync-Cursor.
+    """
     claims = get_jwt()
     if claims.get('rol') != 'cliente':
         return jsonify({"error": "Acceso no autorizado"}), 403
@@ -98,54 +110,132 @@ def get_mis_trabajos():
     try:
         user_id = int(get_jwt_identity())
 
-        # Obtenemos TODO ordenado por fecha
-        trabajos = Trabajo.query.filter_by(cliente_id=user_id).order_by(
-            Trabajo.fecha_creacion.desc()
-        ).all()
-
-        res = []
-        for t in trabajos:
-            # Info del Montador (CON FOTO)
-            montador_info = None
-            if t.montador_id:
-                m = Montador.query.get(t.montador_id)
-                if m:
-                    montador_info = {
-                        "nombre": m.nombre,
-                        "telefono": m.telefono,
-                        "foto_url": m.foto_url
-                    }
-
-            # Parseo seguro del desglose
-            desglose = t.desglose
-            if isinstance(desglose, str):
-                try:
-                    desglose = json.loads(desglose)
-                except json.JSONDecodeError:
-                    desglose = None
-
-            res.append({
-                "trabajo_id": t.id,
-                "descripcion": t.descripcion,
-                "direccion": t.direccion,
-                "precio_calculado": t.precio_calculado,
-                "estado": t.estado, 
-                "fecha_creacion": t.fecha_creacion.isoformat(),
-                "montador_info": montador_info,
-                "imagenes_urls": t.imagenes_urls,
-                "foto_finalizacion": t.foto_finalizacion,
-                "desglose": desglose,
-                "metodo_pago": t.metodo_pago,
-                "payment_intent_id": t.payment_intent_id,
-                "etiquetas": t.etiquetas
-            })
-
-        return jsonify(res), 200
-
+        if 'since' in request.args:
+            return _sincronizar_mis_trabajos(user_id, request.args['since'])
+
+        pagina = request.args.get('cursor')
+        limite = leer_limite(request.args.get('limite'))
+
+        # Versión del listado (1 consulta agregada): si no cambió, 304 sin cargar filas
+        version = db.session.query(
+            db.func.count(Trabajo.id), db.func.max(Trabajo.id),
+            db.func.max(Trabajo.updated_at), db.func.max(Montador.updated_at)
+        ).outerjoin(Montador, Montador.id == Trabajo.montador_id).filter(
+            Trabajo.cliente_id == user_id
+        ).one()
+        etag = calcular_etag('cliente-trabajos', user_id, pagina, limite, *version)
+        no_modificado = respuesta_no_modificado(etag)
+        if no_modificado:
+            return no_modificado
+
+        cursor = nuevo_cursor()
+        filas, siguiente = paginar_desc(
+            _consulta_mis_trabajos(user_id), (Trabajo.fecha_creacion, Trabajo.id),
+            pagina, limite
+        )
+    except CursorInvalido:
+        return jsonify({"error": "Parámetros de paginación inválidos"}), 400
     except Exception as e: # pylint: disable=broad-exception-caught
         print(f"Error en get_mis_trabajos: {e}")
         return jsonify({"error": "Error al obtener trabajos"}), 500
 
+    respuesta = con_etag(make_response(jsonify([_trabajo_a_dict(f) for f in filas]), 200), etag)
+    if not pagina:
+        # La sincronización parte del listado completo (primera página)
+        respuesta.headers['X-Sync-Cursor'] = cursor
+    return respuesta_paginada(respuesta, siguiente)
+
+
+def _consulta_mis_trabajos(user_id):
+    """Proyección trabajo + nombre/teléfono/foto del montador (LEFT JOIN)."""
+    return db.session.query(
+        Trabajo.id, Trabajo.descripcion, Trabajo.direccion, Trabajo.precio_calculado,
+        Trabajo.estado, Trabajo.fecha_creacion, Trabajo.imagenes_urls,
+        Trabajo.foto_finalizacion, Trabajo.desglose, Trabajo.metodo_pago,
+        Trabajo.payment_intent_id, Trabajo.etiquetas,
+        Montador.id.label('montador_id'),
+        Montador.nombre.label('montador_nombre'),
+        Montador.telefono.label('montador_telefono'),
+        Montador.foto_url.label('montador_foto_url')
+    ).outerjoin(
+        Montador, Montador.id == Trabajo.montador_id
+    ).filter(Trabajo.cliente_id == user_id)
+
+
+def _sincronizar_mis_trabajos(user_id, since):
+    """Delta desde el cursor: trabajos cambiados (con su montador) + bajas."""
+    try:
+        desde = leer_cursor(since)
+    except CursorInvalido:
+        return jsonify({"error": "Cursor de sincronización inválido"}), 400
+    except CursorCaducado:
+        return jsonify({"error": "Cursor caducado. Recarga el listado completo."}), 410
+
+    cursor = nuevo_cursor()
+    # También cuenta como cambio que el montador asignado edite su perfil (foto, tlf)
+    filas = _consulta_mis_trabajos(user_id).filter(
+        or_(Trabajo.updated_at > desde, Montador.updated_at > desde)
+    ).order_by(Trabajo.fecha_creacion.desc()).all()
+
+    trabajos = [_trabajo_a_dict(f) for f in filas]
+    eliminados = bajas_desde(
+        TrabajoBaja.cliente_id, user_id, desde, excluir=[f.id for f in filas]
+    )
+
+    respuesta = make_response(jsonify({
+        "trabajos": trabajos,
+        "eliminados": eliminados,
+        "cursor": cursor
+    }), 200)
+    respuesta.headers['X-Sync-Cursor'] = cursor
+    return respuesta
+
+
+def _trabajo_a_dict(t):
+    """Formato de un trabajo en el panel del cliente (fila de _consulta_mis_trabajos)."""
+    montador_info = None
+    if t.montador_id is not None:
+        montador_info = {
+            "nombre": t.montador_nombre,
+            "telefono": t.montador_telefono,
+            "foto_url": t.montador_foto_url
+        }
+
+    # Se normaliza al guardar (app/zonas.py); el texto solo queda en filas
+    # antiguas sin 'flask mantenimiento rellenar-zonas'
+    desglose = t.desglose
+    if isinstance(desglose, str):
+        try:
+            desglose = json.loads(desglose)
+        except json.JSONDecodeError:
+            desglose = None
+
+    return {
+        "trabajo_id": t.id,
+        "descripcion": t.descripcion,
+        "direccion": t.direccion,
+        "precio_calculado": t.precio_calculado,
+        "estado": t.estado,
+        "fecha_creacion": t.fecha_creacion.isoformat(),
+        "montador_info": montador_info,
+        "imagenes_urls": t.imagenes_urls,
+        "foto_finalizacion": t.foto_finalizacion,
+        "desglose": desglose,
+        "metodo_pago": t.metodo_pago,
+        "payment_intent_id": t.payment_intent_id,
+        "etiquetas": t.etiquetas
+    }
+
+
+@cliente_bp.route('/cliente/contadores', methods=['GET'])
+@jwt_required()
+def get_contadores_cliente():
+    """Badges del panel (presupuestos, activos, en revisión...) sin COUNT(*)."""
+    claims = get_jwt()
+    if claims.get('rol') != 'cliente':
+        return jsonify({"error": "Acceso no autorizado"}), 403
+    return jsonify(contadores_de('cliente', int(get_jwt_identity()))), 200
+
 
 @cliente_bp.route('/cliente/trabajo/<int:trabajo_id>/cancelar', methods=['POST'])
 @jwt_required()
@@ -156,23 +246,27 @@ def cancelar_trabajo(trabajo_id):
     """
     cliente_id = int(get_jwt_identity())
     try:
-        t = Trabajo.query.filter_by(id=trabajo_id, cliente_id=cliente_id).first()
+        t = db.session.query(
+            Trabajo.estado, Trabajo.tipo, Trabajo.outlet_product_id,
+            Trabajo.payment_intent_id, Trabajo.metodo_pago
+        ).filter_by(id=trabajo_id, cliente_id=cliente_id).first()
 
         if not t:
             return jsonify({"error": "Trabajo no encontrado"}), 404
 
-        # Verificar si es Outlet (tiene etiqueta especial)
-        es_outlet = False
-        if t.etiquetas and isinstance(t.etiquetas, dict):
-            if t.etiquetas.get('tipo') == 'outlet':
-                es_outlet = True
+        es_outlet = t.tipo == 'outlet'
 
         # Reglas de cancelación:
-        if not es_outlet and t.estado not in ['pendiente', 'cotizacion']:
-            return jsonify({"error": "No se puede cancelar en este estado"}), 400
-
         if es_outlet and t.estado == 'completado':
             return jsonify({"error": "Ya has comprado este producto."}), 400
+        if (not es_outlet and t.estado not in ['pendiente', 'cotizacion']) or \
+                not puede_transicionar(t.estado, 'cancelado'):
+            return jsonify({"error": "No se puede cancelar en este estado"}), 400
+
+        # Compare-and-set sobre el estado leído: si cambió entretanto, no se pisa
+        if not transicionar(trabajo_id, t.estado, 'cancelado', Trabajo.cliente_id == cliente_id):
+            db.session.rollback()
+            return jsonify({"error": "El trabajo ha cambiado. Recarga e inténtalo de nuevo."}), 409
 
         # Lógica de Devolución (Stripe)
         if t.payment_intent_id and t.metodo_pago == 'stripe':
@@ -180,16 +274,14 @@ def cancelar_trabajo(trabajo_id):
 
         # --- LÓGICA OUTLET: DEVOLVER AL ESCAPARATE ---
         if es_outlet:
-            product_id = t.etiquetas.get('outlet_product_id')
-            if product_id:
-                producto = Product.query.get(product_id)
-                if producto:
-                    producto.estado = 'disponible'
-                    producto.payment_intent_id = None
-                    producto.cliente_id = None
-                    print(f"✅ Producto #{product_id} liberado al feed.")
-
-        t.estado = 'cancelado'
+            product_id = t.outlet_product_id
+            if product_id and Product.query.filter_by(id=product_id).update({
+                Product.estado: 'disponible',
+                Product.payment_intent_id: None,
+                Product.cliente_id: None
+            }, synchronize_session=False):
+                print(f"✅ Producto #{product_id} liberado al feed.")
+
         db.session.commit()
 
         return jsonify({
@@ -242,21 +334,20 @@ def activar_trabajo(trabajo_id):
         return jsonify({"error": "Falta ID de pago"}), 400
 
     try:
-        trabajo = Trabajo.query.filter_by(
-            id=trabajo_id, cliente_id=cliente_id, estado='cotizacion'
-        ).first()
-        if not trabajo:
-            return jsonify({"error": "Trabajo no válido"}), 404
-
         intent = stripe.PaymentIntent.retrieve(payment_intent_id)
         if intent.status != 'requires_capture':
             return jsonify({
                 "error": f"El pago no está retenido (Estado: {intent.status})"
             }), 400
 
-        trabajo.payment_intent_id = payment_intent_id
-        trabajo.estado = 'pendiente'
-        trabajo.metodo_pago = 'stripe'
+        # cotizacion -> pendiente en una sentencia (el webhook puede llegar a la vez)
+        trabajo = transicionar(
+            trabajo_id, 'cotizacion', 'pendiente', Trabajo.cliente_id == cliente_id,
+            payment_intent_id=payment_intent_id, metodo_pago='stripe'
+        )
+        if not trabajo:
+            db.session.rollback()
+            return jsonify({"error": "Trabajo no válido"}), 404
 
         stripe.PaymentIntent.modify(
             payment_intent_id,
@@ -268,6 +359,7 @@ def activar_trabajo(trabajo_id):
             "success": True, "message": "Trabajo activo", "estado": "pendiente"
         }), 200
     except stripe.error.StripeError as e:
+        db.session.rollback()
         return jsonify({"error": f"Error de Stripe: {e.user_message}"}), 500
     except Exception as e: # pylint: disable=broad-exception-caught
         db.session.rollback()
@@ -284,15 +376,14 @@ def activar_con_efectivo(trabajo_id):
     cliente_id = int(get_jwt_identity())
 
     try:
-        trabajo = Trabajo.query.filter_by(
-            id=trabajo_id, cliente_id=cliente_id, estado='cotizacion'
-        ).first()
+        trabajo = transicionar(
+            trabajo_id, 'cotizacion', 'pendiente', Trabajo.cliente_id == cliente_id,
+            metodo_pago='efectivo_gemas'
+        )
         if not trabajo:
+            db.session.rollback()
             return jsonify({"error": "Trabajo no encontrado"}), 404
 
-        trabajo.estado = 'pendiente'
-        trabajo.metodo_pago = 'efectivo_gemas'
-
         db.session.commit()
 
         return jsonify({
@@ -317,38 +408,42 @@ def confirmar_pago_cliente(trabajo_id):
     cliente_id = int(get_jwt_identity())
 
     try:
-        trabajo = Trabajo.query.filter_by(
-            id=trabajo_id, cliente_id=cliente_id
-        ).first()
+        # Efectivo: revision_cliente -> completado.
+        # Stripe: revision_cliente -> aprobado_cliente_stripe (el webhook lo completa)
+        es_cliente = Trabajo.cliente_id == cliente_id
+        trabajo = transicionar(
+            trabajo_id, 'revision_cliente', 'completado',
+            es_cliente, Trabajo.metodo_pago == 'efectivo_gemas'
+        ) or transicionar(
+            trabajo_id, 'revision_cliente', 'aprobado_cliente_stripe',
+            es_cliente, Trabajo.metodo_pago != 'efectivo_gemas'
+        )
         if not trabajo:
-            return jsonify({"error": "Trabajo no encontrado"}), 404
-
-        if trabajo.estado != 'revision_cliente':
+            db.session.rollback()
+            existe = db.session.query(Trabajo.id).filter_by(
+                id=trabajo_id, cliente_id=cliente_id
+            ).scalar()
+            if not existe:
+                return jsonify({"error": "Trabajo no encontrado"}), 404
             return jsonify({"error": "El trabajo debe estar en revisión."}), 400
 
         # --- LÓGICA OUTLET: ACTUALIZAR ESTADO DEL PRODUCTO ---
-        if trabajo.etiquetas and isinstance(trabajo.etiquetas, dict):
-            if trabajo.etiquetas.get('tipo') == 'outlet':
-                product_id = trabajo.etiquetas.get('outlet_product_id')
-                if product_id:
-                    producto = Product.query.get(product_id)
-                    if producto:
-                        # Marcamos como vendido para sacarlo del feed
-                        producto.estado = 'vendido'
-                        db.session.add(producto)
-                        print(f"✅ Producto #{product_id} marcado oficialmente como VENDIDO.")
+        if trabajo.tipo == 'outlet':
+            product_id = trabajo.outlet_product_id
+            # Marcamos como vendido para sacarlo del feed
+            if product_id and Product.query.filter_by(id=product_id).update(
+                {Product.estado: 'vendido'}, synchronize_session=False
+            ):
+                print(f"✅ Producto #{product_id} marcado oficialmente como VENDIDO.")
         # -------------------------------------------------------------
 
-        if trabajo.metodo_pago == 'efectivo_gemas':
-            trabajo.estado = 'completado'
-            db.session.commit()
+        db.session.commit()
+
+        if trabajo.estado == 'completado':
             return jsonify({
                 "success": True, "message": "Finalizado.", "estado": "completado"
             }), 200
 
-        trabajo.estado = 'aprobado_cliente_stripe'
-        db.session.commit()
-
         return jsonify({
             "success": True,
             "message": "Aprobación recibida.",
@@ -357,4 +452,4 @@ def confirmar_pago_cliente(trabajo_id):
 
     except Exception as e: # pylint: disable=broad-exception-caught
         db.session.rollback()
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
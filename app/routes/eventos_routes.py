@@ -0,0 +1,168 @@
+"""
+Rutas de eventos en tiempo real (Server-Sent Events) para los paneles.
+El navegador abre: new EventSource('/api/eventos/stream?token=<access_token>')
+EventSource no permite cabeceras, por eso el token va en la URL (también se
+acepta la cabecera Authorization). Al reconectar, el navegador manda
+Last-Event-ID y se reenvía lo perdido. Ver app/event_hub.py.
+
+Cada stream ocupa un hilo de su worker. En producción se sirven desde el
+proceso 'sse' del Procfile (gevent: miles de conexiones por worker) y el
+proceso 'web' (gthread) solo admite unos pocos (SSE_MAX_CONEXIONES), para que
+las conexiones largas nunca dejen sin hilos a la API; pasado el tope responde
+503 y el panel sigue con la recarga por REST.
+"""
+import os
+import queue
+import threading
+import time
+
+from flask import Blueprint, Response, request, jsonify
+from flask_jwt_extended import decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+
+from app.extensions import db
+from app.models import Montador
+from app.event_hub import obtener_hub, formatear_sse
+from app.trabajo_estados import canal_zona
+from app.zonas import zonas_de_servicio
+
+eventos_bp = Blueprint('eventos', __name__)
+
+# Latido para que proxies y balanceadores no corten la conexión
+LATIDO_SEGUNDOS = 15
+# La conexión se cierra y el navegador reconecta solo (con Last-Event-ID):
+# así ningún hilo queda ocupado indefinidamente por un cliente que se fue
+DURACION_MAXIMA_SEGUNDOS = int(os.getenv('SSE_DURACION_MAXIMA', '300'))
+REINTENTO_MS = 3000
+# Streams abiertos a la vez en este proceso (ver docstring del módulo)
+MAX_CONEXIONES = int(os.getenv(
+    'SSE_MAX_CONEXIONES', '1000' if os.getenv('EVENTOS_PROCESO_SSE') == '1' else '8'
+))
+REINTENTO_SATURADO_SEGUNDOS = 30
+
+# Contador de streams del proceso (diccionario en vez de 'global')
+_CONEXIONES = {'abiertas': 0}
+_CONEXIONES_LOCK = threading.Lock()
+
+
+def _reservar_conexion():
+    """True si queda hueco para otro stream en este proceso (y lo ocupa)."""
+    with _CONEXIONES_LOCK:
+        if _CONEXIONES['abiertas'] >= MAX_CONEXIONES:
+            return False
+        _CONEXIONES['abiertas'] += 1
+        return True
+
+
+def _liberar_conexion():
+    with _CONEXIONES_LOCK:
+        _CONEXIONES['abiertas'] -= 1
+
+
+def _leer_token():
+    """Token de ?token= o de la cabecera Authorization."""
+    token = request.args.get('token')
+    if not token:
+        cabecera = request.headers.get('Authorization', '')
+        if cabecera.startswith('Bearer '):
+            token = cabecera[7:]
+    return token
+
+
+def _ultimo_id():
+    """Last-Event-ID (cabecera del navegador o ?last_event_id= para polyfills)."""
+    valor = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        return int(valor) if valor else None
+    except ValueError:
+        return None
+
+
+def _canales(rol, usuario_id):
+    """Canales del usuario. Los montadores reciben además su(s) zona(s) del feed."""
+    if rol != 'montador':
+        return [f'cliente:{usuario_id}']
+
+    zona_param = request.args.get('zona')
+    if zona_param is None:
+        zona_servicio = db.session.query(Montador.zona_servicio).filter(
+            Montador.id == usuario_id
+        ).scalar()
+        zonas = zonas_de_servicio(zona_servicio)
+    elif zona_param.lower() == 'todas':
+        zonas = []
+    else:
+        zonas = zonas_de_servicio(zona_param)
+
+    canales = [f'montador:{usuario_id}']
+    if zonas:
+        # Igual que el feed: los trabajos legacy sin zona se muestran a todos
+        canales += [canal_zona(zona) for zona in zonas] + [canal_zona(None)]
+    else:
+        canales.append('zona:*')
+    return canales
+
+
+@eventos_bp.route('/eventos/stream', methods=['GET'])
+def stream_eventos():
+    """
+    Flujo SSE del usuario: 'trabajo_estado' (sus trabajos), y para montadores
+    'trabajo_nuevo' / 'trabajo_retirado' de sus zonas (?zona=todas para todas).
+    'resync' indica que se perdieron eventos: recargar el listado por REST.
+    """
+    token = _leer_token()
+    if not token:
+        return jsonify({"error": "Falta el token"}), 401
+    try:
+        datos_token = decode_token(token)
+    except (JWTExtendedException, PyJWTError):
+        return jsonify({"error": "Token inválido o caducado"}), 401
+    if datos_token.get('type') != 'access':
+        return jsonify({"error": "Se requiere un access token"}), 401
+
+    rol = datos_token.get('rol', 'cliente')
+    canales = _canales(rol, int(datos_token['sub']))
+    # La conexión a la BD no debe quedar retenida mientras dura el stream
+    db.session.remove()
+
+    if not _reservar_conexion():
+        respuesta = jsonify({
+            "error": "Demasiadas conexiones en tiempo real. Inténtalo más tarde.",
+            "reintentar_en": REINTENTO_SATURADO_SEGUNDOS
+        })
+        respuesta.status_code = 503
+        respuesta.headers['Retry-After'] = str(REINTENTO_SATURADO_SEGUNDOS)
+        return respuesta
+
+    hub = obtener_hub()
+    suscripcion, perdidos, resync = hub.suscribir(canales, _ultimo_id())
+
+    def flujo():
+        try:
+            yield f"retry: {REINTENTO_MS}\n\n"
+            if resync:
+                yield "event: resync\ndata: {}\n\n"
+            for evento in perdidos:
+                yield formatear_sse(evento)
+
+            fin = time.monotonic() + DURACION_MAXIMA_SEGUNDOS
+            while time.monotonic() < fin:
+                if suscripcion.desbordada:
+                    yield "event: resync\ndata: {}\n\n"
+                    return
+                try:
+                    yield formatear_sse(suscripcion.cola.get(timeout=LATIDO_SEGUNDOS))
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            hub.cancelar(suscripcion)
+
+    respuesta = Response(flujo(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Sin buffer en Nginx/Render
+    })
+    # Se libera al cerrar la respuesta, aunque el cliente se vaya antes del primer byte
+    respuesta.call_on_close(_liberar_conexion)
+    respuesta.call_on_close(lambda: hub.cancelar(suscripcion))
+    return respuesta
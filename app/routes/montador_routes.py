@@ -5,17 +5,33 @@ y Reporte de incidencias.
 import json
 import os
 import stripe
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response
 from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
+from sqlalchemy import exists, or_
 from sqlalchemy.exc import SQLAlchemyError
 
-from app.models import Cliente, Trabajo, Montador
+from app.models import Cliente, Trabajo, Montador, TrabajoBaja, ContadorTrabajos
 from app.extensions import db
 from app.storage import upload_image_to_gcs
-from app.gems_service import recargar_gemas
+from app.gems_service import debitar_gemas_montador, abonar_gemas_montador
+from app.etag import calcular_etag, respuesta_no_modificado, con_etag
+from app.pagination import (
+    CursorInvalido, paginar_desc, paginar_asc, leer_limite, respuesta_paginada
+)
+from app.zonas import zonas_de_servicio, zona_de_direccion
+from app.geo import (
+    geocodificar, prefijos_cobertura, filtro_prefijos, distancia2_sql,
+    radio2_grados, km_desde_distancia2, RADIO_POR_DEFECTO_KM
+)
+from app.sync_service import nuevo_cursor, leer_cursor, bajas_desde, CursorCaducado
+from app.contadores import contadores_de
+from app.trabajo_estados import transicionar
 
 montador_bp = Blueprint('montador', __name__)
 
+# Radio máximo de búsqueda por cercanía (limita las celdas geohash a escanear)
+RADIO_MAXIMO_KM = 100.0
+
 # Configuración de Packs (Constante global)
 PACKS_CONFIG = {
     'pack_small': {'amount': 500, 'gems': 50, 'name': 'Puñado de Gemas'},
@@ -29,157 +45,323 @@ PACKS_CONFIG = {
 @jwt_required()
 def get_trabajos_disponibles():
     """
-    Obtiene trabajos pendientes y sin asignar.
+    Obtiene trabajos pendientes y sin asignar (más recientes primero).
     🔒 FILTRO DE PRIVACIDAD ACTIVADO: No envía teléfonos ni direcciones exactas.
+    Filtra por la zona_servicio del montador (?zona=todas para verlo todo, o
+    ?zona=Marbella). Paginado: ?limite= y ?cursor= (cabecera X-Next-Cursor).
+    Con ?near= ordena por cercanía (ver _trabajos_cercanos).
     """
     claims = get_jwt()
     if claims.get('rol') != 'montador':
         return jsonify({"error": "Acceso no autorizado"}), 403
 
     try:
-        trabajos = Trabajo.query.filter_by(
-            estado='pendiente', montador_id=None
-        ).all()
-        res = []
-        for t in trabajos:
-            cliente = Cliente.query.get(t.cliente_id)
-
-            desglose_data = t.desglose
-            if isinstance(desglose_data, str):
-                try:
-                    desglose_data = json.loads(desglose_data)
-                except json.JSONDecodeError:
-                    desglose_data = None
-
-            zona_ref = t.direccion.split(',')[0] if t.direccion else "Málaga"
-            direccion_oculta = f"📍 Zona de {zona_ref}"
-
-            res.append({
-                "trabajo_id": t.id,
-                "descripcion": t.descripcion,
-                "direccion": direccion_oculta,
-                "direccion_completa": None,
-                "precio_calculado": t.precio_calculado,
-                "fecha_creacion": t.fecha_creacion.isoformat(),
-                "imagenes_urls": t.imagenes_urls,
-                "etiquetas": t.etiquetas,
-                "cliente_nombre": cliente.nombre if cliente else "Usuario Kiq",
-                "cliente_telefono": None,
-                "metodo_pago": t.metodo_pago,
-                "desglose": desglose_data
-            })
-        return jsonify(res), 200
+        montador = db.session.query(
+            Montador.zona_servicio, Montador.centro_lat, Montador.centro_lng, Montador.radio_km
+        ).filter(Montador.id == int(get_jwt_identity())).one()
+
+        # Una consulta: índice (estado, montador_id, ...) + nombre del cliente
+        consulta = db.session.query(Trabajo, Cliente.nombre.label('cliente_nombre')).outerjoin(
+            Cliente, Cliente.id == Trabajo.cliente_id
+        ).filter(Trabajo.estado == 'pendiente', Trabajo.montador_id.is_(None))
+        limite = leer_limite(request.args.get('limite'), defecto=50)
+
+        if 'near' in request.args:
+            return _trabajos_cercanos(consulta, montador, limite)
+
+        zona_param = request.args.get('zona')
+        if zona_param is None:
+            zonas = zonas_de_servicio(montador.zona_servicio)
+        elif zona_param.lower() == 'todas':
+            zonas = []
+        else:
+            zonas = zonas_de_servicio(zona_param)
+
+        if zonas:
+            # Los trabajos legacy sin zona calculada se muestran a todos
+            consulta = consulta.filter(
+                or_(Trabajo.zona_clave.in_(zonas), Trabajo.zona_clave.is_(None))
+            )
+
+        filas, siguiente = paginar_desc(
+            consulta, (Trabajo.fecha_creacion, Trabajo.id),
+            request.args.get('cursor'), limite,
+            clave=lambda fila: (fila[0].fecha_creacion, fila[0].id)
+        )
+    except (CursorInvalido, ValueError):
+        return jsonify({"error": "Parámetros de paginación inválidos"}), 400
     except Exception as e: # pylint: disable=broad-exception-caught
         print(f"Error en get_trabajos_disponibles: {e}")
         return jsonify({"error": "Error al obtener trabajos"}), 500
 
+    res = [_trabajo_disponible_a_dict(t, cliente_nombre) for t, cliente_nombre in filas]
+    return respuesta_paginada(jsonify(res), siguiente), 200
+
+
+def _trabajos_cercanos(consulta, montador, limite):
+    """
+    ?near=36.72,-4.42 | ?near=centro (centro del montador) | ?near=Marbella
+    y opcional ?radio_km= (si no, el radio del montador o RADIO_POR_DEFECTO_KM).
+    Rangos de prefijo geohash sobre ix_trabajo_feed_geohash y filtro/orden por
+    distancia dentro del SQL. Paginado por (distancia, id).
+    """
+    near = request.args.get('near', '').strip()
+    if not near or near.lower() == 'centro':
+        if montador.centro_lat is not None and montador.centro_lng is not None:
+            centro = (montador.centro_lat, montador.centro_lng)
+        else:
+            centro = geocodificar(montador.zona_servicio)
+    elif ',' in near and geocodificar(near) is None:
+        lat, lng = (float(v) for v in near.split(',', 1))
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError('Coordenadas fuera de rango')
+        centro = (lat, lng)
+    else:
+        centro = geocodificar(near)
+    if centro is None:
+        return jsonify({"error": "No se pudo ubicar el punto de búsqueda"}), 400
+
+    radio_km = float(request.args.get('radio_km') or montador.radio_km or RADIO_POR_DEFECTO_KM)
+    radio_km = max(0.5, min(radio_km, RADIO_MAXIMO_KM))
+
+    distancia2 = distancia2_sql(Trabajo.lat, Trabajo.lng, *centro)
+    consulta = consulta.add_columns(distancia2.label('distancia2')).filter(
+        filtro_prefijos(Trabajo.geohash, prefijos_cobertura(*centro, radio_km)),
+        distancia2 <= radio2_grados(radio_km)
+    )
+    filas, siguiente = paginar_asc(
+        consulta, (distancia2, Trabajo.id), request.args.get('cursor'), limite,
+        clave=lambda fila: (fila[2], fila[0].id)
+    )
+    res = [
+        _trabajo_disponible_a_dict(t, cliente_nombre, d2)
+        for t, cliente_nombre, d2 in filas
+    ]
+    return respuesta_paginada(jsonify(res), siguiente), 200
+
+
+def _trabajo_disponible_a_dict(t, cliente_nombre, distancia2=None):
+    """Tarjeta del feed (sin datos de contacto ni dirección exacta)."""
+    datos = {
+        "trabajo_id": t.id,
+        "descripcion": t.descripcion,
+        "direccion": f"📍 Zona de {t.zona or zona_de_direccion(t.direccion)}",
+        "direccion_completa": None,
+        "precio_calculado": t.precio_calculado,
+        "fecha_creacion": t.fecha_creacion.isoformat(),
+        "imagenes_urls": t.imagenes_urls,
+        "etiquetas": t.etiquetas,
+        "cliente_nombre": cliente_nombre or "Usuario Kiq",
+        "cliente_telefono": None,
+        "metodo_pago": t.metodo_pago,
+        # Normalizado al guardar (app/zonas.py): ya no se parsea aquí
+        "desglose": t.desglose
+    }
+    if distancia2 is not None:
+        # Aproximada (centro de la localidad), nunca la dirección exacta
+        datos["distancia_km"] = km_desde_distancia2(distancia2)
+    return datos
+
 
 @montador_bp.route('/montador/mis-trabajos', methods=['GET'])
 @jwt_required()
 def get_mis_trabajos_montador():
-    """Obtiene los trabajos asignados al montador."""
+    """
+    Obtiene los trabajos asignados al montador.
+    Con ?since=<cursor> devuelve solo lo creado/modificado y las bajas desde
+    ese cursor. El cursor de la próxima sincronización va en X-Sync-Cursor.
+    """
     claims = get_jwt()
     if claims.get('rol') != 'montador':
         return jsonify({"error": "Acceso no autorizado"}), 403
 
     try:
         montador_id = int(get_jwt_identity())
-        trabajos = Trabajo.query.filter_by(montador_id=montador_id).order_by(
-            Trabajo.fecha_creacion.desc()
-        ).all()
-        res = []
-        for t in trabajos:
-            c = Cliente.query.get(t.cliente_id)
-
-            desglose_data = t.desglose
-            if isinstance(desglose_data, str):
-                try:
-                    desglose_data = json.loads(desglose_data)
-                except json.JSONDecodeError:
-                    desglose_data = None
-
-            cliente_info = None
-            if c:
-                cliente_info = {
-                    "nombre": c.nombre,
-                    "foto_url": c.foto_url,
-                    "telefono": c.telefono
-                }
-
-            res.append({
-                "trabajo_id": t.id,
-                "descripcion": t.descripcion,
-                "direccion": t.direccion,
-                "precio_calculado": t.precio_calculado,
-                "estado": t.estado,
-                "cliente_nombre": c.nombre if c else "Cliente",
-                "cliente_info": cliente_info,
-                "imagenes_urls": t.imagenes_urls,
-                "desglose": desglose_data,
-                "metodo_pago": t.metodo_pago
-            })
-        return jsonify(res), 200
+
+        if 'since' in request.args:
+            return _sincronizar_mis_trabajos(montador_id, request.args['since'])
+
+        # Versión del listado (1 consulta agregada sobre la misma proyección):
+        # si no cambió, 304 sin cargar filas
+        consulta = _consulta_mis_trabajos(montador_id)
+        version = consulta.with_entities(
+            db.func.count(Trabajo.id), db.func.max(Trabajo.id),
+            db.func.max(Trabajo.updated_at), db.func.max(Cliente.updated_at)
+        ).one()
+        etag = calcular_etag('montador-trabajos', montador_id, *version)
+        no_modificado = respuesta_no_modificado(etag)
+        if no_modificado:
+            return no_modificado
+
+        cursor = nuevo_cursor()
+        filas = consulta.order_by(Trabajo.fecha_creacion.desc()).all()
+        res = [_trabajo_a_dict(f) for f in filas]
+
+        respuesta = con_etag(make_response(jsonify(res), 200), etag)
+        respuesta.headers['X-Sync-Cursor'] = cursor
+        return respuesta
     except Exception as e: # pylint: disable=broad-exception-caught
         print(f"Error en get_mis_trabajos_montador: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+def _sincronizar_mis_trabajos(montador_id, since):
+    """Delta desde el cursor: trabajos cambiados (con su cliente) + bajas."""
+    try:
+        desde = leer_cursor(since)
+    except CursorInvalido:
+        return jsonify({"error": "Cursor de sincronización inválido"}), 400
+    except CursorCaducado:
+        return jsonify({"error": "Cursor caducado. Recarga el listado completo."}), 410
+
+    cursor = nuevo_cursor()
+    filas = _consulta_mis_trabajos(montador_id).filter(
+        or_(Trabajo.updated_at > desde, Cliente.updated_at > desde)
+    ).order_by(Trabajo.fecha_creacion.desc()).all()
+
+    trabajos = [_trabajo_a_dict(f) for f in filas]
+    eliminados = bajas_desde(
+        TrabajoBaja.montador_id, montador_id, desde, excluir=[f.id for f in filas]
+    )
+
+    respuesta = make_response(jsonify({
+        "trabajos": trabajos,
+        "eliminados": eliminados,
+        "cursor": cursor
+    }), 200)
+    respuesta.headers['X-Sync-Cursor'] = cursor
+    return respuesta
+
+
+def _consulta_mis_trabajos(montador_id):
+    """Proyección trabajo + nombre/teléfono/foto del cliente (LEFT JOIN)."""
+    return db.session.query(
+        Trabajo.id, Trabajo.descripcion, Trabajo.direccion, Trabajo.precio_calculado,
+        Trabajo.estado, Trabajo.imagenes_urls, Trabajo.desglose, Trabajo.metodo_pago,
+        Cliente.id.label('cliente_id'),
+        Cliente.nombre.label('cliente_nombre'),
+        Cliente.telefono.label('cliente_telefono'),
+        Cliente.foto_url.label('cliente_foto_url')
+    ).outerjoin(
+        Cliente, Cliente.id == Trabajo.cliente_id
+    ).filter(Trabajo.montador_id == montador_id)
+
+
+def _trabajo_a_dict(t):
+    """Formato de un trabajo en el panel del montador (fila de _consulta_mis_trabajos)."""
+    desglose_data = t.desglose
+    if isinstance(desglose_data, str):
+        try:
+            desglose_data = json.loads(desglose_data)
+        except json.JSONDecodeError:
+            desglose_data = None
+
+    cliente_info = None
+    if t.cliente_id is not None:
+        cliente_info = {
+            "nombre": t.cliente_nombre,
+            "foto_url": t.cliente_foto_url,
+            "telefono": t.cliente_telefono
+        }
+
+    return {
+        "trabajo_id": t.id,
+        "descripcion": t.descripcion,
+        "direccion": t.direccion,
+        "precio_calculado": t.precio_calculado,
+        "estado": t.estado,
+        "cliente_nombre": t.cliente_nombre if t.cliente_id is not None else "Cliente",
+        "cliente_info": cliente_info,
+        "imagenes_urls": t.imagenes_urls,
+        "desglose": desglose_data,
+        "metodo_pago": t.metodo_pago
+    }
+
+
+@montador_bp.route('/montador/contadores', methods=['GET'])
+@jwt_required()
+def get_contadores_montador():
+    """Badges del panel (activos, en revisión, completados...) sin COUNT(*)."""
+    claims = get_jwt()
+    if claims.get('rol') != 'montador':
+        return jsonify({"error": "Acceso no autorizado"}), 403
+    return jsonify(contadores_de('montador', int(get_jwt_identity()))), 200
+
+
 @montador_bp.route('/montador/trabajo/<int:trabajo_id>/aceptar', methods=['POST'])
 @jwt_required()
 def aceptar_trabajo(trabajo_id):
-    """El montador acepta un trabajo disponible."""
+    """
+    El montador acepta un trabajo disponible.
+    Compare-and-set: un único UPDATE condicionado (pendiente y sin montador,
+    ver app/trabajo_estados.py) decide quién se lo queda, y el cobro de gemas es
+    otro UPDATE condicionado al saldo, en la misma transacción. Si algo falla se
+    hace rollback de ambos. La fila del montador queda bloqueada hasta el commit
+    para decidir sin carreras si es su primer trabajo (gratis).
+    """
     claims = get_jwt()
     if claims.get('rol') != 'montador':
         return jsonify({"error": "Acceso no autorizado"}), 403
 
     try:
         montador_id = int(get_jwt_identity())
-        montador = Montador.query.get(montador_id)
-        trabajo = Trabajo.query.get(trabajo_id)
+        # Bloquea la fila del montador hasta el commit: dos aceptaciones suyas a la
+        # vez se serializan y la segunda ya ve el primer trabajo (no hay dos gratis).
+        # Sentencia aparte: la consulta de abajo toma su snapshot DESPUÉS del bloqueo
+        if db.session.query(Montador.id).filter(
+            Montador.id == montador_id
+        ).with_for_update().scalar() is None:
+            return jsonify({"error": "Montador no encontrado"}), 404
 
-        if not trabajo or trabajo.estado != 'pendiente' or trabajo.montador_id is not None:
+        # Cuenta de Stripe y si ya tiene trabajos (primer trabajo gratis) en 1 consulta:
+        # los contadores se leen por clave primaria, sin COUNT sobre 'trabajo'
+        montador = db.session.query(
+            Montador.stripe_account_id,
+            exists().where(
+                ContadorTrabajos.rol == 'montador',
+                ContadorTrabajos.usuario_id == Montador.id,
+                ContadorTrabajos.total > 0
+            ).label('tiene_trabajos')
+        ).filter(Montador.id == montador_id).first()
+
+        asignado = transicionar(trabajo_id, 'pendiente', 'aceptado', montador_id=montador_id)
+        if not asignado:
+            db.session.rollback()
             return jsonify({"error": "Trabajo no disponible"}), 400
 
         # --- LÓGICA ANZUELO STRIPE ---
-        if trabajo.metodo_pago == 'stripe':
-            if not montador.stripe_account_id:
-                return jsonify({
-                    "error": "stripe_required",
-                    "message": (
-                        "¡Buenas noticias! Este trabajo se paga con tarjeta. "
-                        "Conecta tu cuenta bancaria para cobrar."
-                    )
-                }), 428
+        if asignado.metodo_pago == 'stripe' and not montador.stripe_account_id:
+            db.session.rollback()
+            return jsonify({
+                "error": "stripe_required",
+                "message": (
+                    "¡Buenas noticias! Este trabajo se paga con tarjeta. "
+                    "Conecta tu cuenta bancaria para cobrar."
+                )
+            }), 428
 
         # --- Lógica de Gemas (Comisión Efectivo) ---
-        if trabajo.metodo_pago == 'efectivo_gemas':
-            coste_gemas = int(trabajo.precio_calculado * 0.10 * 10)
+        if asignado.metodo_pago == 'efectivo_gemas':
+            coste_gemas = int(asignado.precio_calculado * 0.10 * 10)
 
             # 🎁 BONIFICACIÓN: Primer trabajo GRATIS
-            trabajos_previos = Trabajo.query.filter_by(montador_id=montador_id).count()
-            if trabajos_previos == 0:
+            if not montador.tiene_trabajos:
                 coste_gemas = 0
 
-            # Verificar saldo
-            if montador.wallet.saldo < coste_gemas:
+            if coste_gemas > 0 and not debitar_gemas_montador(
+                montador_id, coste_gemas,
+                descripcion=f'Comisión trabajo #{trabajo_id}', trabajo_id=trabajo_id
+            ):
+                db.session.rollback()
                 return jsonify({
                     "error": f"Necesitas {coste_gemas} Gemas para aceptar este trabajo."
                 }), 402
 
-            if coste_gemas > 0:
-                recargar_gemas(
-                    wallet_id=montador.wallet.id,
-                    cantidad_recarga=-coste_gemas,
-                    descripcion=f'Comisión trabajo #{trabajo.id}'
-                )
-
-        # Asignación final
-        trabajo.montador_id = montador.id
-        trabajo.estado = 'aceptado'
+        cliente_telf = db.session.query(Cliente.telefono).filter(
+            Cliente.id == asignado.cliente_id
+        ).scalar()
         db.session.commit()
 
-        cliente_telf = trabajo.cliente.telefono if trabajo.cliente else None
-
         return jsonify({
             "success": True,
             "message": "¡Trabajo aceptado! Contacta con el cliente.",
@@ -213,21 +395,26 @@ def finalizar_con_evidencia(trabajo_id):
         return jsonify({"error": "Archivo vacío."}), 400
 
     try:
-        trabajo = Trabajo.query.filter_by(
+        # Comprobación previa barata para no subir fotos de trabajos ajenos
+        estado = db.session.query(Trabajo.estado).filter_by(
             id=trabajo_id, montador_id=montador_id
-        ).first()
+        ).scalar()
 
-        if not trabajo:
+        if not estado:
             return jsonify({"error": "Trabajo no encontrado"}), 404
-        if trabajo.estado != 'aceptado':
+        if estado != 'aceptado':
             return jsonify({"error": "Estado incorrecto"}), 400
 
         url_publica = upload_image_to_gcs(file, folder="evidencias")
         if not url_publica:
             return jsonify({"error": "Error al subir a GCS."}), 500
 
-        trabajo.foto_finalizacion = url_publica
-        trabajo.estado = 'revision_cliente'
+        if not transicionar(
+            trabajo_id, 'aceptado', 'revision_cliente',
+            Trabajo.montador_id == montador_id, foto_finalizacion=url_publica
+        ):
+            db.session.rollback()
+            return jsonify({"error": "Estado incorrecto"}), 409
         db.session.commit()
 
         return jsonify({
@@ -253,12 +440,17 @@ def reportar_trabajo_fallido(trabajo_id):
 
     try:
         montador_id = int(get_jwt_identity())
-        trabajo = Trabajo.query.filter_by(id=trabajo_id, montador_id=montador_id).first()
+        trabajo = transicionar(
+            trabajo_id, 'aceptado', 'cancelado_incidencia', Trabajo.montador_id == montador_id
+        )
 
         if not trabajo:
-            return jsonify({"error": "Trabajo no encontrado"}), 404
-
-        if trabajo.estado != 'aceptado':
+            db.session.rollback()
+            existe = db.session.query(Trabajo.id).filter_by(
+                id=trabajo_id, montador_id=montador_id
+            ).scalar()
+            if not existe:
+                return jsonify({"error": "Trabajo no encontrado"}), 404
             return jsonify({"error": "Solo se pueden cancelar trabajos activos"}), 400
 
         gemas_a_devolver = 0
@@ -266,13 +458,12 @@ def reportar_trabajo_fallido(trabajo_id):
             gemas_a_devolver = int(trabajo.precio_calculado * 0.10 * 10)
 
         if gemas_a_devolver > 0:
-            recargar_gemas(
-                wallet_id=trabajo.montador.wallet.id,
-                cantidad_recarga=gemas_a_devolver,
-                descripcion=f'Reembolso por trabajo fallido #{trabajo.id}'
+            abonar_gemas_montador(
+                montador_id, gemas_a_devolver,
+                descripcion=f'Reembolso por trabajo fallido #{trabajo_id}',
+                trabajo_id=trabajo_id
             )
 
-        trabajo.estado = 'cancelado_incidencia'
         db.session.commit()
 
         return jsonify({
@@ -4,13 +4,14 @@ Gestiona la creación de pedidos (Orders), pagos y consultas de historial.
 """
 # 1. Imports de terceros
 import stripe
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 # Eliminado SQLAlchemyError que no se usaba
 
 # 2. Imports locales
 from app.models import Product, Order, Cliente
 from app.extensions import db
+from app.etag import calcular_etag, respuesta_no_modificado, con_etag
 
 order_bp = Blueprint('orders', __name__)
 
@@ -165,6 +166,18 @@ def get_mis_compras():
         return jsonify({"error": "Solo clientes compran"}), 403
 
     try:
+        # Versión del listado (pedidos + productos): si no cambió, 304 sin cargar filas
+        version = db.session.query(
+            db.func.count(Order.id), db.func.max(Order.id), db.func.max(Order.updated_at),
+            db.func.count(Product.id), db.func.max(Product.updated_at)
+        ).outerjoin(Product, Product.id == Order.product_id).filter(
+            Order.comprador_id == user_id
+        ).one()
+        etag = calcular_etag('mis-compras', user_id, *version)
+        no_modificado = respuesta_no_modificado(etag)
+        if no_modificado:
+            return no_modificado
+
         ordenes = Order.query.filter_by(comprador_id=user_id).order_by(
             Order.created_at.desc()
         ).all()
@@ -186,7 +199,7 @@ def get_mis_compras():
                         "ubicacion": prod.ubicacion
                     }
                 })
-        return jsonify(res), 200
+        return con_etag(make_response(jsonify(res), 200), etag)
     except Exception as e: # pylint: disable=broad-exception-caught
         print(f"Error listando compras: {e}")
         return jsonify({"error": "Error obteniendo compras"}), 500
@@ -7,9 +7,11 @@ from flask import Blueprint, request, jsonify, make_response
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from sqlalchemy.exc import SQLAlchemyError
 
-from app.models import Product, Montador, Cliente, Trabajo
+from app.models import Product, Montador, Cliente
 from app.extensions import db
 from app.storage import upload_image_to_gcs
+from app.etag import calcular_etag, respuesta_no_modificado, con_etag
+from app.chat_service import obtener_o_crear_conversacion, enviar_mensaje
 
 outlet_bp = Blueprint('outlet', __name__)
 
@@ -191,7 +193,10 @@ def get_producto_detalle(product_id):
 @outlet_bp.route('/outlet/iniciar-chat', methods=['POST'])
 @jwt_required()
 def iniciar_chat_outlet():
-    """Crea un 'Trabajo' ficticio para chatear sobre un producto."""
+    """
+    Abre (o recupera) el chat con el vendedor de un producto.
+    Opcional: {"mensaje": "..."} para enviar ya el primer mensaje.
+    """
     try:
         user_id = int(get_jwt_identity())
         claims = get_jwt()
@@ -223,42 +228,24 @@ def iniciar_chat_outlet():
         if tipo_comprador == 'montador' and user_id == vendedor_id:
             return jsonify({"error": "No puedes chatear contigo mismo"}), 400
 
-        # Buscar chat existente
-        trabajos_existentes = Trabajo.query.filter_by(
-            cliente_id=user_id,
-            montador_id=vendedor_id
-        ).all()
-
-        job_id = None
-
-        for t in trabajos_existentes:
-            if t.etiquetas and isinstance(t.etiquetas, dict):
-                if str(t.etiquetas.get('outlet_product_id')) == str(product_id):
-                    job_id = t.id
-                    break
-
-        if not job_id:
-            nuevo_chat = Trabajo(
-                descripcion=f"Interés en Outlet: {producto.titulo}",
-                direccion="Recogida Outlet",
-                precio_calculado=float(producto.precio),
-                cliente_id=user_id,
-                montador_id=vendedor_id,
-                estado='aceptado',
-                metodo_pago='efectivo_gemas',
-                etiquetas={'outlet_product_id': producto.id, 'tipo': 'outlet'},
-                imagenes_urls=producto.imagenes_urls
-            )
-            db.session.add(nuevo_chat)
-            db.session.commit()
-            job_id = nuevo_chat.id
+        # Chat existente o nuevo (índice único producto + comprador)
+        conversacion, creada = obtener_o_crear_conversacion(
+            producto, tipo_comprador, user_id
+        )
+        if data.get('mensaje'):
+            enviar_mensaje(conversacion, tipo_comprador, user_id, data['mensaje'])
+        db.session.commit()
 
         return jsonify({
             "success": True,
-            "job_id": job_id,
-            "message": "Chat iniciado"
+            "conversacion_id": conversacion.id,
+            "job_id": conversacion.trabajo_id,  # Solo si el vendedor ya registró la venta
+            "message": "Chat iniciado" if creada else "Chat existente"
         }), 200
 
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
     except Exception as e: # pylint: disable=broad-exception-caught
         db.session.rollback()
         print(f"Error en iniciar_chat_outlet: {e}")
@@ -332,14 +319,24 @@ def get_mis_productos_publicados():
 
     try:
         # CORREGIDO: Usamos 'rol' en lugar de 'tipo'
-        if claims.get('rol') == 'montador':
-            productos = Product.query.filter_by(montador_id=user_id).order_by(
-                Product.fecha_creacion.desc()
-            ).all()
+        rol = claims.get('rol')
+        if rol == 'montador':
+            filtro = Product.montador_id == user_id
         else:
-            productos = Product.query.filter_by(cliente_id=user_id).order_by(
-                Product.fecha_creacion.desc()
-            ).all()
+            filtro = Product.cliente_id == user_id
+
+        # Versión del listado: si no cambió, 304 sin cargar filas
+        version = db.session.query(
+            db.func.count(Product.id), db.func.max(Product.id), db.func.max(Product.updated_at)
+        ).filter(filtro).one()
+        etag = calcular_etag('mis-productos', rol, user_id, *version)
+        no_modificado = respuesta_no_modificado(etag)
+        if no_modificado:
+            return no_modificado
+
+        productos = Product.query.filter(filtro).order_by(
+            Product.fecha_creacion.desc()
+        ).all()
 
         res = []
         for p in productos:
@@ -352,10 +349,8 @@ def get_mis_productos_publicados():
                 "fecha": p.fecha_creacion.isoformat(),
             })
 
-        # No cache para ver los cambios al instante
-        response = make_response(jsonify(res), 200)
-        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-        return response
+        # Sin caché "a ciegas": el navegador revalida siempre con el ETag
+        return con_etag(make_response(jsonify(res), 200), etag)
 
     except Exception as e:  # pylint: disable=broad-exception-caught
         print(f"Error en get_mis_productos: {e}")
@@ -0,0 +1,95 @@
+"""
+Sincronización incremental de los listados de trabajos (?since=<cursor>).
+El cursor es una marca de tiempo del servidor (opaca para el frontend). Con él
+se devuelven solo los trabajos creados o modificados después (índices
+(cliente_id, updated_at) / (montador_id, updated_at)) y las bajas: trabajos
+borrados o desasignados, registrados en 'trabajo_baja' por eventos del ORM (y
+por transicionar() en app/trabajo_estados.py para sus UPDATE directos).
+"""
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect
+
+from .extensions import db
+from .models import Trabajo, TrabajoBaja
+from .pagination import codificar_cursor, decodificar_cursor, CursorInvalido
+
+# El cursor se retrasa este margen: cubre transacciones que fijaron updated_at
+# pero aún no habían hecho commit (el cliente recibe algún duplicado, no pierde nada)
+SYNC_MARGEN_SEGUNDOS = int(os.getenv('SYNC_MARGEN_SEGUNDOS', '10'))
+# Bajas más antiguas se purgan; un cursor anterior obliga a recarga completa
+SYNC_RETENCION_DIAS = int(os.getenv('SYNC_RETENCION_DIAS', '30'))
+
+
+class CursorCaducado(Exception):
+    """El cursor es anterior a la retención de bajas: hay que recargar todo."""
+
+
+def nuevo_cursor():
+    """Cursor para la próxima sincronización (tomarlo ANTES de leer las filas)."""
+    return codificar_cursor(datetime.utcnow() - timedelta(seconds=SYNC_MARGEN_SEGUNDOS))
+
+
+def leer_cursor(cursor):
+    """Cursor -> datetime. Lanza CursorInvalido o CursorCaducado."""
+    valores = decodificar_cursor(cursor)
+    if not valores or not isinstance(valores[0], datetime):
+        raise CursorInvalido('Cursor de sincronización inválido')
+    if valores[0] < datetime.utcnow() - timedelta(days=SYNC_RETENCION_DIAS):
+        raise CursorCaducado()
+    return valores[0]
+
+
+def bajas_desde(columna_usuario, usuario_id, desde, excluir=()):
+    """Ids de trabajos que salieron del listado del usuario desde 'desde'."""
+    filas = db.session.query(TrabajoBaja.trabajo_id).filter(
+        columna_usuario == usuario_id, TrabajoBaja.fecha > desde
+    ).distinct().all()
+    excluir = set(excluir)
+    return [trabajo_id for (trabajo_id,) in filas if trabajo_id not in excluir]
+
+
+def purgar_bajas():
+    """Borra las bajas más antiguas que la retención. Devuelve cuántas."""
+    limite = datetime.utcnow() - timedelta(days=SYNC_RETENCION_DIAS)
+    borradas = TrabajoBaja.query.filter(TrabajoBaja.fecha < limite).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+    return borradas
+
+
+# --- REGISTRO AUTOMÁTICO DE BAJAS (dentro del mismo flush/transacción) ---
+
+def registrar_baja(connection, trabajo_id, motivo, cliente_id=None, montador_id=None):
+    """
+    Inserta una baja en la conexión dada (misma transacción que el cambio).
+    La usan los eventos del ORM y transicionar(), cuyos UPDATE directos no
+    pasan por esos eventos.
+    """
+    connection.execute(TrabajoBaja.__table__.insert().values(
+        trabajo_id=trabajo_id,
+        cliente_id=cliente_id,
+        montador_id=montador_id,
+        motivo=motivo,
+        fecha=datetime.utcnow()
+    ))
+
+
+def _registrar_borrado(_mapper, connection, target):
+    registrar_baja(
+        connection, target.id, 'borrado',
+        cliente_id=target.cliente_id, montador_id=target.montador_id
+    )
+
+
+def _registrar_desasignacion(_mapper, connection, target):
+    historial = inspect(target).attrs.montador_id.history
+    for montador_anterior in historial.deleted or ():
+        if montador_anterior is not None and montador_anterior != target.montador_id:
+            registrar_baja(connection, target.id, 'desasignado', montador_id=montador_anterior)
+
+
+event.listen(Trabajo, 'after_delete', _registrar_borrado)
+event.listen(Trabajo, 'after_update', _registrar_desasignacion)
@@ -0,0 +1,86 @@
+"""
+Servicio de Tokens JWT: emite pares access/refresh y gestiona la revocación.
+Renovar sesión con /auth/refresh no verifica contraseña ni consulta la tabla
+de usuarios: como mucho, una consulta indexada por jti a 'token_revocado'.
+Los jti revocados se guardan además en un set en memoria (16 bytes por jti).
+"""
+import uuid
+from datetime import datetime, timezone
+
+from flask_jwt_extended import create_access_token, create_refresh_token
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from .extensions import db, jwt
+from .models import TokenRevocado
+
+# Set compacto de jti revocados en este proceso
+_REVOCADOS = set()
+
+
+def _clave(jti):
+    """uuid4 en texto (36 bytes) -> 16 bytes binarios."""
+    try:
+        return uuid.UUID(jti).bytes
+    except (ValueError, TypeError, AttributeError):
+        return jti
+
+
+def emitir_tokens(usuario_id, rol):
+    """Devuelve (access_token, refresh_token) para el usuario y rol."""
+    claims = {"rol": rol}
+    access_token = create_access_token(identity=str(usuario_id), additional_claims=claims)
+    refresh_token = create_refresh_token(identity=str(usuario_id), additional_claims=claims)
+    return access_token, refresh_token
+
+
+def revocar_token(payload):
+    """
+    Revoca un refresh token (payload JWT decodificado).
+    Devuelve False si ya estaba revocado (p. ej. dos renovaciones simultáneas).
+    """
+    jti = payload['jti']
+    expira_en = datetime.fromtimestamp(payload['exp'], tz=timezone.utc).replace(tzinfo=None)
+    try:
+        db.session.add(TokenRevocado(jti=jti, expira_en=expira_en))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        _REVOCADOS.add(_clave(jti))
+        return False
+    _REVOCADOS.add(_clave(jti))
+    return True
+
+
+def cargar_revocados():
+    """Purga los revocados caducados y carga el resto en memoria (arranque)."""
+    ahora = datetime.utcnow()
+    try:
+        TokenRevocado.query.filter(TokenRevocado.expira_en < ahora).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        for (jti,) in db.session.query(TokenRevocado.jti).yield_per(5000):
+            _REVOCADOS.add(_clave(jti))
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"⚠️ No se pudo cargar la lista de tokens revocados: {e}")
+
+
+@jwt.token_in_blocklist_loader
+def token_revocado(_jwt_header, jwt_payload):
+    """
+    Solo se comprueban refresh tokens (los access tokens son de vida corta).
+    Primero el set en memoria; si no está, 1 consulta por jti (índice único)
+    por si lo revocó otro worker.
+    """
+    if jwt_payload.get('type') != 'refresh':
+        return False
+
+    jti = jwt_payload['jti']
+    if _clave(jti) in _REVOCADOS:
+        return True
+
+    revocado = db.session.query(TokenRevocado.id).filter_by(jti=jti).first() is not None
+    if revocado:
+        _REVOCADOS.add(_clave(jti))
+    return revocado
@@ -0,0 +1,169 @@
+"""
+Máquina de estados de Trabajo.
+TRANSICIONES declara qué cambios de estado existen; transicionar() ejecuta
+cada uno como UN UPDATE condicionado al estado de origen (compare-and-set):
+
+    UPDATE trabajo SET estado = :destino, ... WHERE id = :id AND estado = :origen
+    RETURNING *
+
+Si otro proceso (webhook de Stripe, el montador, el cliente) se adelantó, el
+UPDATE no toca ninguna fila y se devuelve None: nunca se pisa un cambio ajeno.
+Los UPDATE directos no pasan por los eventos del ORM, así que aquí se hace
+explícitamente lo que esos eventos harían: fijar updated_at (sincronización
+?since=), registrar la baja si se quita el montador (app/sync_service.py),
+mantener los contadores por usuario/estado (app/contadores.py), caducar la copia
+del trabajo en la sesión y anunciar el cambio a los paneles por SSE
+(app/event_hub.py) cuando la transacción hace commit. NO hace commit.
+"""
+from datetime import datetime
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm.util import identity_key
+
+from .extensions import db
+from .models import Trabajo
+from .contadores import mover_trabajo
+from .sync_service import registrar_baja
+from .event_hub import encolar
+from .zonas import zona_de_direccion
+
+# estado de origen -> estados de destino permitidos
+TRANSICIONES = {
+    'cotizacion': {'pendiente', 'cancelado'},
+    'pendiente': {'aceptado', 'cancelado'},
+    'aceptado': {'en_progreso', 'revision_cliente', 'cancelado_incidencia', 'cancelado'},
+    'en_progreso': {'revision_cliente', 'incidencia', 'cancelado_incidencia'},
+    'revision_cliente': {'completado', 'aprobado_cliente_stripe', 'incidencia', 'cancelado'},
+    'aprobado_cliente_stripe': {'completado', 'cancelado'},
+    'incidencia': {'revision_cliente', 'cancelado_incidencia', 'cancelado'},
+    'cancelado_incidencia': {'cancelado'},
+    'completado': set(),
+    'cancelado': set(),
+}
+assert set(TRANSICIONES) == set(Trabajo.ESTADOS_TRABAJO), 'Estados sin declarar'
+
+
+class TransicionInvalida(ValueError):
+    """Cambio de estado no declarado en TRANSICIONES (error de programación)."""
+
+
+def puede_transicionar(origen, destino):
+    """True si el cambio origen -> destino está declarado."""
+    return destino in TRANSICIONES.get(origen, ())
+
+
+def transicionar(trabajo_id, origen, destino, *condiciones, **valores):
+    """
+    Pasa el trabajo de 'origen' (un estado o una tupla de estados) a 'destino'.
+    'condiciones' son filtros extra (p. ej. Trabajo.cliente_id == 7) y 'valores'
+    otras columnas a fijar en la misma sentencia. Asignar montador_id exige
+    que no tuviera montador; quitarlo (montador_id=None) registra su baja.
+    Devuelve la fila ya actualizada o None.
+    Con varios orígenes se prueba uno a uno (cada intento sigue siendo atómico).
+    """
+    origenes = (origen,) if isinstance(origen, str) else tuple(origen)
+    for estado in origenes:
+        if not puede_transicionar(estado, destino):
+            raise TransicionInvalida(f'{estado} -> {destino}')
+
+    tabla = Trabajo.__table__
+    filtros = list(condiciones)
+    libera = 'montador_id' in valores and valores['montador_id'] is None
+    if 'montador_id' in valores and not libera:
+        filtros.append(tabla.c.montador_id.is_(None))
+    valores.setdefault('updated_at', datetime.utcnow())
+
+    conexion = db.session.connection()
+    for estado in origenes:
+        montador_previo = None
+        if libera:
+            # RETURNING solo da los valores nuevos: se lee (y bloquea) el anterior
+            montador_previo = conexion.execute(
+                select(tabla.c.montador_id).where(tabla.c.id == trabajo_id).with_for_update()
+            ).scalar()
+        fila = conexion.execute(
+            tabla.update().where(
+                tabla.c.id == trabajo_id, tabla.c.estado == estado, *filtros
+            ).values(estado=destino, **valores).returning(*tabla.c)
+        ).first()
+        if fila is None:
+            continue
+
+        montador_anterior = montador_previo if 'montador_id' in valores else fila.montador_id
+        if montador_anterior is not None and montador_anterior != fila.montador_id:
+            registrar_baja(conexion, fila.id, 'desasignado', montador_id=montador_anterior)
+        mover_trabajo(
+            conexion,
+            (fila.cliente_id, montador_anterior, estado),
+            (fila.cliente_id, fila.montador_id, destino)
+        )
+        _caducar_en_sesion(trabajo_id, ['estado', *valores])
+        anunciar_trabajo(db.session, fila, estado)
+        return fila
+    return None
+
+
+def _caducar_en_sesion(trabajo_id, columnas):
+    """Si la sesión ya tenía cargado el trabajo, caduca lo que cambió el UPDATE."""
+    trabajo = db.session.identity_map.get(identity_key(Trabajo, trabajo_id))
+    if trabajo is not None:
+        db.session.expire(trabajo, columnas)
+
+
+# --- EVENTOS EN TIEMPO REAL (SSE) ---
+
+def canal_zona(zona_clave):
+    """Canal de los trabajos pendientes de una zona ('zona:-' = sin zona, legacy)."""
+    return f"zona:{zona_clave or '-'}"
+
+
+def anunciar_trabajo(session, trabajo, estado_anterior=None):
+    """
+    Encola los eventos de un trabajo creado o que cambió de estado:
+    - 'trabajo_estado' al cliente y al montador asignado,
+    - 'trabajo_nuevo' / 'trabajo_retirado' al canal de su zona (feed de disponibles).
+    'trabajo' puede ser la fila devuelta por el UPDATE o el objeto del ORM.
+    """
+    canales = [f'cliente:{trabajo.cliente_id}']
+    if trabajo.montador_id:
+        canales.append(f'montador:{trabajo.montador_id}')
+    encolar(session, canales, 'trabajo_estado', {
+        'trabajo_id': trabajo.id,
+        'estado': trabajo.estado,
+        'estado_anterior': estado_anterior,
+        'montador_id': trabajo.montador_id,
+        'updated_at': trabajo.updated_at
+    })
+
+    if trabajo.estado == 'pendiente' and trabajo.montador_id is None:
+        # Tarjeta sin datos de contacto (mismo filtro de privacidad que el feed)
+        encolar(session, [canal_zona(trabajo.zona_clave)], 'trabajo_nuevo', {
+            'trabajo_id': trabajo.id,
+            'descripcion': trabajo.descripcion,
+            'direccion': f"📍 Zona de {trabajo.zona or zona_de_direccion(trabajo.direccion)}",
+            'precio_calculado': trabajo.precio_calculado,
+            'fecha_creacion': trabajo.fecha_creacion,
+            'imagenes_urls': trabajo.imagenes_urls,
+            'etiquetas': trabajo.etiquetas,
+            'metodo_pago': trabajo.metodo_pago,
+            'desglose': trabajo.desglose
+        })
+    elif estado_anterior == 'pendiente':
+        encolar(session, [canal_zona(trabajo.zona_clave)], 'trabajo_retirado', {
+            'trabajo_id': trabajo.id
+        })
+
+
+def _anunciar_alta(_mapper, _connection, target):
+    anunciar_trabajo(inspect(target).session, target)
+
+
+def _anunciar_cambio(_mapper, _connection, target):
+    """Cambios de estado hechos por el ORM (los de transicionar() ya se anunciaron)."""
+    historial = inspect(target).attrs.estado.history
+    if historial.deleted and historial.deleted[0] != target.estado:
+        anunciar_trabajo(inspect(target).session, target, historial.deleted[0])
+
+
+event.listen(Trabajo, 'after_insert', _anunciar_alta)
+event.listen(Trabajo, 'after_update', _anunciar_cambio)
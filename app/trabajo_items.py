@@ -0,0 +1,113 @@
+"""
+Partidas presupuestadas de cada trabajo (tabla 'trabajo_item').
+Se escriben en la MISMA transacción que el trabajo (eventos del ORM) a partir de
+desglose['muebles_cotizados'], que puede venir como dict o como texto JSON.
+Así "¿cuántos canapés grandes se presupuestaron el mes pasado?" es un agregado
+con índice (tipo, variante, fecha) en vez de recorrer cada desglose en Python.
+Histórico: flask mantenimiento rellenar-items
+"""
+import json
+
+from sqlalchemy import event, func, inspect
+
+from .extensions import db
+from .models import Trabajo, TrabajoItem
+from .calculator import TARIFARIO
+
+TIPO_GENERICO = 'otro'
+# Desgloses antiguos solo guardaban el texto mostrado ("Canapé Abatible")
+_TIPO_POR_NOMBRE = {
+    tarifa['display_name']['es'].lower(): tipo
+    for tipo, tarifa in TARIFARIO.items() if 'display_name' in tarifa
+}
+
+
+def _numero(valor, tipo, defecto=None):
+    try:
+        return tipo(valor)
+    except (TypeError, ValueError):
+        return defecto
+
+
+def items_de_desglose(desglose):
+    """desglose (dict o texto JSON) -> lista de dicts con las columnas de TrabajoItem."""
+    if isinstance(desglose, str):
+        try:
+            desglose = json.loads(desglose)
+        except json.JSONDecodeError:
+            return []
+    if not isinstance(desglose, dict):
+        return []
+
+    items = []
+    for mueble in desglose.get('muebles_cotizados') or []:
+        if not isinstance(mueble, dict):
+            continue
+        nombre = mueble.get('item')
+        tipo = mueble.get('tipo') or _TIPO_POR_NOMBRE.get(str(nombre or '').lower())
+        atributos = mueble.get('atributos')
+        items.append({
+            'tipo': tipo or TIPO_GENERICO,
+            'variante': mueble.get('variante'),
+            'nombre': str(nombre)[:100] if nombre else None,
+            'cantidad': _numero(mueble.get('cantidad'), int, 1),
+            'precio_unitario': _numero(mueble.get('precio_unitario'), float),
+            'subtotal': _numero(mueble.get('subtotal'), float),
+            'atributos': atributos if isinstance(atributos, dict) else None
+        })
+    return items
+
+
+def escribir_items(connection, trabajo_id, fecha, desglose):
+    """Inserta las partidas del desglose (una sentencia). Devuelve cuántas."""
+    items = items_de_desglose(desglose)
+    if items:
+        connection.execute(TrabajoItem.__table__.insert(), [
+            {**item, 'trabajo_id': trabajo_id, 'fecha': fecha} for item in items
+        ])
+    return len(items)
+
+
+def resumen_items(desde, hasta, tipo=None):
+    """
+    Unidades, nº de trabajos e importe por (tipo, variante) presupuestados
+    en [desde, hasta). Una consulta GROUP BY sobre trabajo_item.
+    """
+    consulta = db.session.query(
+        TrabajoItem.tipo, TrabajoItem.variante,
+        func.sum(TrabajoItem.cantidad).label('unidades'),
+        func.count(func.distinct(TrabajoItem.trabajo_id)).label('trabajos'),
+        func.sum(TrabajoItem.subtotal).label('importe')
+    ).filter(TrabajoItem.fecha >= desde, TrabajoItem.fecha < hasta)
+    if tipo:
+        consulta = consulta.filter(TrabajoItem.tipo == tipo)
+    return consulta.group_by(TrabajoItem.tipo, TrabajoItem.variante).order_by(
+        func.sum(TrabajoItem.cantidad).desc()
+    ).all()
+
+
+# --- MANTENIMIENTO AUTOMÁTICO (eventos del ORM, dentro del mismo flush) ---
+
+def _borrar_items(connection, trabajo_id):
+    tabla = TrabajoItem.__table__
+    connection.execute(tabla.delete().where(tabla.c.trabajo_id == trabajo_id))
+
+
+def _al_crear(_mapper, connection, target):
+    escribir_items(connection, target.id, target.fecha_creacion, target.desglose)
+
+
+def _al_modificar(_mapper, connection, target):
+    if inspect(target).attrs.desglose.history.has_changes():
+        _borrar_items(connection, target.id)
+        escribir_items(connection, target.id, target.fecha_creacion, target.desglose)
+
+
+def _al_borrar(_mapper, connection, target):
+    # SQLite no aplica ON DELETE CASCADE sin PRAGMA foreign_keys
+    _borrar_items(connection, target.id)
+
+
+event.listen(Trabajo, 'after_insert', _al_crear)
+event.listen(Trabajo, 'after_update', _al_modificar)
+event.listen(Trabajo, 'before_delete', _al_borrar)
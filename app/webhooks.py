@@ -9,9 +9,10 @@ from dotenv import load_dotenv
 
 # Importaciones locales necesarias
 from app.extensions import db
-from app.models import Montador, Trabajo, Product
+from app.models import Montador, Product
 from app import gems_service
 from app.gems_service import obtener_o_crear_wallet
+from app.trabajo_estados import transicionar
 
 # Cargar variables de entorno
 load_dotenv()
@@ -104,29 +105,30 @@ def handle_payment_intent_succeeded(payment_intent):
         return False
 
     try:
-        trabajo = Trabajo.query.get(trabajo_id)
-        if not trabajo:
-            print(f"⚠️ Trabajo {trabajo_id} no encontrado.")
-            return False
-
-        # Si el pago tuvo éxito, pasamos el trabajo al siguiente estado lógico
+        trabajo_id = int(trabajo_id)
+        # Si el pago tuvo éxito, pasamos el trabajo al siguiente estado lógico.
+        # Cada paso es un UPDATE condicionado: si el cliente ya lo activó desde
+        # la web (o el webhook llega repetido), no se toca nada.
         # Si estaba en 'cotizacion', pasa a 'pendiente' (ya se retuvo/pagó)
-        if trabajo.estado == 'cotizacion':
-            trabajo.estado = 'pendiente'
-            trabajo.metodo_pago = 'stripe'
-            trabajo.payment_intent_id = payment_intent.get('id')
+        if transicionar(
+            trabajo_id, 'cotizacion', 'pendiente',
+            metodo_pago='stripe', payment_intent_id=payment_intent.get('id')
+        ):
             db.session.commit()
             print(f"✅ Trabajo #{trabajo_id} activado tras pago exitoso.")
             return True
 
         # Si estaba en 'aprobado_cliente_stripe', significa que se capturó el pago final
-        if trabajo.estado == 'aprobado_cliente_stripe':
-            trabajo.estado = 'completado'
+        trabajo = transicionar(trabajo_id, 'aprobado_cliente_stripe', 'completado')
+        if trabajo:
             db.session.commit()
 
             # TRANSFERENCIA AL MONTADOR (Split Payment)
             # Solo si hay un montador asignado y tiene Stripe Connect
-            if trabajo.montador and trabajo.montador.stripe_account_id:
+            cuenta_montador = db.session.query(Montador.stripe_account_id).filter(
+                Montador.id == trabajo.montador_id
+            ).scalar() if trabajo.montador_id else None
+            if cuenta_montador:
                 try:
                     amount = payment_intent.get('amount') # Céntimos
                     # Kiq se queda el 10%, Montador el 90%
@@ -135,7 +137,7 @@ def handle_payment_intent_succeeded(payment_intent):
                     stripe.Transfer.create(
                         amount=amount_transfer,
                         currency='eur',
-                        destination=trabajo.montador.stripe_account_id,
+                        destination=cuenta_montador,
                         source_transaction=payment_intent.get('id'), # Transferir desde este pago
                         metadata={'trabajo_id': trabajo_id}
                     )
@@ -145,6 +147,9 @@ def handle_payment_intent_succeeded(payment_intent):
 
             return True
 
+        db.session.rollback()
+        print(f"⚠️ Trabajo {trabajo_id} no encontrado o ya procesado.")
+
     except Exception as e: # pylint: disable=broad-exception-caught
         print(f"❌ Error procesando pago trabajo {trabajo_id}: {e}")
         db.session.rollback()
@@ -0,0 +1,70 @@
+"""
+Zonas de los trabajos: se calculan UNA vez al guardar (no en cada petición).
+- zona: texto que se enseña al montador ("📍 Zona de Marbella").
+- zona_clave: forma normalizada (minúsculas, sin tildes) para filtrar por la
+  zona_servicio del montador con un índice.
+También normaliza 'desglose' si llega como texto JSON (datos legacy) y copia
+el enlace al Outlet de 'etiquetas' a columnas indexadas (tipo, outlet_product_id).
+"""
+import json
+import re
+import unicodedata
+
+from sqlalchemy import event
+
+from .models import Trabajo
+
+ZONA_POR_DEFECTO = "Málaga"
+
+
+def normalizar_zona(texto):
+    """'  Málaga ' -> 'malaga'."""
+    sin_tildes = unicodedata.normalize('NFKD', texto or '').encode('ascii', 'ignore').decode()
+    return re.sub(r'\s+', ' ', sin_tildes).strip().lower()
+
+
+def zona_de_direccion(direccion):
+    """Primer tramo de la dirección (mismo criterio que usaba el feed)."""
+    zona = (direccion or '').split(',')[0].strip()
+    return zona or ZONA_POR_DEFECTO
+
+
+def zonas_de_servicio(zona_servicio):
+    """'Málaga, Torremolinos / Benalmádena' -> ['malaga', 'torremolinos', 'benalmadena']."""
+    partes = re.split(r'[,;/]', zona_servicio or '')
+    return [clave for clave in (normalizar_zona(p) for p in partes) if clave]
+
+
+def datos_outlet(etiquetas):
+    """
+    etiquetas -> (tipo, outlet_product_id).
+    {'tipo': 'outlet', 'outlet_product_id': 7} -> ('outlet', 7); resto -> ('montaje', None)
+    """
+    if not isinstance(etiquetas, dict) or etiquetas.get('tipo') != 'outlet':
+        return 'montaje', None
+    try:
+        return 'outlet', int(etiquetas.get('outlet_product_id'))
+    except (TypeError, ValueError):
+        return 'outlet', None
+
+
+def _preparar_trabajo(_mapper, _connection, target):
+    """before_insert / before_update: precalcula zona, tipo y normaliza desglose."""
+    zona = zona_de_direccion(target.direccion)
+    if target.zona != zona:
+        target.zona = zona
+        target.zona_clave = normalizar_zona(zona)
+
+    if isinstance(target.desglose, str):
+        try:
+            target.desglose = json.loads(target.desglose)
+        except json.JSONDecodeError:
+            target.desglose = None
+
+    tipo, outlet_product_id = datos_outlet(target.etiquetas)
+    if (target.tipo, target.outlet_product_id) != (tipo, outlet_product_id):
+        target.tipo, target.outlet_product_id = tipo, outlet_product_id
+
+
+event.listen(Trabajo, 'before_insert', _preparar_trabajo)
+event.listen(Trabajo, 'before_update', _preparar_trabajo)
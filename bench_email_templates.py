@@ -0,0 +1,58 @@
+"""
+Micro-benchmark del renderizado de emails (plantillas Jinja2 precompiladas).
+Mide cuántos correos por segundo se generan con y sin la caché de render,
+sin enviar nada ni tocar la base de datos.
+Ejecutar con: python bench_email_templates.py
+"""
+import timeit
+from dotenv import load_dotenv
+
+load_dotenv()
+
+try:
+    from app import email_service
+except ImportError as exc:
+    print("❌ Error: No se encuentra el módulo 'app'.")
+    print("   Asegúrate de ejecutar este archivo desde la carpeta RAÍZ del proyecto.")
+    raise SystemExit(1) from exc
+
+REPETICIONES = 20000
+
+ITEMS = [
+    {"item": "Armario", "cantidad": 1},
+    {"item": "Canapé Abatible", "cantidad": 2},
+    {"item": "Mesita de Noche <script>", "cantidad": 2},
+]
+
+
+def render_sin_cache(i):
+    """Contexto distinto en cada llamada: siempre renderiza la plantilla."""
+    return email_service.renderizar_email(
+        'resumen_presupuesto.html',
+        nombre_cliente=f"Cliente {i}", precio=120 + i, items_resumen=ITEMS
+    )
+
+
+def render_con_cache():
+    """Mismo contexto (notificación masiva): sale de la caché."""
+    return email_service.renderizar_email(
+        'resumen_presupuesto.html',
+        nombre_cliente="Cliente", precio=120, items_resumen=ITEMS
+    )
+
+
+def medir(nombre, funcion):
+    """Ejecuta la función REPETICIONES veces y muestra el throughput."""
+    contador = iter(range(REPETICIONES))
+    segundos = timeit.timeit(lambda: funcion(next(contador)), number=REPETICIONES)
+    print(f"   {nombre:<28} {REPETICIONES / segundos:>12,.0f} emails/s")
+
+
+if __name__ == "__main__":
+    print(f"⏱️  Renderizando {REPETICIONES} emails por escenario...")
+    medir("Plantilla (sin caché)", render_sin_cache)
+    medir("Plantilla (caché caliente)", lambda _i: render_con_cache())
+    medir(
+        "Código de verificación",
+        lambda i: email_service.renderizar_email('codigo_verificacion.html', codigo=i)
+    )
@@ -0,0 +1,17 @@
+"""
+Configuración de Gunicorn (la carga sola desde la raíz del proyecto, para los
+dos procesos del Procfile).
+"""
+import os
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """
+    Crea el pool de hashing de contraseñas en cuanto arranca cada worker web.
+    El proceso 'sse' (gevent) no hashea: ahí no se crea.
+    """
+    if os.getenv('EVENTOS_PROCESO_SSE') == '1':
+        return
+    # Dentro del hook: el master de Gunicorn no debe importar la app
+    from app.password_service import iniciar_pool  # pylint: disable=import-outside-toplevel
+    iniciar_pool()
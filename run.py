@@ -9,8 +9,11 @@ from app import create_app
 # Esto es CRUCIAL para que create_app() encuentre la DATABASE_URL y claves.
 load_dotenv()
 
-# Llama a la función "fábrica" definida en app/__init__.py
-app = create_app()
+# Llama a la función "fábrica" definida en app/__init__.py.
+# Los procesos del pool de hashing (forkserver) reimportan este archivo como
+# '__mp_main__': solo necesitan werkzeug, no otra app.
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == '__main__':
     # Ejecuta la aplicación en modo desarrollo (solo si ejecutas python run.py)
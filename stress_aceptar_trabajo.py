@@ -0,0 +1,170 @@
+"""
+Prueba de estrés de la aceptación de trabajos (compare-and-set).
+N montadores (uno por hilo) intentan aceptar EL MISMO trabajo a la vez.
+Comprueba en cada ronda que:
+  - solo uno recibe 200 y el resto 400 ("Trabajo no disponible"),
+  - el trabajo queda asignado al ganador,
+  - solo se cobra UNA comisión de gemas (y a la wallet del ganador).
+Crea sus propios datos de prueba (emails @stress.kiq) y los borra al terminar.
+
+Ejecutar con (mejor contra un PostgreSQL de pruebas, NUNCA producción):
+    DATABASE_URL=postgresql://... python stress_aceptar_trabajo.py --hilos 32 --rondas 20
+Sin DATABASE_URL usa un SQLite temporal (serializa las escrituras: sirve para
+validar la lógica, no para medir contención real).
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ.setdefault('EMAIL_WORKER_EN_PROCESO', '0')
+if not os.getenv('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(), 'stress_aceptar.db'
+    )
+
+try:
+    from app import create_app, db
+    from app.models import Cliente, Montador, Trabajo, Wallet, GemTransaction
+    from app.token_service import emitir_tokens
+except ImportError as exc:
+    print("❌ Error: No se encuentra el módulo 'app'.")
+    print("   Asegúrate de ejecutar este archivo desde la carpeta RAÍZ del proyecto.")
+    raise SystemExit(1) from exc
+
+DOMINIO = '@stress.kiq'
+SALDO_INICIAL = 10000
+PRECIO = 100  # comisión = 100 * 0.10 * 10 = 100 gemas
+
+
+def crear_datos(hilos):
+    """Cliente + N montadores con wallet y un trabajo previo (sin primer trabajo gratis)."""
+    cliente = Cliente(nombre='Cliente Stress', email=f'cliente{DOMINIO}', password_hash='x')
+    db.session.add(cliente)
+    db.session.flush()
+
+    montadores = []
+    for i in range(hilos):
+        montador = Montador(
+            nombre=f'Montador Stress {i}', email=f'montador{i}{DOMINIO}', password_hash='x'
+        )
+        db.session.add(montador)
+        db.session.flush()
+        db.session.add(Wallet(montador_id=montador.id, saldo=SALDO_INICIAL))
+        db.session.add(Trabajo(
+            descripcion='Trabajo previo', direccion='Málaga', precio_calculado=PRECIO,
+            cliente_id=cliente.id, montador_id=montador.id, estado='completado'
+        ))
+        montadores.append(montador.id)
+    db.session.commit()
+    return cliente.id, montadores
+
+
+def borrar_datos(cliente_id, montadores):
+    """Elimina todo lo creado por la prueba."""
+    wallets = db.session.query(Wallet.id).filter(Wallet.montador_id.in_(montadores))
+    GemTransaction.query.filter(GemTransaction.wallet_id.in_(wallets)).delete(
+        synchronize_session=False
+    )
+    Wallet.query.filter(Wallet.montador_id.in_(montadores)).delete(synchronize_session=False)
+    for trabajo in Trabajo.query.filter_by(cliente_id=cliente_id).all():
+        db.session.delete(trabajo)
+    Montador.query.filter(Montador.id.in_(montadores)).delete(synchronize_session=False)
+    Cliente.query.filter_by(id=cliente_id).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def ronda(app, cliente_id, tokens):
+    """Crea un trabajo y lanza todos los hilos a la vez contra /aceptar."""
+    with app.app_context():
+        trabajo = Trabajo(
+            descripcion='Trabajo disputado', direccion='Málaga', precio_calculado=PRECIO,
+            cliente_id=cliente_id, estado='pendiente', metodo_pago='efectivo_gemas'
+        )
+        db.session.add(trabajo)
+        db.session.commit()
+        trabajo_id = trabajo.id
+
+    salida = threading.Barrier(len(tokens))
+    resultados = {}
+
+    def intentar(montador_id, token):
+        cliente = app.test_client()
+        salida.wait()
+        respuesta = cliente.post(
+            f'/api/montador/trabajo/{trabajo_id}/aceptar',
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        resultados[montador_id] = respuesta.status_code
+
+    hilos = [threading.Thread(target=intentar, args=par) for par in tokens.items()]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    ganadores = [m for m, codigo in resultados.items() if codigo == 200]
+    with app.app_context():
+        asignado = db.session.query(Trabajo.montador_id).filter_by(id=trabajo_id).scalar()
+        cobros = db.session.query(GemTransaction.wallet_id, Wallet.montador_id).join(
+            Wallet, Wallet.id == GemTransaction.wallet_id
+        ).filter(GemTransaction.trabajo_id == trabajo_id).all()
+
+    errores = []
+    if len(ganadores) != 1:
+        errores.append(f"{len(ganadores)} ganadores")
+    elif asignado != ganadores[0]:
+        errores.append(f"asignado a {asignado}, ganó {ganadores[0]}")
+    otros = set(resultados.values()) - {200, 400}
+    if otros:
+        errores.append(f"respuestas inesperadas {sorted(otros)}")
+    if len(cobros) != 1 or (ganadores and cobros[0][1] != ganadores[0]):
+        errores.append(f"{len(cobros)} cobros de comisión")
+    return Counter(resultados.values()), duracion, errores
+
+
+def main():
+    """Lanza las rondas y muestra el resumen."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--hilos', type=int, default=16)
+    parser.add_argument('--rondas', type=int, default=10)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        cliente_id, montadores = crear_datos(args.hilos)
+        tokens = {m: emitir_tokens(m, 'montador')[0] for m in montadores}
+
+    print(f"🔨 {args.rondas} rondas x {args.hilos} hilos contra el mismo trabajo")
+    fallos = 0
+    try:
+        for i in range(1, args.rondas + 1):
+            codigos, duracion, errores = ronda(app, cliente_id, tokens)
+            estado = '✅' if not errores else '❌ ' + ', '.join(errores)
+            print(f"   Ronda {i:3d} | {dict(codigos)} | {duracion * 1000:7.1f} ms | {estado}")
+            fallos += bool(errores)
+    finally:
+        with app.app_context():
+            saldo_total = db.session.query(db.func.sum(Wallet.saldo)).filter(
+                Wallet.montador_id.in_(montadores)
+            ).scalar()
+            esperado = SALDO_INICIAL * len(montadores) - args.rondas * PRECIO
+            print(f"💎 Saldo total: {saldo_total} (esperado {esperado})")
+            fallos += saldo_total != esperado
+            borrar_datos(cliente_id, montadores)
+
+    if fallos:
+        print(f"❌ {fallos} comprobaciones fallidas")
+        raise SystemExit(1)
+    print("✅ Sin dobles asignaciones ni dobles cobros.")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,7 @@ load_dotenv()
 
 # Intentamos importar
 try:
-    from app.email_service import enviar_email_generico
+    from app.email_service import enviar_email_inmediato
 except ImportError as exc:
     print("❌ Error: No se encuentra el módulo 'app'.")
     print("   Asegúrate de ejecutar este archivo desde la carpeta RAÍZ del proyecto.")
@@ -21,7 +21,7 @@ MI_CORREO = "fqvdo7@gmail.com"
 
 print(f"📧 Intentando enviar correo a: {MI_CORREO} ...")
 
-EXITO = enviar_email_generico(
+EXITO = enviar_email_inmediato(
     destinatario=MI_CORREO,
     asunto="🧪 Prueba de Sistema Kiq",
     contenido_html="""
@@ -0,0 +1,157 @@
+"""
+Verificación de consultas de /api/cliente/mis-trabajos (sin N+1).
+Cuenta las sentencias SQL que ejecuta cada petición para clientes con cada vez
+más trabajos (la mitad con montador asignado) y comprueba que el número NO crece:
+  - listado completo (primera página, sin ETag),
+  - sincronización incremental (?since=),
+  - paginación (?limite= + ?cursor=).
+Trabaja SIEMPRE sobre un SQLite temporal con sus propios datos de prueba
+(emails @consultas.kiq), que borra al terminar.
+
+Ejecutar con:
+    python verificar_consultas_mis_trabajos.py --tamanos 1 10 100
+"""
+import argparse
+import os
+import tempfile
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+load_dotenv()
+if os.getenv('DATABASE_URL', 'sqlite').split(':', 1)[0] != 'sqlite':
+    raise SystemExit("❌ DATABASE_URL no es SQLite: esta verificación solo usa una BD temporal.")
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+    tempfile.mkdtemp(), 'consultas_mis_trabajos.db'
+)
+os.environ.setdefault('EMAIL_WORKER_EN_PROCESO', '0')
+
+try:
+    from app import create_app, db
+    from app.models import Cliente, Montador, Trabajo
+    from app.token_service import emitir_tokens
+except ImportError as exc:
+    print("❌ Error: No se encuentra el módulo 'app'.")
+    print("   Asegúrate de ejecutar este archivo desde la carpeta RAÍZ del proyecto.")
+    raise SystemExit(1) from exc
+
+DOMINIO = '@consultas.kiq'
+
+
+def crear_datos(tamano):
+    """Un cliente con 'tamano' trabajos; los impares, con un montador distinto cada uno."""
+    cliente = Cliente(nombre='Cliente Consultas', email=f'cliente{tamano}{DOMINIO}',
+                      password_hash='x')
+    db.session.add(cliente)
+    db.session.flush()
+
+    montadores = []
+    for i in range(tamano):
+        montador_id = None
+        if i % 2:
+            montador = Montador(
+                nombre=f'Montador {i}', email=f'montador{tamano}-{i}{DOMINIO}',
+                password_hash='x', telefono='600000000', foto_url='https://x/foto.jpg'
+            )
+            db.session.add(montador)
+            db.session.flush()
+            montador_id = montador.id
+            montadores.append(montador_id)
+        db.session.add(Trabajo(
+            descripcion=f'Trabajo {i}', direccion='Málaga', precio_calculado=100,
+            cliente_id=cliente.id, montador_id=montador_id,
+            estado='aceptado' if montador_id else 'cotizacion',
+            desglose={'muebles_cotizados': [{'item': 'Armario', 'cantidad': 1}]}
+        ))
+    db.session.commit()
+    return cliente.id, montadores
+
+
+def borrar_datos(cliente_id, montadores):
+    """Elimina todo lo creado por la prueba (por el ORM: limpia también 'identidad')."""
+    for trabajo in Trabajo.query.filter_by(cliente_id=cliente_id).all():
+        db.session.delete(trabajo)
+    db.session.flush()
+    for usuario in Montador.query.filter(Montador.id.in_(montadores)).all() + \
+            [db.session.get(Cliente, cliente_id)]:
+        db.session.delete(usuario)
+    db.session.commit()
+
+
+def contar_consultas(app, url, token):
+    """(status, nº de sentencias SQL, respuesta) de un GET."""
+    sentencias = []
+
+    def contar(_conn, _cursor, sentencia, *_args):
+        sentencias.append(sentencia)
+
+    with app.app_context():
+        motor = db.engine
+    event.listen(motor, 'before_cursor_execute', contar)
+    try:
+        respuesta = app.test_client().get(url, headers={'Authorization': f'Bearer {token}'})
+    finally:
+        event.remove(motor, 'before_cursor_execute', contar)
+    return respuesta.status_code, len(sentencias), respuesta
+
+
+def medir(app, tamano):
+    """Sentencias por escenario para un cliente con 'tamano' trabajos."""
+    with app.app_context():
+        cliente_id, montadores = crear_datos(tamano)
+        token = emitir_tokens(cliente_id, 'cliente')[0]
+
+    try:
+        medidas = {}
+        codigo, total, respuesta = contar_consultas(app, '/api/cliente/mis-trabajos', token)
+        con_montador = sum(1 for t in respuesta.get_json() if t['montador_info'])
+        if codigo != 200 or len(respuesta.get_json()) != min(tamano, 100) or \
+                con_montador != min(tamano, 100) // 2:
+            raise SystemExit(f"❌ Listado incorrecto ({codigo}) con {tamano} trabajos")
+        medidas['listado'] = total
+
+        cursor = respuesta.headers['X-Sync-Cursor']
+        codigo, total, _ = contar_consultas(
+            app, f'/api/cliente/mis-trabajos?since={cursor}', token
+        )
+        medidas['since'] = total if codigo == 200 else f'HTTP {codigo}'
+
+        codigo, total, respuesta = contar_consultas(
+            app, '/api/cliente/mis-trabajos?limite=1', token
+        )
+        siguiente = respuesta.headers.get('X-Next-Cursor')
+        if siguiente:
+            codigo, total, _ = contar_consultas(
+                app, f'/api/cliente/mis-trabajos?limite=1&cursor={siguiente}', token
+            )
+        medidas['pagina'] = total if codigo == 200 else f'HTTP {codigo}'
+        return medidas
+    finally:
+        with app.app_context():
+            borrar_datos(cliente_id, montadores)
+
+
+def main():
+    """Mide cada tamaño y compara con el más pequeño."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--tamanos', type=int, nargs='+', default=[1, 10, 100])
+    args = parser.parse_args()
+
+    app = create_app()
+    resultados = {tamano: medir(app, tamano) for tamano in sorted(args.tamanos)}
+
+    referencia = resultados[min(resultados)]
+    fallos = 0
+    for tamano, medidas in resultados.items():
+        distinto = medidas != referencia
+        fallos += distinto
+        print(f"   {tamano:5d} trabajos | sentencias {medidas} | {'❌' if distinto else '✅'}")
+
+    if fallos:
+        print("❌ El número de consultas crece con los trabajos del cliente (N+1).")
+        raise SystemExit(1)
+    print("✅ Número de consultas constante.")
+
+
+if __name__ == '__main__':
+    main()
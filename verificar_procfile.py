@@ -0,0 +1,114 @@
+"""
+Prueba de arranque de los procesos del Procfile ('web' y 'sse').
+Arranca cada rol en un subproceso con SUS variables de entorno y carga su
+aplicación WSGI tal y como lo haría Gunicorn (modulo:atributo). Comprueba que:
+  - el objetivo de cada rol carga (control: sin las variables de eventos),
+  - sin Redis, NINGÚN rol arranca (el backend local dejaría a 'sse' sin los
+    eventos que publica 'web'),
+  - con un Redis inalcanzable, tampoco,
+  - con --redis-url (un Redis de pruebas), arrancan todos.
+Usa un SQLite temporal; no toca la base de datos configurada.
+
+Ejecutar con:
+    python verificar_procfile.py [--redis-url redis://localhost:6379/15]
+"""
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+REDIS_INALCANZABLE = 'redis://127.0.0.1:1/0'
+VARIABLES_EVENTOS = ('EVENTOS_SSE_SEPARADO', 'EVENTOS_PROCESO_SSE')
+ERROR_BACKEND = 'Eventos en tiempo real con varios procesos'
+CARGAR_APP = (
+    "import importlib, sys; modulo, atributo = sys.argv[1].split(':'); "
+    "getattr(importlib.import_module(modulo), atributo)"
+)
+
+
+def leer_procfile():
+    """{rol: (variables de entorno, 'modulo:atributo')} de cada línea del Procfile."""
+    roles = {}
+    with open(os.path.join(RAIZ, 'Procfile'), encoding='utf-8') as procfile:
+        for linea in procfile:
+            if ':' not in linea:
+                continue
+            rol, comando = linea.split(':', 1)
+            partes = shlex.split(comando)
+            entorno = {}
+            while partes and '=' in partes[0]:
+                clave, valor = partes.pop(0).split('=', 1)
+                entorno[clave] = valor
+            if not partes or partes[0] != 'gunicorn':
+                raise SystemExit(f"❌ Rol '{rol}': se esperaba un comando gunicorn")
+            objetivo = next(p for p in partes[1:] if not p.startswith('-') and ':' in p)
+            roles[rol.strip()] = (entorno, objetivo)
+    return roles
+
+
+def arrancar(entorno_rol, objetivo, redis_url, control=False):
+    """
+    (arrancó, última línea de salida) del rol con ese Redis (o sin Redis).
+    control=True quita las variables de eventos del rol (un único proceso).
+    """
+    entorno = {
+        clave: valor for clave, valor in os.environ.items()
+        if clave not in ('EVENTOS_BACKEND', 'REDIS_URL', 'WEB_CONCURRENCY')
+    }
+    entorno.update({
+        clave: valor for clave, valor in entorno_rol.items()
+        if not (control and clave in VARIABLES_EVENTOS)
+    })
+    entorno['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'arranque.db')
+    entorno['EMAIL_WORKER_EN_PROCESO'] = '0'
+    if redis_url:
+        entorno.update(EVENTOS_BACKEND='redis', REDIS_URL=redis_url)
+
+    proceso = subprocess.run(
+        [sys.executable, '-c', CARGAR_APP, objetivo], cwd=RAIZ, env=entorno,
+        capture_output=True, text=True, timeout=120, check=False
+    )
+    salida = (proceso.stderr or proceso.stdout).strip().splitlines()
+    return proceso.returncode == 0, salida[-1] if salida else ''
+
+
+def main():
+    """Arranca cada rol en cada escenario y sale con código 1 si algo no cuadra."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--redis-url', help='Redis de pruebas para el escenario con Redis')
+    args = parser.parse_args()
+
+    escenarios = [
+        ('control', None, True),
+        ('sin Redis', None, False),
+        ('Redis inalcanzable', REDIS_INALCANZABLE, False)
+    ]
+    if args.redis_url:
+        escenarios.append(('con Redis', args.redis_url, True))
+    else:
+        print("ℹ️ Sin --redis-url: no se prueba el arranque con Redis.")
+
+    fallos = 0
+    for rol, (entorno_rol, objetivo) in leer_procfile().items():
+        for nombre, redis_url, debe_arrancar in escenarios:
+            arranco, ultima = arrancar(
+                entorno_rol, objetivo, redis_url, control=nombre == 'control'
+            )
+            # Si no arranca, debe ser por el backend de eventos y no por otro error
+            correcto = arranco if debe_arrancar else (not arranco and ERROR_BACKEND in ultima)
+            fallos += not correcto
+            estado = 'arranca' if arranco else 'no arranca'
+            print(f"   {'✅' if correcto else '❌'} {rol:4s} | {nombre:18s} | {estado}")
+            if not correcto:
+                print(f"      {ultima}")
+
+    if fallos:
+        raise SystemExit(1)
+    print("✅ Los procesos del Procfile exigen el mismo backend de eventos.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Verificación de la sincronización incremental (?since=) tras cambios de estado.
+Los cambios de estado son UPDATE directos (app/trabajo_estados.py) que no pasan
+por los eventos del ORM; comprueba que aun así el delta los recoge:
+  - cliente: el trabajo cancelado y el aceptado llegan en 'trabajos',
+  - montador: el trabajo aceptado entra en su lista,
+  - montador: si la transición le quita el trabajo, llega en 'eliminados'.
+Trabaja SIEMPRE sobre un SQLite temporal (crea y borra sus propios datos).
+
+Ejecutar con:
+    python verificar_sync_transiciones.py
+"""
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+load_dotenv()
+if os.getenv('DATABASE_URL', 'sqlite').split(':', 1)[0] != 'sqlite':
+    raise SystemExit("❌ DATABASE_URL no es SQLite: esta verificación solo usa una BD temporal.")
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+    tempfile.mkdtemp(), 'sync_transiciones.db'
+)
+os.environ['EMAIL_WORKER_EN_PROCESO'] = '0'
+# Sin margen en el cursor: si no, cualquier cambio reciente saldría "por casualidad"
+os.environ['SYNC_MARGEN_SEGUNDOS'] = '0'
+
+try:
+    from app import create_app, db
+    from app.models import Cliente, Montador, Trabajo, Wallet
+    from app.token_service import emitir_tokens
+    from app.trabajo_estados import transicionar
+except ImportError as exc:
+    print("❌ Error: No se encuentra el módulo 'app'.")
+    print("   Asegúrate de ejecutar este archivo desde la carpeta RAÍZ del proyecto.")
+    raise SystemExit(1) from exc
+
+
+def crear_datos():
+    """Un cliente con dos presupuestos y un montador que puede aceptar trabajos."""
+    cliente = Cliente(nombre='Cliente Sync', email='cliente@sync.kiq', password_hash='x')
+    montador = Montador(
+        nombre='Montador Sync', email='montador@sync.kiq', password_hash='x',
+        stripe_account_id='acct_sync'
+    )
+    db.session.add_all([cliente, montador])
+    db.session.flush()
+    db.session.add(Wallet(montador_id=montador.id, saldo=1000))
+    trabajos = [
+        Trabajo(descripcion=f'Trabajo {i}', direccion='Málaga', precio_calculado=100,
+                cliente_id=cliente.id, estado='cotizacion')
+        for i in range(2)
+    ]
+    db.session.add_all(trabajos)
+    db.session.commit()
+    return cliente.id, montador.id, [t.id for t in trabajos]
+
+
+def envejecer_trabajos():
+    """Lleva updated_at al pasado: solo lo que cambie DESPUÉS del cursor debe salir."""
+    tabla = Trabajo.__table__
+    db.session.execute(tabla.update().values(
+        updated_at=datetime.utcnow() - timedelta(hours=1)
+    ))
+    db.session.commit()
+
+
+def main():
+    """Ejecuta los tres escenarios y sale con código 1 si alguno falla."""
+    app = create_app()
+    cliente = app.test_client()
+
+    with app.app_context():
+        cliente_id, montador_id, (cancelado, aceptado) = crear_datos()
+        cabecera_c = {'Authorization': f"Bearer {emitir_tokens(cliente_id, 'cliente')[0]}"}
+        cabecera_m = {'Authorization': f"Bearer {emitir_tokens(montador_id, 'montador')[0]}"}
+
+    cliente.post(f'/api/cliente/trabajo/{aceptado}/pagar-con-gemas', headers=cabecera_c)
+    with app.app_context():
+        envejecer_trabajos()
+
+    cursor_c = cliente.get(
+        '/api/cliente/mis-trabajos', headers=cabecera_c
+    ).headers['X-Sync-Cursor']
+    cursor_m = cliente.get(
+        '/api/montador/mis-trabajos', headers=cabecera_m
+    ).headers['X-Sync-Cursor']
+
+    codigos = (
+        cliente.post(f'/api/cliente/trabajo/{cancelado}/cancelar', headers=cabecera_c).status_code,
+        cliente.post(f'/api/montador/trabajo/{aceptado}/aceptar', headers=cabecera_m).status_code
+    )
+    if codigos != (200, 200):
+        raise SystemExit(f"❌ cancelar/aceptar respondieron {codigos}")
+
+    delta_c = cliente.get(f'/api/cliente/mis-trabajos?since={cursor_c}', headers=cabecera_c).json
+    delta_m = cliente.get(f'/api/montador/mis-trabajos?since={cursor_m}', headers=cabecera_m).json
+    cursor_m = delta_m['cursor']
+
+    # Una transición que quita el montador (ningún endpoint lo hace aún)
+    with app.app_context():
+        transicionar(aceptado, 'aceptado', 'cancelado', montador_id=None)
+        db.session.commit()
+    baja_m = cliente.get(f'/api/montador/mis-trabajos?since={cursor_m}', headers=cabecera_m).json
+
+    comprobaciones = {
+        'cliente ve cancelar y aceptar': sorted(
+            (t['trabajo_id'], t['estado']) for t in delta_c['trabajos']
+        ) == sorted([(cancelado, 'cancelado'), (aceptado, 'aceptado')]),
+        'montador ve el trabajo aceptado': [
+            t['trabajo_id'] for t in delta_m['trabajos']
+        ] == [aceptado],
+        'montador recibe la baja': baja_m['eliminados'] == [aceptado] and not baja_m['trabajos'],
+    }
+    for nombre, correcto in comprobaciones.items():
+        print(f"   {'✅' if correcto else '❌'} {nombre}")
+    if not all(comprobaciones.values()):
+        raise SystemExit(1)
+    print("✅ La sincronización incremental recoge los cambios de estado.")
+
+
+if __name__ == '__main__':
+    main()